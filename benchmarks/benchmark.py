@@ -0,0 +1,479 @@
+# coding=utf-8
+"""
+CPU benchmarks of grafica, running without a display or OpenGL context.
+
+Every case is measured at several sizes, reporting the best time of some repetitions,
+the throughput in items per second and the peak memory allocated by a single run.
+
+    python benchmarks/benchmark.py                          # run everything
+    python benchmarks/benchmark.py --filter scene_graph     # only matching cases
+    python benchmarks/benchmark.py --save baseline.json     # store a baseline
+    python benchmarks/benchmark.py --compare baseline.json  # fail on regressions
+
+Cases whose dependencies are missing (e.g. glfw for sira) are reported as skipped.
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+rootPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(rootPath)
+sys.path.append(os.path.join(rootPath, "examples"))
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+class BenchmarkCase:
+    def __init__(self, name, setup, sizes):
+        self.name = name
+        self.setup = setup
+        self.sizes = sizes
+
+
+cases = []
+
+
+def benchmark(name, sizes):
+    """
+    Registers a benchmark. The decorated function receives a size, does any preparation
+    and returns the function to be timed, which processes 'size' items.
+    Setups needing cleanup (e.g. temporary files) may instead be generators yielding that
+    function once, they are resumed after the measurements.
+    """
+    def register(setup):
+        cases.append(BenchmarkCase(name, setup, sizes))
+        return setup
+    return register
+
+
+# Helpers
+
+def createTree(size, branching=4):
+    """Scene graph with 'size' nodes, each of them with a small translation"""
+    import grafica.scene_graph as sg
+    import grafica.transformations as tr
+
+    root = sg.SceneGraphNode("node_0")
+    nodes = [root]
+    for i in range(1, size):
+        node = sg.SceneGraphNode("node_" + str(i))
+        node.transform = tr.translate(0.01 * i, 0, 0)
+        nodes[(i - 1) // branching].childs += [node]
+        nodes.append(node)
+    return root
+
+
+def writeGridOBJ(filename, size):
+    """Writes a square grid with about 'size' triangles, including normals"""
+    side = max(1, int(np.sqrt(size / 2)))
+    with open(filename, "w") as file:
+        for j in range(side + 1):
+            for i in range(side + 1):
+                file.write("v %f %f 0.0\n" % (i, j))
+        file.write("vn 0.0 0.0 1.0\n")
+        for j in range(side):
+            for i in range(side):
+                a = j * (side + 1) + i + 1
+                b = a + 1
+                c = a + side + 2
+                d = a + side + 1
+                file.write("f %d//1 %d//1 %d//1 %d//1\n" % (a, b, c, d))
+
+
+# grafica.transformations
+
+@benchmark("transformations.translate_scalar", sizes=(1000, 10000))
+def benchTranslateScalar(size):
+    import grafica.transformations as tr
+    values = np.random.rand(size).tolist()
+
+    def run():
+        for value in values:
+            tr.translate(value, value, 0)
+    return run
+
+
+@benchmark("transformations.translate_out", sizes=(1000, 10000))
+def benchTranslateOut(size):
+    import grafica.transformations as tr
+    values = np.random.rand(size).tolist()
+    out = tr.identity()
+
+    def run():
+        for value in values:
+            tr.translate(value, value, 0, out=out)
+    return run
+
+
+@benchmark("transformations.rotationA_batch", sizes=(10000, 100000))
+def benchRotationABatch(size):
+    import grafica.transformations as tr
+    thetas = np.random.rand(size)
+    axes = np.random.rand(size, 3)
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    return lambda: tr.rotationA(thetas, axes)
+
+
+@benchmark("transformations.matmul_batch", sizes=(10000, 100000))
+def benchMatmulBatch(size):
+    import grafica.transformations as tr
+    values = np.random.rand(size)
+    translations = tr.translate(values, values, 0)
+    rotations = tr.rotationZ(values)
+    scales = tr.uniformScale(values + 0.5)
+    return lambda: tr.matmul([translations, rotations, scales])
+
+
+@benchmark("transformations.affineInverse_batch", sizes=(10000, 100000))
+def benchAffineInverse(size):
+    import grafica.transformations as tr
+    values = np.random.rand(size)
+    matrices = tr.matmul([tr.translate(values, values, 0), tr.rotationZ(values), tr.uniformScale(values + 0.5)])
+
+    # Closed form inverses must agree with numpy, also when overwriting their input
+    expected = np.linalg.inv(matrices)
+    error = np.abs(tr.affineInverse(matrices) - expected).max()
+    assert error < 1e-4, "affineInverse differs from np.linalg.inv by " + str(error)
+    inverses = matrices.copy()
+    error = np.abs(tr.affineInverse(inverses, out=inverses) - expected).max()
+    assert error < 1e-4, "affineInverse with out=matrices differs from np.linalg.inv by " + str(error)
+    rigid = tr.matmul([tr.translate(values, values, 0), tr.rotationZ(values)])
+    expected = np.linalg.inv(rigid)
+    error = np.abs(tr.rigidInverse(rigid, out=rigid) - expected).max()
+    assert error < 1e-4, "rigidInverse with out=matrices differs from np.linalg.inv by " + str(error)
+    return lambda: tr.affineInverse(matrices)
+
+
+# grafica.quaternions
+
+@benchmark("quaternions.fromMatrix", sizes=(10000, 100000))
+def benchQuaternionFromMatrix(size):
+    import grafica.quaternions as qt
+    axes = np.random.randn(size, 3)
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    # Half of the rotations are close to half turns, where w vanishes
+    thetas = np.where(np.arange(size) % 2 == 0, np.pi - np.random.rand(size) * 1e-3, np.random.rand(size) * np.pi)
+    matrices = qt.toMatrix(qt.fromAxisAngle(axes, thetas))
+
+    # Round trips must give back the same rotations
+    error = np.abs(qt.toMatrix(qt.fromMatrix(matrices)) - matrices).max()
+    assert error < 1e-5, "fromMatrix does not invert toMatrix, error " + str(error)
+    halfTurn = np.array([[0, -1, 0], [-1, 0, 0], [0, 0, -1]], dtype=np.float32)
+    error = np.abs(qt.toMatrix(qt.fromMatrix(halfTurn))[:3, :3] - halfTurn).max()
+    assert error < 1e-5, "fromMatrix fails on half turns, error " + str(error)
+    return lambda: qt.fromMatrix(matrices)
+
+
+# grafica.scene_graph
+
+@benchmark("scene_graph.findNode", sizes=(1000, 10000))
+def benchFindNode(size):
+    import grafica.scene_graph as sg
+    root = createTree(size)
+    name = "node_" + str(size - 1)
+    return lambda: sg.findNode(root, name)
+
+
+@benchmark("scene_graph.findTransform", sizes=(1000, 10000))
+def benchFindTransform(size):
+    import grafica.scene_graph as sg
+    root = createTree(size)
+    name = "node_" + str(size - 1)
+    return lambda: sg.findTransform(root, name)
+
+
+@benchmark("scene_graph.RenderList.update", sizes=(1000, 10000, 100000))
+def benchRenderListUpdate(size):
+    import grafica.scene_graph as sg
+    root = createTree(size)
+    # Without GPUShapes there are no draw batches, so no OpenGL context is required
+    renderList = sg.RenderList(root, None, "transform")
+    renderList.update()
+    return renderList.update
+
+
+# grafica.basic_shapes
+
+@benchmark("basic_shapes.createRainbowCircle", sizes=(1000, 10000))
+def benchCreateCircle(size):
+    import grafica.basic_shapes as bs
+    return lambda: bs.createRainbowCircle(size)
+
+
+@benchmark("basic_shapes.merge", sizes=(100, 1000))
+def benchMerge(size):
+    import grafica.basic_shapes as bs
+    cubes = [bs.createColorNormalsCube(1, 0, 0) for i in range(size)]
+
+    def run():
+        shape = bs.Shape([], [])
+        for cube in cubes:
+            bs.merge(shape, 9, cube)
+    return run
+
+
+# grafica.text_renderer
+
+@benchmark("text_renderer.textToShape", sizes=(100, 1000))
+def benchTextToShape(size):
+    import grafica.text_renderer as tx
+    text = ("grafica " * (size // 8 + 1))[:size]
+    return lambda: tx.textToShape(text, 0.1, 0.2)
+
+
+# grafica.triangle_mesh
+
+@benchmark("triangle_mesh.TriangleFaceMeshBuilder", sizes=(1000, 10000))
+def benchTriangleMeshBuilder(size):
+    import grafica.triangle_mesh as tm
+    side = max(1, int(np.sqrt(size / 2)))
+    triangles = []
+    for j in range(side):
+        for i in range(side):
+            a = j * (side + 1) + i
+            b = a + 1
+            c = a + side + 2
+            d = a + side + 1
+            triangles += [tm.Triangle(a, b, c), tm.Triangle(c, d, a)]
+
+    def run():
+        builder = tm.TriangleFaceMeshBuilder()
+        for triangle in triangles:
+            builder.addTriangle(triangle)
+    return run
+
+
+# grafica.strips
+
+@benchmark("strips.stripify", sizes=(10000, 100000))
+def benchStripify(size):
+    import grafica.strips as st
+    side = max(1, int(np.sqrt(size / 2)))
+    triangles = st.unstripify(st.gridStrips(side, side))
+    return lambda: st.stripify(triangles)
+
+
+# OBJ readers, the one of the examples and grafica.obj_reader
+
+@benchmark("obj.readOBJ", sizes=(1000, 10000))
+def benchReadOBJ(size):
+    from ex_obj_reader import readOBJ
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "grid.obj")
+        writeGridOBJ(filename, size)
+        yield lambda: readOBJ(filename, (1.0, 0.0, 0.0))
+
+
+@benchmark("obj_reader.loadOBJ", sizes=(1000, 10000, 100000))
+def benchLoadOBJ(size):
+    import grafica.obj_reader as obr
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "grid.obj")
+        writeGridOBJ(filename, size)
+        yield lambda: obr.loadOBJ(filename)
+
+
+@benchmark("mesh_cache.readMesh", sizes=(1000, 10000, 100000))
+def benchReadMesh(size):
+    import grafica.mesh_cache as mc
+    import grafica.obj_reader as obr
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "grid.obj")
+        writeGridOBJ(filename, size)
+        cache = mc.MeshCache(directory)
+        obr.readOBJ(filename, (1.0, 0.0, 0.0), cache)
+
+        # Reading every byte, as glBufferData does
+        def run():
+            shape = obr.readOBJ(filename, (1.0, 0.0, 0.0), cache)
+            np.sum(shape.vertices)
+            np.sum(shape.indices)
+        yield run
+
+
+# grafica.simplification
+
+@benchmark("simplification.lodChain", sizes=(968,))
+def benchLodChain(size):
+    import grafica.obj_reader as obr
+    import grafica.simplification as sm
+    # suzanne.obj has 968 triangles, split at texture and normal seams by the reader
+    mesh = obr.loadOBJ(os.path.join(rootPath, "assets", "suzanne.obj"))
+    attributes = np.hstack((mesh.texCoords, mesh.normals))
+    ratios = (0.5, 0.25, 0.125)
+
+    def run():
+        return sm.lodChain(mesh.positions, mesh.triangles, ratios,
+            positionIndices=mesh.positionIndices, attributes=attributes)
+
+    # Split vertices must not stop the simplification
+    levels = run()
+    for ratio, level in zip(ratios, levels[1:]):
+        assert len(level) <= int(ratio * size), "suzanne.obj was not simplified to " + str(ratio) + \
+            ", " + str(len(level)) + " triangles remain."
+    return run
+
+
+# grafica.texture_atlas
+
+@benchmark("texture_atlas.build", sizes=(100, 1000))
+def benchAtlasBuild(size):
+    import grafica.texture_atlas as ta
+    atlas = ta.TextureAtlas()
+    for i in range(size):
+        height, width = np.random.randint(8, 64, 2)
+        atlas.addImage(i, np.zeros((height, width, 4), dtype=np.uint8))
+    return atlas.build
+
+
+# grafica.texture_compression
+
+@benchmark("texture_compression.compressBC1", sizes=(256, 1024))
+def benchCompressBC1(size):
+    import grafica.texture_compression as tc
+    image = np.random.randint(0, 255, (size, size, 3)).astype(np.uint8)
+    return lambda: tc.compressBC1(image)
+
+
+# sira
+
+@benchmark("sira.IndirectRGBRasterDisplay.setMatrix", sizes=(64, 256))
+def benchSiraSetMatrix(size):
+    import sira
+    display = sira.IndirectRGBRasterDisplay((size, size), (size, size), "benchmark")
+    display.setColorPalette(np.random.randint(0, 255, (4, 3)).astype(np.uint8))
+    matrix = np.random.randint(0, 4, (size, size)).astype(np.uint8)
+    return lambda: display.setMatrix(matrix)
+
+
+# Runner
+
+def measure(case, size, repeat):
+    setup = case.setup(size)
+    if inspect.isgenerator(setup):
+        try:
+            return measureRun(case, size, repeat, next(setup))
+        finally:
+            setup.close()
+    return measureRun(case, size, repeat, setup)
+
+
+def measureRun(case, size, repeat, run):
+
+    # A first call warms up caches and lazy imports
+    run()
+
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(times)
+    return {
+        "name": case.name,
+        "size": size,
+        "seconds": seconds,
+        "throughput": size / seconds if seconds > 0 else float("inf"),
+        "peakMemory": peakMemory
+    }
+
+
+def resultKey(result):
+    return result["name"] + "[" + str(result["size"]) + "]"
+
+
+def formatBytes(value):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if value < 1024:
+            return "%.1f %s" % (value, unit)
+        value /= 1024
+    return "%.1f TB" % value
+
+
+def runBenchmarks(nameFilter=None, repeat=5, quick=False, baseline=None, tolerance=0.2):
+    """Runs the benchmarks, printing a line per result. Returns (results, regressions)"""
+    results = []
+    regressions = []
+
+    print("%-48s %12s %16s %12s %10s" % ("benchmark", "time", "items/s", "memory", "baseline"))
+    for case in cases:
+        if nameFilter is not None and nameFilter not in case.name:
+            continue
+
+        sizes = case.sizes[:1] if quick else case.sizes
+        for size in sizes:
+            try:
+                result = measure(case, size, repeat)
+            except ImportError as error:
+                print("%-48s skipped: %s" % (case.name + "[" + str(size) + "]", error))
+                break
+
+            comparison = ""
+            if baseline is not None and resultKey(result) in baseline:
+                ratio = result["seconds"] / baseline[resultKey(result)]["seconds"]
+                comparison = "%.2fx" % ratio
+                if ratio > 1 + tolerance:
+                    comparison += " SLOWER"
+                    regressions.append((resultKey(result), ratio))
+
+            print("%-48s %10.3fms %16.0f %12s %10s" % (resultKey(result), 1000 * result["seconds"],
+                result["throughput"], formatBytes(result["peakMemory"]), comparison))
+            results.append(result)
+
+    return results, regressions
+
+
+def saveResults(filename, results):
+    data = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": {resultKey(result): result for result in results}
+    }
+    with open(filename, "w") as file:
+        json.dump(data, file, indent=4)
+
+
+def loadBaseline(filename):
+    with open(filename) as file:
+        return json.load(file)["results"]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="CPU benchmarks of grafica")
+    parser.add_argument("--filter", help="run only benchmarks containing this text")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of every benchmark, the best one is reported")
+    parser.add_argument("--quick", action="store_true", help="run only the smallest size of every benchmark")
+    parser.add_argument("--save", help="store the results as a JSON baseline")
+    parser.add_argument("--compare", help="compare against a JSON baseline, failing on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before reporting a regression")
+    args = parser.parse_args()
+
+    baseline = loadBaseline(args.compare) if args.compare else None
+    results, regressions = runBenchmarks(args.filter, args.repeat, args.quick, baseline, args.tolerance)
+
+    if args.save:
+        saveResults(args.save, results)
+        print("Results saved to", args.save)
+
+    if len(regressions) > 0:
+        print("\n%d regressions over %d%%:" % (len(regressions), 100 * args.tolerance))
+        for key, ratio in regressions:
+            print("  %s is %.2fx slower" % (key, ratio))
+        sys.exit(1)
@@ -12,6 +12,7 @@ import grafica.transformations as tr
 import grafica.basic_shapes as bs
 import grafica.easy_shaders as es
 import grafica.lighting_shaders as ls
+from grafica.camera import Camera
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -140,6 +141,9 @@ if __name__ == "__main__":
     t0 = glfw.get_time()
     camera_theta = np.pi/4
 
+    # The projection is computed once, the view only when the camera moves
+    camera = Camera(at=[0,0,0], up=[0,0,1], fovy=45, aspect=float(width)/float(height), near=0.1, far=100)
+
     while not glfw.window_should_close(window):
 
         # Using GLFW to check for input events
@@ -156,19 +160,13 @@ if __name__ == "__main__":
         if (glfw.get_key(window, glfw.KEY_RIGHT) == glfw.PRESS):
             camera_theta += 2* dt
 
-        projection = tr.ortho(-1, 1, -1, 1, 0.1, 100)
-        projection = tr.perspective(45, float(width)/float(height), 0.1, 100)
-
         camX = 3 * np.sin(camera_theta)
         camY = 3 * np.cos(camera_theta)
 
-        viewPos = np.array([camX,camY,2])
-
-        view = tr.lookAt(
-            viewPos,
-            np.array([0,0,0]),
-            np.array([0,0,1])
-        )
+        camera.eye = [camX, camY, 2]
+        viewPos = camera.eye
+        projection = camera.projection
+        view = camera.view
 
         rotation_theta = glfw.get_time()
 
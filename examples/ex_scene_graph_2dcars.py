@@ -132,6 +132,16 @@ if __name__ == "__main__":
     # Our shapes here are always fully painted
     glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
 
+    # The scene graph is compiled into a flat list of draw calls,
+    # it is traversed again only if nodes are added or removed.
+    # Wheels and chasis shared by all cars are drawn as instances, with one draw call each
+    instancedPipeline = es.SimpleInstancedTransformShaderProgram()
+    renderList = sg.RenderList(cars, pipeline, "transform", {pipeline: instancedPipeline})
+
+    # Nodes to be modified on each frame
+    wheelRotationNode = sg.findNode(cars, "wheelRotation")
+    car3 = sg.findNode(cars, "scaledCar3")
+
     while not glfw.window_should_close(window):
         # Using GLFW to check for input events
         glfw.poll_events()
@@ -140,24 +150,24 @@ if __name__ == "__main__":
         glClear(GL_COLOR_BUFFER_BIT)
 
         # Modifying only a specific node in the scene graph
-        wheelRotationNode = sg.findNode(cars, "wheelRotation")
         theta = -10 * glfw.get_time()
         wheelRotationNode.transform = tr.rotationZ(theta)
 
         # Modifying only car 3
-        car3 = sg.findNode(cars, "scaledCar3")
         car3.transform = tr.translate(0.3, 0.5 * np.sin(0.1 * theta), 0)
 
         # Uncomment to see the position of scaledCar_3, it will fill your terminal
         #print("car3Position =", sg.findPosition(cars, "scaledCar3"))
 
         # Drawing the Car
-        sg.drawSceneGraphNode(cars, pipeline, "transform")
+        renderList.update()
+        renderList.draw()
 
         # Once the render is done, buffers are swapped, showing only the complete scene.
         glfw.swap_buffers(window)
 
     # freeing GPU memory
+    renderList.clear()
     cars.clear()
     
     glfw.terminate()
\ No newline at end of file
@@ -13,6 +13,7 @@ import grafica.basic_shapes as bs
 import grafica.scene_graph as sg
 import grafica.easy_shaders as es
 import grafica.performance_monitor as pm
+import grafica.bounding_volumes as bv
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -147,6 +148,10 @@ if __name__ == "__main__":
             np.array([0,0,1])
         )
     glUniformMatrix4fv(glGetUniformLocation(mvpPipeline.shaderProgram, "view"), 1, GL_TRUE, view)
+
+    # Frustum planes in world coordinates, nodes outside them are not drawn
+    frustum = bv.frustumPlanes(projection, view)
+    cullingStats = sg.CullingStats()
     
     perfMonitor = pm.PerformanceMonitor(glfw.get_time(), 0.5)
 
@@ -157,7 +162,8 @@ if __name__ == "__main__":
 
         # Measuring performance
         perfMonitor.update(glfw.get_time())
-        glfw.set_window_title(window, title + str(perfMonitor))
+        glfw.set_window_title(window, title + str(perfMonitor) + str(cullingStats))
+        cullingStats.reset()
 
         # Using GLFW to check for input events
         glfw.poll_events()
@@ -184,8 +190,8 @@ if __name__ == "__main__":
         #print(sg.findPosition(redCarNode, "car"))
 
         # Drawing the Car
-        sg.drawSceneGraphNode(redCarNode, mvpPipeline, "model")
-        sg.drawSceneGraphNode(blueCarNode, mvpPipeline, "model")
+        sg.drawSceneGraphNode(redCarNode, mvpPipeline, "model", frustum=frustum, stats=cullingStats)
+        sg.drawSceneGraphNode(blueCarNode, mvpPipeline, "model", frustum=frustum, stats=cullingStats)
 
         # Once the render is done, buffers are swapped, showing only the complete scene.
         glfw.swap_buffers(window)
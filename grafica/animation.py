@@ -0,0 +1,179 @@
+# coding=utf-8
+"""Keyframe animation of scene graph nodes, sampling all the tracks at once with numpy"""
+
+import numpy as np
+import grafica.scene_graph as sg
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+def composeTRS(translations, rotations, scales):
+    """
+    Builds a (N,4,4) stack of transforms T * Rz * Ry * Rx * S from (N,3) arrays of
+    translations, XYZ euler angles in radians and scale factors.
+    """
+    N = len(translations)
+    cx, cy, cz = np.cos(rotations).T
+    sx, sy, sz = np.sin(rotations).T
+
+    matrices = np.zeros((N, 4, 4), dtype=np.float32)
+
+    # Rotation Rz * Ry * Rx
+    matrices[:, 0, 0] = cy * cz
+    matrices[:, 0, 1] = sx * sy * cz - cx * sz
+    matrices[:, 0, 2] = cx * sy * cz + sx * sz
+    matrices[:, 1, 0] = cy * sz
+    matrices[:, 1, 1] = sx * sy * sz + cx * cz
+    matrices[:, 1, 2] = cx * sy * sz - sx * cz
+    matrices[:, 2, 0] = -sy
+    matrices[:, 2, 1] = sx * cy
+    matrices[:, 2, 2] = cx * cy
+
+    # Scaling is applied first, so it multiplies the columns
+    matrices[:, :3, :3] *= scales[:, np.newaxis, :]
+
+    matrices[:, :3, 3] = translations
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+class KeyframeTrack:
+    """
+    Keyframes of translation, rotation (XYZ euler angles) and scale of a node.
+    Missing components keep the identity value.
+    """
+    def __init__(self, node, times, translations=None, rotations=None, scales=None, loop=True, startTime=0.0):
+        assert isinstance(node, sg.SceneGraphNode)
+
+        times = np.asarray(times, dtype=np.float64)
+        K = len(times)
+        assert K > 0, "A track needs at least one keyframe."
+        assert np.all(np.diff(times) > 0), "Keyframe times must be increasing."
+
+        def keyValues(values, default):
+            if values is None:
+                return np.tile(np.array(default, dtype=np.float64), (K, 1))
+            values = np.asarray(values, dtype=np.float64)
+            assert values.shape == (K, 3), "Keyframe values must be given as (keyframes, 3) arrays."
+            return values
+
+        self.node = node
+        self.times = times
+        self.translations = keyValues(translations, [0, 0, 0])
+        self.rotations = keyValues(rotations, [0, 0, 0])
+        self.scales = keyValues(scales, [1, 1, 1])
+        self.loop = loop
+        self.startTime = startTime
+
+
+class Animator:
+    """
+    Evaluates the keyframe tracks of many nodes in a single vectorized pass.
+
+    Keyframes of all the tracks are packed in flat arrays, the segment of each track is
+    found with one searchsorted call and values are linearly interpolated.
+    Resulting matrices are written straight into the transforms of the nodes, which are
+    bound to a shared array (see scene_graph.bindTransforms) or to the slots of a RenderList.
+    """
+    def __init__(self):
+        self.tracks = {}
+        self._packed = False
+
+    def addTrack(self, track):
+        """Adds a KeyframeTrack, replacing any previous track of the same node"""
+        assert isinstance(track, KeyframeTrack)
+
+        self.tracks[id(track.node)] = track
+        self._packed = False
+
+    def removeTrack(self, node):
+        del self.tracks[id(node)]
+        self._packed = False
+
+    def _pack(self):
+        tracks = list(self.tracks.values())
+        self.nodes = [track.node for track in tracks]
+
+        counts = np.array([len(track.times) for track in tracks], dtype=np.int64)
+        self.keyOffsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        self.keyCounts = counts
+
+        self.startTimes = np.array([track.startTime + track.times[0] for track in tracks])
+        self.durations = np.array([track.times[-1] - track.times[0] for track in tracks])
+        self.loops = np.array([track.loop for track in tracks], dtype=bool)
+
+        # Key times are normalized to [0, 1] within each track and shifted by twice the
+        # track index, so the keys of all the tracks are sorted in a single array
+        safeDurations = np.where(self.durations > 0, self.durations, 1)
+        self.keyTimes = np.concatenate([
+            (track.times - track.times[0]) / safeDurations[i] for i, track in enumerate(tracks)]) \
+            if len(tracks) > 0 else np.zeros(0)
+        self.trackIndices = np.arange(len(tracks))
+        self.packedKeys = self.keyTimes + 2 * np.repeat(self.trackIndices, counts)
+
+        # translation, rotation and scale, 3 columns each
+        self.keyValues = np.concatenate([
+            np.hstack((track.translations, track.rotations, track.scales)) for track in tracks]) \
+            if len(tracks) > 0 else np.zeros((0, 9))
+
+        # The nodes must share a storage to be written all at once
+        storage, _ = sg.findTransformStorage(self.nodes)
+        if storage is None and len(self.nodes) > 0:
+            self._ownStorage = sg.bindTransforms(self.nodes, getattr(self, "_ownStorage", None))
+
+        self._bindingRevision = None
+        self._structureRevision = None
+        self._packed = True
+
+    def sample(self, time):
+        """Returns the interpolated (N,9) translation, rotation and scale of every track"""
+
+        if not self._packed:
+            self._pack()
+
+        # Normalized time within every track
+        safeDurations = np.where(self.durations > 0, self.durations, 1)
+        u = (time - self.startTimes) / safeDurations
+        u = np.where(self.loops, u - np.floor(u), np.clip(u, 0, 1))
+
+        # Segment [first, second] containing the time, on every track
+        first = np.searchsorted(self.packedKeys, 2 * self.trackIndices + u, side="right") - 1
+        lastKeys = self.keyOffsets + self.keyCounts - 1
+        first = np.clip(first, self.keyOffsets, np.maximum(lastKeys - 1, self.keyOffsets))
+        second = np.minimum(first + 1, lastKeys)
+
+        t0 = self.keyTimes[first]
+        t1 = self.keyTimes[second]
+        span = np.where(t1 > t0, t1 - t0, 1)
+        alpha = np.clip(np.where(t1 > t0, (u - t0) / span, 0), 0, 1)
+
+        v0 = self.keyValues[first]
+        v1 = self.keyValues[second]
+        return v0 + alpha[:, np.newaxis] * (v1 - v0)
+
+    def update(self, time):
+        """Samples all the tracks at the given time and writes the node transforms"""
+
+        values = self.sample(time)
+        if len(values) == 0:
+            return
+
+        matrices = composeTRS(values[:, 0:3], values[:, 3:6], values[:, 6:9])
+
+        # Storage slots change only when render lists are compiled
+        if self._bindingRevision != sg.bindingRevision():
+            self._storage, self._slots = sg.findTransformStorage(self.nodes)
+            self._bindingRevision = sg.bindingRevision()
+
+        if self._storage is not None:
+            self._storage[self._slots] = matrices
+        else:
+            for node, matrix in zip(self.nodes, matrices):
+                node._transform[...] = matrix
+
+        # Bounds and static shapes containing these nodes are now outdated
+        if self._structureRevision != sg.structureRevision():
+            self._parents = sg.parentsOf(self.nodes)
+            self._structureRevision = sg.structureRevision()
+        sg.markModified(self._parents)
@@ -0,0 +1,222 @@
+# coding=utf-8
+"""
+Loading assets in the background, so scenes stream in without stopping the render loop.
+
+Images are decoded (or block compressed, if the texture manager compresses them) and
+OBJ files parsed by a pool of workers, threads or processes.
+OpenGL calls must stay on the thread owning the context, so finished assets are queued,
+and AssetLoader.update uploads them from the render loop within a time budget per frame.
+Until then, textures are replaced by a placeholder, and meshes are empty GPUShapes,
+drawing nothing, which are filled in place when their data arrives.
+Assets failing to load keep the placeholder or stay empty, and are listed in AssetLoader.errors.
+"""
+
+import concurrent.futures
+import os.path
+import queue
+import time
+from OpenGL.GL import *
+import numpy as np
+import grafica.gpu_shape as gs
+import grafica.obj_reader as obr
+import grafica.texture_compression as tc
+import grafica.textures as tx
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+PLACEHOLDER_COLOR = (128, 128, 128, 255)
+
+
+# Work done by the pool, at module level so process pools can pickle it
+
+def _decodeImage(filename):
+    return tx.loadImage(filename)
+
+
+def _compressImage(filename, mipmaps):
+    return tc.loadCompressed(filename, mipmaps)
+
+
+def _parseMesh(filename, color, cache):
+    if color is None:
+        shape = obr.readTextureOBJ(filename, cache)
+    else:
+        shape = obr.readOBJ(filename, color, cache)
+    return np.asarray(shape.vertices), np.asarray(shape.indices)
+
+
+class TextureHandle:
+    """
+    Texture being loaded. texture is the placeholder until ready, then the loaded one.
+    GPUShapes given to the loader get the loaded texture assigned too.
+    """
+    def __init__(self, key, texture):
+        self.key = key
+        self.texture = texture
+        self.ready = False
+        self.failed = False
+        self.gpuShapes = []
+
+
+class AssetLoader:
+    """
+    Loads textures and meshes in the background, through the given TextureManager
+    (the default one if None), so textures already loaded are reused at once.
+    """
+    def __init__(self, workers=None, processes=False, textureManager=None):
+        executor = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+        self.executor = executor(max_workers=workers)
+        self.textureManager = textureManager if textureManager is not None else tx.defaultManager()
+        self.finished = queue.SimpleQueue()
+        self.pending = 0
+        self.placeholder = None
+
+        # (filename, exception) of the assets that could not be loaded
+        self.errors = []
+
+        # Texture and mesh requests waiting for the same file and parameters
+        self.textureRequests = {}
+        self.meshRequests = {}
+
+    def _submit(self, upload, fail, function, *arguments):
+        """
+        Runs function in the pool, queueing upload(result) for the render thread,
+        or fail() if it raised. The first argument of function is the file loaded.
+        """
+        self.pending += 1
+        future = self.executor.submit(function, *arguments)
+        future.add_done_callback(lambda done: self.finished.put((upload, fail, arguments[0], done)))
+
+    def _complete(self, upload, fail, filename, future):
+        self.pending -= 1
+        error = future.exception()
+        if error is not None:
+            self.errors.append((filename, error))
+            fail()
+        else:
+            upload(future.result())
+
+    def _placeholderTexture(self):
+        """The placeholder is in the texture manager too, with a reference per handle using it"""
+        if self.placeholder is None:
+            data = np.array([[PLACEHOLDER_COLOR]], dtype=np.uint8)
+            self.placeholder = tx.uploadTexture(data, GL_RGBA, GL_REPEAT, GL_REPEAT, GL_NEAREST, GL_NEAREST)
+            self.textureManager.add(("placeholder", id(self)), self.placeholder, data.nbytes)
+
+        self.textureManager.retain(self.placeholder)
+        return self.placeholder
+
+    def loadTexture(self, filename, sWrapMode=GL_REPEAT, tWrapMode=GL_REPEAT,
+            minFilterMode=GL_LINEAR, maxFilterMode=GL_LINEAR, mipmaps=None, gpuShape=None):
+        """
+        TextureHandle of an image, which adds a reference in the texture manager once loaded.
+        If a GPUShape is given, it uses the placeholder meanwhile.
+        """
+        key = self.textureManager.key(filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+
+        if self.textureManager.contains(key):
+            handle = TextureHandle(key, self.textureManager.acquireKey(key))
+            handle.ready = True
+        else:
+            handle = TextureHandle(key, self._placeholderTexture())
+            if key not in self.textureRequests:
+                self.textureRequests[key] = []
+                upload = lambda result: self._uploadTexture(key, result)
+                fail = lambda: self._failTexture(key)
+                if self.textureManager.usesCompression():
+                    self._submit(upload, fail, _compressImage, key[0], key[5])
+                else:
+                    self._submit(upload, fail, _decodeImage, key[0])
+            self.textureRequests[key].append(handle)
+
+        if gpuShape is not None:
+            gpuShape.texture = handle.texture
+            handle.gpuShapes.append(gpuShape)
+        return handle
+
+    def _uploadTexture(self, key, result):
+        handles = self.textureRequests.pop(key)
+
+        # The texture may have been loaded meanwhile, e.g. by TextureManager.acquire
+        if self.textureManager.contains(key):
+            texture = self.textureManager.acquireKey(key)
+        else:
+            _, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps = key
+            if isinstance(result, tc.CompressedTexture):
+                texture = tc.uploadCompressedTexture(result, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+                size = result.nbytes
+            else:
+                data, format = result
+                texture = tx.uploadTexture(data, format, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+                height, width, channels = data.shape
+                size = tx.textureBytes(width, height, channels, mipmaps)
+
+            self.textureManager.add(key, texture, size)
+            self.textureManager.decodes += 1
+            self.textureManager.uploads += 1
+
+        for i, handle in enumerate(handles):
+            if i > 0:
+                self.textureManager.retain(texture)
+            self.textureManager.release(handle.texture)
+            handle.texture = texture
+            handle.ready = True
+            for gpuShape in handle.gpuShapes:
+                gpuShape.texture = texture
+
+    def _failTexture(self, key):
+        """Handles of an image that could not be loaded keep the placeholder"""
+        for handle in self.textureRequests.pop(key):
+            handle.failed = True
+
+    def loadMesh(self, filename, pipeline, color=None, cache=False):
+        """
+        GPUShape of an OBJ file, empty until loaded. With a color, it has the vertex layout of
+        readOBJ (positions, colors and normals), otherwise the one of readTextureOBJ.
+        Requests of a file already being loaded with the same color wait for the same result.
+        """
+        gpuShape = gs.GPUShape().initBuffers()
+        gpuShape.size = 0
+        pipeline.setupVAO(gpuShape)
+
+        key = (os.path.abspath(filename), None if color is None else tuple(color), cache)
+        if key not in self.meshRequests:
+            self.meshRequests[key] = []
+            self._submit(lambda result: self._uploadMesh(key, result),
+                lambda: self.meshRequests.pop(key), _parseMesh, filename, color, cache)
+        self.meshRequests[key].append(gpuShape)
+        return gpuShape
+
+    def _uploadMesh(self, key, result):
+        stride = 9 if key[1] is not None else 8
+        for gpuShape in self.meshRequests.pop(key):
+            gpuShape.fillBuffers(result[0], result[1], GL_STATIC_DRAW, stride)
+
+    def update(self, timeBudget=0.004):
+        """
+        Uploads finished assets from the render thread, until timeBudget seconds are spent.
+        At least one is uploaded per call, so loading always progresses. Returns how many were.
+        Assets whose loading raised are not uploaded, they are added to errors instead.
+        """
+        start = time.perf_counter()
+        count = 0
+        while self.pending > 0 and (count == 0 or time.perf_counter() - start < timeBudget):
+            try:
+                upload, fail, filename, future = self.finished.get_nowait()
+            except queue.Empty:
+                break
+
+            count += 1
+            self._complete(upload, fail, filename, future)
+
+        return count
+
+    def finish(self):
+        """Waits for every pending asset and uploads it, e.g. behind a loading screen"""
+        while self.pending > 0:
+            self._complete(*self.finished.get())
+
+    def shutdown(self):
+        """Stops the workers once their current jobs end. Assets still pending are not uploaded"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -28,6 +28,17 @@ def merge(destinationShape, strideSize, sourceShape):
     destinationShape.indices += [(offset/strideSize) + index for index in sourceShape.indices]
 
 
+def addTextureLayer(shape, stride, layer):
+    """Copy of a textured shape with a texture array layer appended to every vertex,
+    as SimpleTextureArrayTransformShaderProgram reads them"""
+
+    vertices = []
+    for i in range(0, len(shape.vertices), stride):
+        vertices += list(shape.vertices[i:i + stride]) + [layer]
+
+    return Shape(vertices, list(shape.indices))
+
+
 def applyOffset(shape, stride, offset):
 
     numberOfVertices = len(shape.vertices)//stride
@@ -0,0 +1,149 @@
+# coding=utf-8
+"""Bounding volumes and view frustum tests"""
+
+import numpy as np
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Results of a frustum test
+OUTSIDE = 0
+INTERSECTING = 1
+INSIDE = 2
+
+
+class BoundingBox:
+    """
+    Axis aligned bounding box (AABB) defined by its minimum and maximum corners
+    """
+    def __init__(self, minPoint, maxPoint):
+        self.minPoint = np.array(minPoint, dtype=np.float32)
+        self.maxPoint = np.array(maxPoint, dtype=np.float32)
+
+    def __str__(self):
+        return "BoundingBox(" + str(self.minPoint) + ", " + str(self.maxPoint) + ")"
+
+    def center(self):
+        return 0.5 * (self.minPoint + self.maxPoint)
+
+    def halfExtents(self):
+        return 0.5 * (self.maxPoint - self.minPoint)
+
+    def transform(self, matrix):
+        """
+        Returns the box enclosing this box after applying an affine 4x4 matrix.
+        Instead of transforming the 8 corners, the center is transformed and the
+        half extents are projected with the absolute value of the linear part.
+        """
+        linear = matrix[:3, :3]
+        center = linear @ self.center() + matrix[:3, 3]
+        extents = np.abs(linear) @ self.halfExtents()
+        return BoundingBox(center - extents, center + extents)
+
+    def boundingSphere(self):
+        """Sphere enclosing this box"""
+        return BoundingSphere(self.center(), np.linalg.norm(self.halfExtents()))
+
+
+class BoundingSphere:
+    def __init__(self, center, radius):
+        self.center = np.array(center, dtype=np.float32)
+        self.radius = float(radius)
+
+    def __str__(self):
+        return "BoundingSphere(" + str(self.center) + ", " + str(self.radius) + ")"
+
+    def transform(self, matrix):
+        """
+        Returns the sphere enclosing this sphere after applying an affine 4x4 matrix.
+        The radius grows with the largest scale factor of the linear part.
+        """
+        linear = matrix[:3, :3]
+        center = linear @ self.center + matrix[:3, 3]
+        maxScale = np.sqrt(np.max(np.sum(linear * linear, axis=0)))
+        return BoundingSphere(center, self.radius * maxScale)
+
+
+def boundsFromVertices(vertexData, stride):
+    """
+    Computes the bounding box and the bounding sphere of flat vertex data
+    where the first 3 floats of every vertex are its position.
+    It returns (None, None) for empty data.
+    """
+    vertexData = np.asarray(vertexData, dtype=np.float32)
+    if vertexData.size == 0:
+        return None, None
+
+    positions = vertexData.reshape((-1, stride))[:, :3]
+    minPoint = positions.min(axis=0)
+    maxPoint = positions.max(axis=0)
+    box = BoundingBox(minPoint, maxPoint)
+
+    # The sphere is centered on the box, its radius is the farthest vertex
+    center = box.center()
+    radius = np.sqrt(np.max(np.sum((positions - center) ** 2, axis=1)))
+    sphere = BoundingSphere(center, radius)
+
+    return box, sphere
+
+
+def mergeBoxes(boxA, boxB):
+    """Smallest box containing both boxes, any of them can be None"""
+    if boxA is None:
+        return boxB
+    if boxB is None:
+        return boxA
+    return BoundingBox(
+        np.minimum(boxA.minPoint, boxB.minPoint),
+        np.maximum(boxA.maxPoint, boxB.maxPoint))
+
+
+def frustumPlanes(projection, view=None):
+    """
+    Extracts the 6 frustum planes (left, right, bottom, top, near, far) from
+    the projection and view matrices (Gribb-Hartmann method).
+    Each row is a plane (a, b, c, d) with its normal pointing inside the frustum,
+    so a point p is inside the plane when a*x + b*y + c*z + d >= 0.
+    Planes are expressed in world coordinates, the space where model matrices map to.
+    """
+    clip = projection if view is None else np.matmul(projection, view)
+    clip = np.asarray(clip, dtype=np.float64)
+
+    planes = np.array([
+        clip[3] + clip[0],  # left
+        clip[3] - clip[0],  # right
+        clip[3] + clip[1],  # bottom
+        clip[3] - clip[1],  # top
+        clip[3] + clip[2],  # near
+        clip[3] - clip[2]]) # far
+
+    # Normalizing so plane distances are actual distances
+    norms = np.linalg.norm(planes[:, :3], axis=1)
+    return planes / norms[:, np.newaxis]
+
+
+def testBox(planes, box):
+    """Classifies a box as OUTSIDE, INTERSECTING or INSIDE the frustum"""
+    center = box.center()
+    extents = box.halfExtents()
+
+    # Signed distance from the box center and the box projected radius, for every plane
+    distances = planes[:, :3] @ center + planes[:, 3]
+    radii = np.abs(planes[:, :3]) @ extents
+
+    if np.any(distances < -radii):
+        return OUTSIDE
+    if np.all(distances >= radii):
+        return INSIDE
+    return INTERSECTING
+
+
+def testSphere(planes, sphere):
+    """Classifies a sphere as OUTSIDE, INTERSECTING or INSIDE the frustum"""
+    distances = planes[:, :3] @ sphere.center + planes[:, 3]
+
+    if np.any(distances < -sphere.radius):
+        return OUTSIDE
+    if np.all(distances >= sphere.radius):
+        return INSIDE
+    return INTERSECTING
@@ -0,0 +1,293 @@
+# coding=utf-8
+"""
+Bounding volume hierarchy over triangle meshes, for picking and visibility queries.
+
+The tree is built level by level with the surface area heuristic (SAH) evaluated on bins,
+all the nodes of a level at once. Rays are traversed together as well: every step tests
+(ray, node) pairs against node boxes and (ray, triangle) pairs against triangles.
+"""
+
+import numpy as np
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Tolerance on the barycentric coordinates, so rays through shared edges do not leak between triangles
+EDGE_TOLERANCE = 1e-9
+
+
+def _boxAreas(minPoints, maxPoints):
+    """Half of the surface area of boxes, 0 for empty ones"""
+    sizes = np.maximum(maxPoints - minPoints, 0)
+    return sizes[..., 0] * sizes[..., 1] + sizes[..., 1] * sizes[..., 2] + sizes[..., 2] * sizes[..., 0]
+
+
+def _segmentRanges(starts, counts):
+    """Concatenated aranges [start, start + count) of every segment"""
+    total = int(np.sum(counts))
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    return offsets + np.arange(total)
+
+
+class TriangleBVH:
+    """
+    BVH over (V,3) positions and (F,3) triangles.
+
+    Nodes are stored in flat arrays: boxes (nodeMin, nodeMax), childs (leftChild, rightChild)
+    of inner nodes, and ranges (leafStart, leafCount) of leaves over the triangle order.
+    A node is a leaf when its leafCount is greater than 0.
+    """
+    def __init__(self, positions, triangles, leafSize=4, maxLeafSize=16, bins=16):
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+        self.leafSize = leafSize
+        self.maxLeafSize = maxLeafSize
+        self.bins = bins
+        self._setPositions(positions)
+        self._build()
+
+    def _setPositions(self, positions):
+        self.positions = np.asarray(positions, dtype=np.float64)
+        corners = self.positions[self.triangles]
+        self.triangleMin = corners.min(axis=1)
+        self.triangleMax = corners.max(axis=1)
+
+        # Triangles as a vertex and two edges, for the intersection tests
+        self.vertices0 = corners[:, 0]
+        self.edges1 = corners[:, 1] - corners[:, 0]
+        self.edges2 = corners[:, 2] - corners[:, 0]
+
+    def _build(self):
+        F = len(self.triangles)
+        B = self.bins
+        centroids = 0.5 * (self.triangleMin + self.triangleMax)
+        self.order = np.arange(F)
+
+        nodeMin, nodeMax, leftChild, rightChild, leafStart, leafCount = [], [], [], [], [], []
+        self.levels = []
+
+        # Active nodes of the current level: ids and ranges over the triangle order
+        ids = np.array([0])
+        starts = np.array([0])
+        counts = np.array([F])
+        nextId = 1
+
+        while len(ids) > 0 and F > 0:
+            K = len(ids)
+            self.levels.append(ids)
+            positions = _segmentRanges(starts, counts)
+            segments = np.repeat(np.arange(K), counts)
+            offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            triangles = self.order[positions]
+
+            boxMin = np.minimum.reduceat(self.triangleMin[triangles], offsets)
+            boxMax = np.maximum.reduceat(self.triangleMax[triangles], offsets)
+            centroidMin = np.minimum.reduceat(centroids[triangles], offsets)
+            centroidMax = np.maximum.reduceat(centroids[triangles], offsets)
+
+            # Binning along the largest extent of the centroids
+            axes = np.argmax(centroidMax - centroidMin, axis=1)
+            low = centroidMin[np.arange(K), axes]
+            extents = centroidMax[np.arange(K), axes] - low
+            scale = np.where(extents > 0, B / np.where(extents > 0, extents, 1), 0)
+            values = centroids[triangles, axes[segments]]
+            binIndices = np.clip(((values - low[segments]) * scale[segments]).astype(np.int64), 0, B - 1)
+
+            keys = segments * B + binIndices
+            binCounts = np.bincount(keys, minlength=K * B).reshape((K, B))
+            binMin = np.full((K * B, 3), np.inf)
+            binMax = np.full((K * B, 3), -np.inf)
+            byKey = triangles[np.argsort(keys, kind="stable")]
+            filled = np.flatnonzero(binCounts.reshape(-1))
+            binOffsets = np.concatenate(([0], np.cumsum(binCounts.reshape(-1)[filled])[:-1]))
+            binMin[filled] = np.minimum.reduceat(self.triangleMin[byKey], binOffsets)
+            binMax[filled] = np.maximum.reduceat(self.triangleMax[byKey], binOffsets)
+            binMin = binMin.reshape((K, B, 3))
+            binMax = binMax.reshape((K, B, 3))
+
+            # SAH cost of splitting after every bin, with boxes and counts swept from both sides
+            leftCounts = np.cumsum(binCounts, axis=1)[:, :-1]
+            rightCounts = counts[:, np.newaxis] - leftCounts
+            leftAreas = _boxAreas(np.minimum.accumulate(binMin, axis=1), np.maximum.accumulate(binMax, axis=1))[:, :-1]
+            rightAreas = _boxAreas(
+                np.minimum.accumulate(binMin[:, ::-1], axis=1)[:, ::-1],
+                np.maximum.accumulate(binMax[:, ::-1], axis=1)[:, ::-1])[:, 1:]
+            costs = leftAreas * leftCounts + rightAreas * rightCounts
+            splits = np.argmin(costs, axis=1)
+            bestCosts = costs[np.arange(K), splits]
+            leafCosts = _boxAreas(boxMin, boxMax) * counts
+
+            split = (counts > self.leafSize) & ((bestCosts < leafCosts) | (counts > self.maxLeafSize))
+
+            # Nodes whose centroids coincide are split in halves of the triangle order
+            halves = split & (extents <= 0)
+            sides = binIndices > splits[segments]
+            withinSegment = np.arange(len(positions)) - offsets[segments]
+            sides = np.where(halves[segments], withinSegment >= counts[segments] // 2, sides)
+            sides &= split[segments]
+
+            # Stable partition of every node range, left side first
+            permutation = np.argsort(segments * 2 + sides, kind="stable")
+            self.order[positions] = triangles[permutation]
+            leftCounts = counts - np.bincount(segments, weights=sides, minlength=K).astype(np.int64)
+
+            S = int(np.sum(split))
+            lefts = np.full(K, -1)
+            rights = np.full(K, -1)
+            lefts[split] = nextId + 2 * np.arange(S)
+            rights[split] = lefts[split] + 1
+            nextId += 2 * S
+
+            nodeMin.append(boxMin)
+            nodeMax.append(boxMax)
+            leftChild.append(lefts)
+            rightChild.append(rights)
+            leafStart.append(np.where(split, -1, starts))
+            leafCount.append(np.where(split, 0, counts))
+
+            # Childs of the split nodes, in the order their ids were given
+            childStarts = np.stack((starts[split], starts[split] + leftCounts[split]), axis=1).reshape(-1)
+            childCounts = np.stack((leftCounts[split], counts[split] - leftCounts[split]), axis=1).reshape(-1)
+            ids = np.stack((lefts[split], rights[split]), axis=1).reshape(-1)
+            starts = childStarts
+            counts = childCounts
+
+        # Node ids increase level by level, so concatenating the levels sorts them
+        self.nodeMin = np.concatenate(nodeMin) if F > 0 else np.zeros((0, 3))
+        self.nodeMax = np.concatenate(nodeMax) if F > 0 else np.zeros((0, 3))
+        self.leftChild = np.concatenate(leftChild) if F > 0 else np.zeros(0, dtype=np.int64)
+        self.rightChild = np.concatenate(rightChild) if F > 0 else np.zeros(0, dtype=np.int64)
+        self.leafStart = np.concatenate(leafStart) if F > 0 else np.zeros(0, dtype=np.int64)
+        self.leafCount = np.concatenate(leafCount) if F > 0 else np.zeros(0, dtype=np.int64)
+
+    def refit(self, positions):
+        """
+        Updates the boxes after the vertices moved, keeping the tree structure.
+        Cheaper than building again, although the tree gets worse for large deformations.
+        """
+        self._setPositions(positions)
+
+        leaves = np.flatnonzero(self.leafCount > 0)
+        leaves = leaves[np.argsort(self.leafStart[leaves])]
+        triangles = self.order
+        offsets = self.leafStart[leaves]
+        self.nodeMin[leaves] = np.minimum.reduceat(self.triangleMin[triangles], offsets)
+        self.nodeMax[leaves] = np.maximum.reduceat(self.triangleMax[triangles], offsets)
+
+        # Inner nodes from the deepest level up
+        for ids in reversed(self.levels):
+            inner = ids[self.leafCount[ids] == 0]
+            self.nodeMin[inner] = np.minimum(self.nodeMin[self.leftChild[inner]], self.nodeMin[self.rightChild[inner]])
+            self.nodeMax[inner] = np.maximum(self.nodeMax[self.leftChild[inner]], self.nodeMax[self.rightChild[inner]])
+
+    def _traverse(self, origins, directions, tMax, anyHit):
+        origins = np.asarray(origins, dtype=np.float64).reshape((-1, 3))
+        directions = np.asarray(directions, dtype=np.float64).reshape((-1, 3))
+        R = len(origins)
+
+        with np.errstate(divide="ignore"):
+            inverseDirections = 1 / directions
+
+        distances = np.full(R, tMax, dtype=np.float64)
+        hitTriangles = np.full(R, -1, dtype=np.int64)
+        barycentrics = np.zeros((R, 2), dtype=np.float64)
+
+        rays = np.arange(R) if len(self.nodeMin) > 0 else np.zeros(0, dtype=np.int64)
+        nodes = np.zeros(len(rays), dtype=np.int64)
+
+        while len(rays) > 0:
+            # Slab test against the node boxes, up to the closest hit found so far.
+            # Rays lying on a slab plane give NaNs (0 * inf), which leave that axis unbounded
+            with np.errstate(invalid="ignore"):
+                t0 = (self.nodeMin[nodes] - origins[rays]) * inverseDirections[rays]
+                t1 = (self.nodeMax[nodes] - origins[rays]) * inverseDirections[rays]
+            tNear = np.max(np.fmax(np.minimum(t0, t1), -np.inf), axis=1)
+            tFar = np.min(np.fmin(np.maximum(t0, t1), np.inf), axis=1)
+            inside = (tNear <= tFar) & (tFar >= 0) & (tNear <= distances[rays])
+            rays = rays[inside]
+            nodes = nodes[inside]
+
+            leaves = self.leafCount[nodes] > 0
+            if np.any(leaves):
+                leafRays = rays[leaves]
+                leafNodes = nodes[leaves]
+                counts = self.leafCount[leafNodes]
+                pairRays = np.repeat(leafRays, counts)
+                pairTriangles = self.order[_segmentRanges(self.leafStart[leafNodes], counts)]
+                self._intersect(origins, directions, pairRays, pairTriangles, distances, hitTriangles, barycentrics)
+
+            rays = rays[~leaves]
+            nodes = nodes[~leaves]
+            if anyHit:
+                pending = hitTriangles[rays] < 0
+                rays = rays[pending]
+                nodes = nodes[pending]
+
+            rays = np.concatenate((rays, rays))
+            nodes = np.concatenate((self.leftChild[nodes], self.rightChild[nodes]))
+
+        return distances, hitTriangles, barycentrics
+
+    def _intersect(self, origins, directions, rays, triangles, distances, hitTriangles, barycentrics):
+        """Moller-Trumbore tests of (ray, triangle) pairs, keeping the closest hit of every ray"""
+        edges1 = self.edges1[triangles]
+        edges2 = self.edges2[triangles]
+        d = directions[rays]
+
+        p = np.cross(d, edges2)
+        determinants = np.sum(edges1 * p, axis=1)
+        valid = np.abs(determinants) > 1e-12
+        inverse = 1 / np.where(valid, determinants, 1)
+
+        s = origins[rays] - self.vertices0[triangles]
+        u = np.sum(s * p, axis=1) * inverse
+        q = np.cross(s, edges1)
+        v = np.sum(d * q, axis=1) * inverse
+        t = np.sum(edges2 * q, axis=1) * inverse
+
+        valid &= (u >= -EDGE_TOLERANCE) & (v >= -EDGE_TOLERANCE) & (u + v <= 1 + EDGE_TOLERANCE)
+        valid &= (t > 1e-9) & (t < distances[rays])
+        rays, triangles, t, u, v = rays[valid], triangles[valid], t[valid], u[valid], v[valid]
+        if len(rays) == 0:
+            return
+
+        np.minimum.at(distances, rays, t)
+        closest = t == distances[rays]
+        rays = rays[closest]
+        hitTriangles[rays] = triangles[closest]
+        barycentrics[rays, 0] = u[closest]
+        barycentrics[rays, 1] = v[closest]
+
+    def closestHit(self, origins, directions, tMax=np.inf):
+        """
+        Closest intersection of (R,3) rays. Returns (distances, triangles, barycentrics):
+        distances along the directions, the hit triangle or -1, and its (u,v) coordinates.
+        The hit point is origin + distance * direction = (1-u-v) * a + u * b + v * c.
+        """
+        return self._traverse(origins, directions, tMax, False)
+
+    def anyHit(self, origins, directions, tMax=np.inf):
+        """(R,) boolean mask of the rays hitting any triangle before tMax, as in shadow queries"""
+        _, triangles, _ = self._traverse(origins, directions, tMax, True)
+        return triangles >= 0
+
+
+def screenRays(inverseViewProjection, points, width, height):
+    """
+    (origins, directions) of rays through (N,2) pixel coordinates (e.g. mouse positions,
+    y growing downwards) of a viewport, in the space the view projection maps from.
+    Camera.inverseViewProjection gives world space rays.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+    x = 2 * points[:, 0] / width - 1
+    y = 1 - 2 * points[:, 1] / height
+
+    ndc = np.stack((
+        np.stack((x, y, -np.ones_like(x), np.ones_like(x)), axis=1),
+        np.stack((x, y, np.ones_like(x), np.ones_like(x)), axis=1)))
+    unprojected = ndc @ np.asarray(inverseViewProjection, dtype=np.float64).T
+    nearPoints = unprojected[0, :, :3] / unprojected[0, :, 3:]
+    farPoints = unprojected[1, :, :3] / unprojected[1, :, 3:]
+
+    directions = farPoints - nearPoints
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return nearPoints, directions
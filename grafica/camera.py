@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Camera keeping its view and projection matrices up to date"""
+
+import numpy as np
+import grafica.transformations as tr
+import grafica.bounding_volumes as bv
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+def _cameraProperty(name, changesView):
+    """Property storing a camera parameter and recording the change only when the value differs"""
+    attribute = "_" + name
+
+    def getter(self):
+        return getattr(self, attribute)
+
+    def setter(self, value):
+        if isinstance(getattr(self, attribute), np.ndarray):
+            value = np.array(value, dtype=np.float32)
+        if np.array_equal(getattr(self, attribute), value):
+            return
+
+        setattr(self, attribute, value)
+        self.version += 1
+        if changesView:
+            self._viewVersion = self.version
+        else:
+            self._projectionVersion = self.version
+
+    return property(getter, setter)
+
+
+class Camera:
+    """
+    Perspective camera, or orthographic when orthoHeight is given as the height of the view volume.
+
+    Matrices and frustum planes are computed when requested after a parameter changed,
+    and reused otherwise. version increases with every change, so other caches (uniforms,
+    culling results) can tell whether the camera moved since they were computed.
+    Returned arrays are shared with the camera and must not be modified.
+    """
+    eye = _cameraProperty("eye", True)
+    at = _cameraProperty("at", True)
+    up = _cameraProperty("up", True)
+    fovy = _cameraProperty("fovy", False)
+    aspect = _cameraProperty("aspect", False)
+    near = _cameraProperty("near", False)
+    far = _cameraProperty("far", False)
+    orthoHeight = _cameraProperty("orthoHeight", False)
+
+    def __init__(self, eye=(0, 0, 1), at=(0, 0, 0), up=(0, 1, 0), fovy=60, aspect=1, near=0.1, far=100, orthoHeight=None):
+        self._eye = np.array(eye, dtype=np.float32)
+        self._at = np.array(at, dtype=np.float32)
+        self._up = np.array(up, dtype=np.float32)
+        self._fovy = fovy
+        self._aspect = aspect
+        self._near = near
+        self._far = far
+        self._orthoHeight = orthoHeight
+
+        self.version = 0
+        self._viewVersion = 0
+        self._projectionVersion = 0
+
+        # Version of the parameters each cached value was computed with
+        self._computed = {}
+        self._values = {}
+
+    def _cached(self, name, version, compute):
+        if self._computed.get(name) != version:
+            self._values[name] = compute()
+            self._computed[name] = version
+        return self._values[name]
+
+    @property
+    def view(self):
+        return self._cached("view", self._viewVersion,
+            lambda: tr.lookAt(self._eye, self._at, self._up))
+
+    @property
+    def inverseView(self):
+        return self._cached("inverseView", self._viewVersion,
+            lambda: tr.rigidInverse(self.view))
+
+    @property
+    def projection(self):
+        def compute():
+            if self._orthoHeight is None:
+                return tr.perspective(self._fovy, self._aspect, self._near, self._far)
+            halfHeight = 0.5 * self._orthoHeight
+            halfWidth = halfHeight * self._aspect
+            return tr.ortho(-halfWidth, halfWidth, -halfHeight, halfHeight, self._near, self._far)
+
+        return self._cached("projection", self._projectionVersion, compute)
+
+    @property
+    def viewProjection(self):
+        return self._cached("viewProjection", self.version,
+            lambda: tr.matmul([self.projection, self.view]))
+
+    @property
+    def inverseViewProjection(self):
+        """Maps normalized device coordinates back to world coordinates"""
+        return self._cached("inverseViewProjection", self.version,
+            lambda: np.linalg.inv(self.viewProjection).astype(np.float32))
+
+    @property
+    def frustumPlanes(self):
+        """World space frustum planes, as given by bounding_volumes.frustumPlanes"""
+        return self._cached("frustumPlanes", self.version,
+            lambda: bv.frustumPlanes(self.viewProjection))
@@ -4,10 +4,10 @@
 from OpenGL.GL import *
 import OpenGL.GL.shaders
 import numpy as np
-from PIL import Image
 
 import grafica.basic_shapes as bs
-from grafica.gpu_shape import GPUShape
+import grafica.textures as tx
+from grafica.gpu_shape import GPUShape, InstancedGPUShape, drawElements
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -20,33 +20,48 @@ SIZE_IN_BYTES = 4
 def textureSimpleSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode):
      # wrapMode: GL_REPEAT, GL_CLAMP_TO_EDGE
      # filterMode: GL_LINEAR, GL_NEAREST
-    texture = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, texture)
-    
-    # texture wrapping params
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, sWrapMode)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, tWrapMode)
-
-    # texture filtering params
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, minFilterMode)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, maxFilterMode)
-    
-    image = Image.open(imgName)
-    img_data = np.array(image, np.uint8)
-
-    if image.mode == "RGB":
-        internalFormat = GL_RGB
-        format = GL_RGB
-    elif image.mode == "RGBA":
-        internalFormat = GL_RGBA
-        format = GL_RGBA
-    else:
-        print("Image mode not supported.")
-        raise Exception()
-
-    glTexImage2D(GL_TEXTURE_2D, 0, internalFormat, image.size[0], image.size[1], 0, format, GL_UNSIGNED_BYTE, img_data)
-
-    return texture
+    data, format = tx.loadImage(imgName)
+    return tx.uploadTexture(data, format, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+
+
+def textureCachedSetup(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps=None):
+    """As textureSimpleSetup, but sharing the texture through the default TextureManager.
+    Mipmaps are generated for mipmap minification filters. GPUShape.clear releases it."""
+    return tx.defaultManager().acquire(imgName, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+
+
+def textureArraySetup(imgNames, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps=None):
+    """Texture array with a layer per image file, all of them with the same size.
+    Pipelines with TextureArray in their names use it, reading the layer of each vertex or instance."""
+    return tx.loadTextureArray(imgNames, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+
+
+def instanceTransformLayers(transforms, layers):
+    """Instance buffer rows of SimpleInstancedTextureArrayTransformShaderProgram,
+    a (N,4,4) transform and a texture array layer per instance"""
+    transforms = np.asarray(transforms, dtype=np.float32).reshape((-1, 16))
+    instanceData = np.empty((len(transforms), 17), dtype=np.float32)
+    instanceData[:, :16] = transforms
+    instanceData[:, 16] = layers
+    return instanceData
+
+
+def setupInstanceMatrixAttribute(shaderProgram, attributeName, instanceVbo, stride=64):
+    """A mat4 attribute uses 4 consecutive locations, one per column.
+    Matrices are stored row major on the instance buffer, as numpy does, so shaders
+    read their transpose and must multiply vectors on the left side.
+    The matrix is the first item of each instance, whose size in bytes is the stride."""
+
+    glBindBuffer(GL_ARRAY_BUFFER, instanceVbo)
+
+    # 4x4 floats => 16*4 = 64 bytes per instance
+    location = glGetAttribLocation(shaderProgram, attributeName)
+    for i in range(4):
+        glVertexAttribPointer(location + i, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(16 * i))
+        glEnableVertexAttribArray(location + i)
+
+        # Advancing once per instance instead of once per vertex
+        glVertexAttribDivisor(location + i, 1)
 
 
 class SimpleShaderProgram:
@@ -103,12 +118,12 @@ class SimpleShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -171,13 +186,13 @@ class SimpleTextureShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
         
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -239,12 +254,12 @@ class SimpleTransformShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
         
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -312,12 +327,12 @@ class SimpleTextureTransformShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -381,12 +396,12 @@ class SimpleModelViewProjectionShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -455,15 +470,331 @@ class SimpleTextureModelViewProjectionShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
 
 
+
+
+class SimpleInstancedTransformShaderProgram:
+    """SimpleTransformShaderProgram drawing many instances at once, each with its own transform"""
+
+    def __init__(self):
+
+        vertex_shader = """
+            #version 130
+
+            in vec3 position;
+            in vec3 color;
+            in mat4 instanceTransform;
+
+            out vec3 newColor;
+
+            void main()
+            {
+                // The instance matrix arrives transposed, see setupInstanceMatrixAttribute
+                gl_Position = vec4(position, 1.0f) * instanceTransform;
+                newColor = color;
+            }
+            """
+
+        fragment_shader = """
+            #version 130
+            in vec3 newColor;
+
+            out vec4 outColor;
+
+            void main()
+            {
+                outColor = vec4(newColor, 1.0f);
+            }
+            """
+
+        self.shaderProgram = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+
+    def setupVAO(self, instancedShape):
+        assert isinstance(instancedShape, InstancedGPUShape)
+
+        glBindVertexArray(instancedShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, instancedShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, instancedShape.ebo)
+
+        # 3d vertices + rgb color specification => 3*4 + 3*4 = 24 bytes
+        position = glGetAttribLocation(self.shaderProgram, "position")
+        glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(position)
+
+        color = glGetAttribLocation(self.shaderProgram, "color")
+        glVertexAttribPointer(color, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(color)
+
+        setupInstanceMatrixAttribute(self.shaderProgram, "instanceTransform", instancedShape.instanceVbo)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def drawCall(self, instancedShape, mode=None):
+        assert isinstance(instancedShape, InstancedGPUShape)
+
+        # Binding the VAO and executing the draw call for all the instances
+        glBindVertexArray(instancedShape.vao)
+        drawElements(instancedShape, mode, instancedShape.instanceCount)
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
+
+
+class SimpleInstancedModelViewProjectionShaderProgram:
+    """SimpleModelViewProjectionShaderProgram drawing many instances at once, each with its own model matrix"""
+
+    def __init__(self):
+
+        vertex_shader = """
+            #version 130
+            
+            uniform mat4 projection;
+            uniform mat4 view;
+
+            in vec3 position;
+            in vec3 color;
+            in mat4 instanceModel;
+
+            out vec3 newColor;
+            void main()
+            {
+                // The instance matrix arrives transposed, see setupInstanceMatrixAttribute
+                gl_Position = projection * view * (vec4(position, 1.0f) * instanceModel);
+                newColor = color;
+            }
+            """
+
+        fragment_shader = """
+            #version 130
+            in vec3 newColor;
+
+            out vec4 outColor;
+            void main()
+            {
+                outColor = vec4(newColor, 1.0f);
+            }
+            """
+
+        self.shaderProgram = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(vertex_shader, OpenGL.GL.GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(fragment_shader, OpenGL.GL.GL_FRAGMENT_SHADER))
+
+
+    def setupVAO(self, instancedShape):
+        assert isinstance(instancedShape, InstancedGPUShape)
+
+        glBindVertexArray(instancedShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, instancedShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, instancedShape.ebo)
+
+        # 3d vertices + rgb color specification => 3*4 + 3*4 = 24 bytes
+        position = glGetAttribLocation(self.shaderProgram, "position")
+        glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(position)
+        
+        color = glGetAttribLocation(self.shaderProgram, "color")
+        glVertexAttribPointer(color, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(color)
+
+        setupInstanceMatrixAttribute(self.shaderProgram, "instanceModel", instancedShape.instanceVbo)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def drawCall(self, instancedShape, mode=None):
+        assert isinstance(instancedShape, InstancedGPUShape)
+
+        # Binding the VAO and executing the draw call for all the instances
+        glBindVertexArray(instancedShape.vao)
+        drawElements(instancedShape, mode, instancedShape.instanceCount)
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
+
+
+class SimpleTextureArrayTransformShaderProgram:
+    """
+    SimpleTextureTransformShaderProgram reading a texture array, with the layer as a vertex attribute.
+    Shapes with different images of the array can be merged and drawn in a single call,
+    see bs.addTextureLayer.
+    """
+
+    def __init__(self):
+
+        vertex_shader = """
+            #version 130
+
+            uniform mat4 transform;
+
+            in vec3 position;
+            in vec2 texCoords;
+            in float layer;
+
+            out vec3 outTexCoords;
+
+            void main()
+            {
+                gl_Position = transform * vec4(position, 1.0f);
+                outTexCoords = vec3(texCoords, layer);
+            }
+            """
+
+        fragment_shader = """
+            #version 130
+
+            in vec3 outTexCoords;
+
+            out vec4 outColor;
+
+            uniform sampler2DArray samplerTex;
+
+            void main()
+            {
+                outColor = texture(samplerTex, outTexCoords);
+            }
+            """
+
+        self.shaderProgram = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(fragment_shader, GL_FRAGMENT_SHADER))
+
+
+    def setupVAO(self, gpuShape):
+
+        glBindVertexArray(gpuShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, gpuShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, gpuShape.ebo)
+
+        # 3d vertices + 2d texture coordinates + layer => 3*4 + 2*4 + 4 = 24 bytes
+        position = glGetAttribLocation(self.shaderProgram, "position")
+        glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(position)
+
+        texCoords = glGetAttribLocation(self.shaderProgram, "texCoords")
+        glVertexAttribPointer(texCoords, 2, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(3 * SIZE_IN_BYTES))
+        glEnableVertexAttribArray(texCoords)
+
+        layer = glGetAttribLocation(self.shaderProgram, "layer")
+        glVertexAttribPointer(layer, 1, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(5 * SIZE_IN_BYTES))
+        glEnableVertexAttribArray(layer)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def drawCall(self, gpuShape, mode=None):
+        assert isinstance(gpuShape, GPUShape)
+
+        glBindVertexArray(gpuShape.vao)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, gpuShape.texture)
+        drawElements(gpuShape, mode)
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
+
+
+class SimpleInstancedTextureArrayTransformShaderProgram:
+    """
+    SimpleTextureTransformShaderProgram drawing many instances at once, each with its own
+    transform and layer of a texture array. Vertices have positions and texture coordinates,
+    as createTextureQuad, and instance rows are built with instanceTransformLayers.
+    """
+
+    def __init__(self):
+
+        vertex_shader = """
+            #version 130
+
+            in vec3 position;
+            in vec2 texCoords;
+            in mat4 instanceTransform;
+            in float instanceLayer;
+
+            out vec3 outTexCoords;
+
+            void main()
+            {
+                // The instance matrix arrives transposed, see setupInstanceMatrixAttribute
+                gl_Position = vec4(position, 1.0f) * instanceTransform;
+                outTexCoords = vec3(texCoords, instanceLayer);
+            }
+            """
+
+        fragment_shader = """
+            #version 130
+
+            in vec3 outTexCoords;
+
+            out vec4 outColor;
+
+            uniform sampler2DArray samplerTex;
+
+            void main()
+            {
+                outColor = texture(samplerTex, outTexCoords);
+            }
+            """
+
+        self.shaderProgram = OpenGL.GL.shaders.compileProgram(
+            OpenGL.GL.shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
+            OpenGL.GL.shaders.compileShader(fragment_shader, GL_FRAGMENT_SHADER))
+
+
+    def setupVAO(self, instancedShape):
+        assert isinstance(instancedShape, InstancedGPUShape)
+
+        glBindVertexArray(instancedShape.vao)
+
+        glBindBuffer(GL_ARRAY_BUFFER, instancedShape.vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, instancedShape.ebo)
+
+        # 3d vertices + 2d texture coordinates => 3*4 + 2*4 = 20 bytes
+        position = glGetAttribLocation(self.shaderProgram, "position")
+        glVertexAttribPointer(position, 3, GL_FLOAT, GL_FALSE, 20, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(position)
+
+        texCoords = glGetAttribLocation(self.shaderProgram, "texCoords")
+        glVertexAttribPointer(texCoords, 2, GL_FLOAT, GL_FALSE, 20, ctypes.c_void_p(3 * SIZE_IN_BYTES))
+        glEnableVertexAttribArray(texCoords)
+
+        # 4x4 transform + layer => 16*4 + 4 = 68 bytes per instance
+        setupInstanceMatrixAttribute(self.shaderProgram, "instanceTransform", instancedShape.instanceVbo, 68)
+
+        layer = glGetAttribLocation(self.shaderProgram, "instanceLayer")
+        glVertexAttribPointer(layer, 1, GL_FLOAT, GL_FALSE, 68, ctypes.c_void_p(16 * SIZE_IN_BYTES))
+        glEnableVertexAttribArray(layer)
+        glVertexAttribDivisor(layer, 1)
+
+        # Unbinding current vao
+        glBindVertexArray(0)
+
+
+    def drawCall(self, instancedShape, mode=None):
+        assert isinstance(instancedShape, InstancedGPUShape)
+
+        # A single texture for all the instances, each of them reading its own layer
+        glBindVertexArray(instancedShape.vao)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, instancedShape.texture)
+        drawElements(instancedShape, mode, instancedShape.instanceCount)
+
+        # Unbind the current VAO
+        glBindVertexArray(0)
@@ -4,6 +4,9 @@
 #import OpenGL.GL as ogl
 from OpenGL.GL import *
 import numpy as np
+import grafica.bounding_volumes as bv
+import grafica.strips as st
+import grafica.textures as tx
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
@@ -12,6 +15,10 @@ __license__ = "MIT"
 # 1 byte = 8 bits
 SIZE_IN_BYTES = 4
 
+# Primitive modes whose indices may be split with the restart index
+STRIP_MODES = (GL_TRIANGLE_STRIP, GL_LINE_STRIP)
+
+
 class GPUShape:
     def __init__(self):
         """VAO, VBO, EBO and texture handlers to GPU memory"""
@@ -22,6 +29,20 @@ class GPUShape:
         self.texture = None
         self.size = None
 
+        # Primitive drawn with the indices, GL_TRIANGLE_STRIP when they come from grafica.strips
+        self.mode = GL_TRIANGLES
+
+        # Number of floats per vertex and bounding volumes in model coordinates,
+        # they are computed when filling the buffers
+        self.stride = None
+        self.boundingBox = None
+        self.boundingSphere = None
+
+        # Increased every time the buffers are filled, as the bounds may change.
+        # Scene graph nodes holding this shape are flagged too.
+        self.boundsRevision = 0
+        self._parents = []
+
     def initBuffers(self):
         """Convenience function for initialization of OpenGL buffers.
         It returns itself to enable the convenience call:
@@ -41,12 +62,32 @@ class GPUShape:
             "  ebo=" + str(self.ebo) +\
             "  tex=" + str(self.texture)
 
-    def fillBuffers(self, vertices, indices, usage):
+    def fillBuffers(self, vertices, indices, usage, stride=None, mode=GL_TRIANGLES):
+        """Uploads vertices and indices to the GPU.
+        The first 3 floats of each vertex are its position, they are used to
+        compute the bounding volumes of the shape.
+        The stride (floats per vertex) is needed to know where positions are, without it
+        the shape has no bounds, so it is never culled, and it can not be part of static nodes.
+        The mode is the primitive drawn by drawCall, e.g. GL_TRIANGLE_STRIP for
+        indices built with grafica.strips.
+        """
 
-        vertexData = np.array(vertices, dtype=np.float32)
-        indices = np.array(indices, dtype=np.uint32)
+        # Arrays already in the right type, as memory mapped meshes, are uploaded without copies
+        vertexData = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1)
+        indices = np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1)
 
         self.size = len(indices)
+        self.mode = mode
+
+        self.stride = stride
+        if stride is not None:
+            self.boundingBox, self.boundingSphere = bv.boundsFromVertices(vertexData, stride)
+        else:
+            self.boundingBox, self.boundingSphere = None, None
+
+        self.boundsRevision += 1
+        for parent in self._parents:
+            parent._shapeModified()
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
         glBufferData(GL_ARRAY_BUFFER, len(vertexData) * SIZE_IN_BYTES, vertexData, usage)
@@ -54,11 +95,28 @@ class GPUShape:
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
         glBufferData(GL_ELEMENT_ARRAY_BUFFER, len(indices) * SIZE_IN_BYTES, indices, usage)
 
+    def readBuffers(self):
+        """Reads back vertices and indices from GPU memory as flat numpy arrays"""
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        vertexBytes = int(glGetBufferParameteriv(GL_ARRAY_BUFFER, GL_BUFFER_SIZE))
+        vertexData = np.empty(vertexBytes // SIZE_IN_BYTES, dtype=np.float32)
+        glGetBufferSubData(GL_ARRAY_BUFFER, 0, vertexBytes, vertexData)
+
+        # The EBO is read through the VAO holding it
+        glBindVertexArray(self.vao)
+        indices = np.empty(self.size, dtype=np.uint32)
+        glGetBufferSubData(GL_ELEMENT_ARRAY_BUFFER, 0, self.size * SIZE_IN_BYTES, indices)
+        glBindVertexArray(0)
+
+        return vertexData, indices
+
     def clear(self):
         """Freeing GPU memory"""
 
+        # Textures shared through the default TextureManager are released instead
         if self.texture != None:
-            glDeleteTextures(1, [self.texture])
+            tx.releaseTexture(self.texture)
         
         if self.ebo != None:
             glDeleteBuffers(1, [self.ebo])
@@ -68,4 +126,81 @@ class GPUShape:
 
         if self.vao != None:
             glDeleteVertexArrays(1, [self.vao])
-        
\ No newline at end of file
+        
+
+class InstancedGPUShape:
+    """
+    A GPUShape drawn many times in a single draw call.
+    It has its own VAO and a buffer with per instance data (e.g. model matrices),
+    while vertices, indices and texture are shared with the original GPUShape.
+    """
+    def __init__(self, gpuShape):
+        assert isinstance(gpuShape, GPUShape)
+
+        self.gpuShape = gpuShape
+        self.vao = glGenVertexArrays(1)
+        self.instanceVbo = glGenBuffers(1)
+        self.instanceCount = 0
+
+    @property
+    def vbo(self):
+        return self.gpuShape.vbo
+
+    @property
+    def ebo(self):
+        return self.gpuShape.ebo
+
+    @property
+    def texture(self):
+        return self.gpuShape.texture
+
+    @property
+    def size(self):
+        return self.gpuShape.size
+
+    @property
+    def mode(self):
+        return self.gpuShape.mode
+
+    def __str__(self):
+        return "instances of " + str(self.gpuShape) +\
+            "  instanceVbo=" + str(self.instanceVbo) +\
+            "  count=" + str(self.instanceCount)
+
+    def fillInstanceBuffer(self, instanceData, usage=GL_STREAM_DRAW):
+        """Uploads per instance data, one row of floats per instance"""
+
+        instanceData = np.ascontiguousarray(instanceData, dtype=np.float32)
+        self.instanceCount = len(instanceData)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceVbo)
+        glBufferData(GL_ARRAY_BUFFER, instanceData.nbytes, instanceData, usage)
+
+    def clear(self):
+        """Freeing GPU memory owned by the instances, the original GPUShape is not modified"""
+
+        glDeleteBuffers(1, [self.instanceVbo])
+        glDeleteVertexArrays(1, [self.vao])
+
+
+def drawElements(shape, mode=None, instanceCount=None):
+    """
+    Draws the indices of a GPUShape, or the instances of an InstancedGPUShape, with its VAO bound.
+    The primitive mode of the shape is used unless another one is given.
+    Strips are drawn with primitive restart enabled, so a single call draws all of them.
+    """
+    if mode is None:
+        mode = shape.mode
+
+    restart = shape.mode in STRIP_MODES
+    if restart:
+        glEnable(GL_PRIMITIVE_RESTART)
+        glPrimitiveRestartIndex(st.RESTART_INDEX)
+
+    if instanceCount is None:
+        glDrawElements(mode, shape.size, GL_UNSIGNED_INT, None)
+    else:
+        glDrawElementsInstanced(mode, shape.size, GL_UNSIGNED_INT, None, instanceCount)
+
+    if restart:
+        glDisable(GL_PRIMITIVE_RESTART)
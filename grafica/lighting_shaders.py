@@ -3,7 +3,7 @@
 
 from OpenGL.GL import *
 import OpenGL.GL.shaders
-from grafica.gpu_shape import GPUShape
+from grafica.gpu_shape import GPUShape, drawElements
 
 class SimpleFlatShaderProgram():
 
@@ -108,12 +108,12 @@ class SimpleFlatShaderProgram():
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -229,14 +229,14 @@ class SimpleTextureFlatShaderProgram():
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -345,12 +345,12 @@ class SimpleGouraudShaderProgram():
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -466,14 +466,14 @@ class SimpleTextureGouraudShaderProgram():
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -588,12 +588,12 @@ class SimplePhongShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -712,14 +712,14 @@ class SimpleTexturePhongShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_2D, gpuShape.texture)
 
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        drawElements(gpuShape, mode)
 
         # Unbind the current VAO
         glBindVertexArray(0)
@@ -0,0 +1,272 @@
+# coding=utf-8
+"""
+Binary mesh files and a cache of imported meshes.
+
+A mesh file has a fixed header, the vertex layout as text, and the vertex (float32)
+and index (uint32) blocks aligned to 64 bytes. Those blocks are memory mapped when
+loading, so they go from disk to glBufferData without building Python objects.
+
+The cache keeps a mesh file per imported source. An entry is valid while the source
+keeps its modification time and size, or, if those changed, its content hash.
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import numpy as np
+import grafica.basic_shapes as bs
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+MAGIC = b"GRAFMESH"
+VERSION = 1
+ALIGNMENT = 64
+
+# magic, version, stride, vertex count, index count, vertex offset, index offset,
+# source modification time (ns), source size, source hash, layout length
+_HEADER = struct.Struct("<8sIIQQQQqQ32sI")
+_SOURCE_TIME_OFFSET = struct.calcsize("<8sIIQQQQ")
+
+
+class MeshData:
+    """
+    Vertices (V,stride) float32 and indices (N,) uint32 of a mesh file, as memory mapped arrays.
+    The layout is a list of (attribute name, floats), e.g. [("position", 3), ("normal", 3)].
+    """
+    def __init__(self, vertices, indices, layout):
+        self.vertices = vertices
+        self.indices = indices
+        self.layout = layout
+
+    @property
+    def stride(self):
+        return sum(size for _, size in self.layout)
+
+    def toShape(self):
+        """Shape referencing the same arrays, ready for GPUShape.fillBuffers"""
+        return bs.Shape(self.vertices.reshape(-1), self.indices)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encodeLayout(layout):
+    return ",".join(name + ":" + str(size) for name, size in layout).encode("utf-8")
+
+
+def _decodeLayout(text):
+    if len(text) == 0:
+        return []
+    return [(name, int(size)) for name, size in (item.split(":") for item in text.decode("utf-8").split(","))]
+
+
+def fileHash(filename, blockSize=1 << 20):
+    """32 bytes BLAKE2b digest of the content of a file"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(blockSize), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def atomicWrite(filename, write):
+    """
+    Calls write(file) on a new temporary file in the directory of filename, then renames it
+    to filename, so readers never see it half written. Every writer has its own temporary
+    file, so threads or processes may write the same file at once. It is removed on errors.
+    """
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            write(file)
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def writeMesh(filename, vertices, indices, layout, sourceTime=0, sourceSize=0, sourceHash=b""):
+    """
+    Writes a mesh file. The vertices are (V,stride) or flat floats matching the layout.
+    The file is written with atomicWrite, so readers never see it half written.
+    """
+    stride = sum(size for _, size in layout)
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape((-1, stride))
+    indices = np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1)
+    layoutText = _encodeLayout(layout)
+
+    vertexOffset = _align(_HEADER.size + len(layoutText))
+    indexOffset = _align(vertexOffset + vertices.nbytes)
+    header = _HEADER.pack(MAGIC, VERSION, stride, len(vertices), len(indices), vertexOffset, indexOffset,
+        sourceTime, sourceSize, sourceHash, len(layoutText))
+
+    def write(file):
+        file.write(header)
+        file.write(layoutText)
+        file.seek(vertexOffset)
+        file.write(vertices.data)
+        file.seek(indexOffset)
+        file.write(indices.data)
+
+    atomicWrite(filename, write)
+
+
+def readHeader(filename):
+    """Header fields of a mesh file as a dictionary, None if it is not a valid mesh file"""
+    try:
+        with open(filename, "rb") as file:
+            data = file.read(_HEADER.size)
+            if len(data) < _HEADER.size:
+                return None
+            fields = _HEADER.unpack(data)
+            layoutText = file.read(fields[10])
+    except OSError:
+        return None
+
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        return None
+
+    return {
+        "stride": fields[2],
+        "vertexCount": fields[3],
+        "indexCount": fields[4],
+        "vertexOffset": fields[5],
+        "indexOffset": fields[6],
+        "sourceTime": fields[7],
+        "sourceSize": fields[8],
+        "sourceHash": fields[9],
+        "layout": _decodeLayout(layoutText)
+    }
+
+
+def _block(filename, buffer, dtype, offset, shape):
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    if buffer is not None:
+        return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+def readMesh(filename, memoryMap=True):
+    """
+    MeshData of a mesh file. Its arrays are memory mapped, or, without memoryMap,
+    views of the bytes of the file read at once.
+    """
+    header = readHeader(filename)
+    assert header is not None, filename + " is not a mesh file."
+
+    buffer = None
+    if not memoryMap:
+        with open(filename, "rb") as file:
+            buffer = file.read()
+
+    vertices = _block(filename, buffer, np.float32, header["vertexOffset"], (header["vertexCount"], header["stride"]))
+    indices = _block(filename, buffer, np.uint32, header["indexOffset"], (header["indexCount"],))
+    return MeshData(vertices, indices, header["layout"])
+
+
+def sourceMatches(entryPath, header, sourcePath, sourceTimeOffset):
+    """
+    True if a cache entry was built from the current content of its source, given the
+    sourceTime, sourceSize and sourceHash of its header. Sources touched or checked out again
+    keep their entries when the content did not change, the time at sourceTimeOffset is updated.
+    """
+    status = os.stat(sourcePath)
+    if header["sourceTime"] == status.st_mtime_ns and header["sourceSize"] == status.st_size:
+        return True
+
+    if header["sourceSize"] != status.st_size or header["sourceHash"] != fileHash(sourcePath):
+        return False
+
+    with open(entryPath, "r+b") as file:
+        file.seek(sourceTimeOffset)
+        file.write(struct.pack("<q", status.st_mtime_ns))
+    return True
+
+
+def sourceStatus(sourcePath):
+    """(modification time, size) of a source file, to know whether it changed while importing it"""
+    status = os.stat(sourcePath)
+    return status.st_mtime_ns, status.st_size
+
+
+def defaultCacheDirectory():
+    """GRAFICA_MESH_CACHE, or a grafica folder in the user cache directory"""
+    directory = os.environ.get("GRAFICA_MESH_CACHE")
+    if directory is None:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        directory = os.path.join(base, "grafica", "meshes")
+    return directory
+
+
+class MeshCache:
+    """
+    Mesh files of imported sources, stored in a directory.
+    The same source may be imported with several variants (e.g. a color baked in the vertices),
+    each of them being a separate entry.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else defaultCacheDirectory()
+        self.hits = 0
+        self.misses = 0
+
+    def entryPath(self, sourcePath, variant=""):
+        key = (os.path.abspath(sourcePath) + "\n" + variant).encode("utf-8")
+        return os.path.join(self.directory, hashlib.blake2b(key, digest_size=16).hexdigest() + ".mesh")
+
+    def _isValid(self, entryPath, header, sourcePath):
+        return sourceMatches(entryPath, header, sourcePath, _SOURCE_TIME_OFFSET)
+
+    def load(self, sourcePath, importer, variant=""):
+        """
+        MeshData of the source. When there is no valid entry, importer(sourcePath) is called,
+        returning (vertices, indices, layout), and its result is stored.
+        """
+        entryPath = self.entryPath(sourcePath, variant)
+        header = readHeader(entryPath)
+        if header is not None and self._isValid(entryPath, header, sourcePath):
+            self.hits += 1
+            return readMesh(entryPath)
+
+        self.misses += 1
+        sourceTime, sourceSize = sourceStatus(sourcePath)
+        sourceHash = fileHash(sourcePath)
+        vertices, indices, layout = importer(sourcePath)
+        stride = sum(size for _, size in layout)
+        mesh = MeshData(np.asarray(vertices, dtype=np.float32).reshape((-1, stride)),
+            np.asarray(indices, dtype=np.uint32).reshape(-1), layout)
+
+        # The hash must describe the parsed bytes, sources modified meanwhile are not stored
+        if sourceStatus(sourcePath) != (sourceTime, sourceSize):
+            return mesh
+
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            writeMesh(entryPath, mesh.vertices, mesh.indices, layout, sourceTime, sourceSize, sourceHash)
+        except PermissionError:
+            # On Windows, an entry memory mapped by other reader can not be replaced
+            return mesh
+        return readMesh(entryPath)
+
+    def clear(self):
+        """Removes all the mesh files of the cache"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".mesh"):
+                os.remove(os.path.join(self.directory, name))
+
+
+_defaultCache = None
+
+
+def defaultCache():
+    """MeshCache used by the readers when no other one is given"""
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = MeshCache()
+    return _defaultCache
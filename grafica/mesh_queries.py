@@ -0,0 +1,154 @@
+# coding=utf-8
+"""
+Topological queries over triangle meshes stored as arrays.
+
+Incidences are kept in CSR (compressed sparse row) form: the entries of row i are
+indices[offsets[i]:offsets[i+1]]. Queries run over whole arrays with numpy or with
+scipy sparse graph routines, instead of walking one Python object per triangle.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
+import grafica.triangle_mesh as tm
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+class MeshTopology:
+    """
+    Vertex and face incidences of a triangle mesh, given as a (F,3) array or a list of Triangle.
+
+    - vertexFaceOffsets, vertexFaces: CSR of the faces around each vertex.
+    - edges: (E,2) unique edges with sorted vertex indices, edgeFaceCounts: faces on each edge.
+    - faceEdges: (F,3) edge of every side ab, bc and ca.
+    - faceAdjacency: sparse (F,F) matrix of faces sharing an edge.
+    - vertexAdjacency: sparse (V,V) matrix of vertices joined by an edge.
+    """
+    def __init__(self, triangles, vertexCount=None):
+        self.triangles = tm.triangleArray(triangles)
+        F = len(self.triangles)
+        V = vertexCount
+        if V is None:
+            V = int(self.triangles.max()) + 1 if F > 0 else 0
+        self.vertexCount = V
+
+        corners = self.triangles.reshape(-1)
+
+        # Vertex to face, sorting the corners by vertex
+        order = np.argsort(corners, kind="stable")
+        self.vertexFaces = order // 3
+        self.vertexFaceOffsets = np.zeros(V + 1, dtype=np.int64)
+        np.cumsum(np.bincount(corners, minlength=V), out=self.vertexFaceOffsets[1:])
+
+        # Unique edges, from the packed keys of all the sides
+        heads = self.triangles[:, [1, 2, 0]].reshape(-1)
+        keys = np.minimum(corners, heads) * V + np.maximum(corners, heads)
+        edgeKeys, sideEdges, self.edgeFaceCounts = np.unique(keys, return_inverse=True, return_counts=True)
+        self.edges = np.stack((edgeKeys // V, edgeKeys % V), axis=1) if V > 0 else np.zeros((0, 2), dtype=np.int64)
+        self.faceEdges = sideEdges.reshape((F, 3))
+
+        # Faces sharing an edge are found multiplying the face-edge incidence by its transpose
+        E = len(self.edges)
+        faceEdgeIncidence = sparse.csr_matrix(
+            (np.ones(3 * F, dtype=np.int32), (np.repeat(np.arange(F), 3), sideEdges)), shape=(F, E))
+        faceAdjacency = (faceEdgeIncidence @ faceEdgeIncidence.T).tocsr()
+        self.faceAdjacency = faceAdjacency - sparse.diags(faceAdjacency.diagonal(), format="csr", dtype=faceAdjacency.dtype)
+        self.faceAdjacency.eliminate_zeros()
+
+        self.vertexAdjacency = sparse.csr_matrix(
+            (np.ones(2 * E, dtype=np.int8),
+            (np.concatenate((self.edges[:, 0], self.edges[:, 1])),
+            np.concatenate((self.edges[:, 1], self.edges[:, 0])))), shape=(V, V))
+
+    def facesAroundVertex(self, vertex):
+        return self.vertexFaces[self.vertexFaceOffsets[vertex]:self.vertexFaceOffsets[vertex + 1]]
+
+    def oneRing(self, vertex):
+        """Vertices joined to the given vertex by an edge"""
+        adjacency = self.vertexAdjacency
+        return adjacency.indices[adjacency.indptr[vertex]:adjacency.indptr[vertex + 1]]
+
+    def faceNeighbours(self, face):
+        """Faces sharing an edge with the given face"""
+        adjacency = self.faceAdjacency
+        return adjacency.indices[adjacency.indptr[face]:adjacency.indptr[face + 1]]
+
+    def valences(self):
+        """Number of edges at every vertex"""
+        return np.diff(self.vertexAdjacency.indptr)
+
+    def boundaryEdges(self):
+        """(B,2) edges with a single face"""
+        return self.edges[self.edgeFaceCounts == 1]
+
+    def nonManifoldEdges(self):
+        """(N,2) edges shared by more than 2 faces"""
+        return self.edges[self.edgeFaceCounts > 2]
+
+    def isolatedVertices(self):
+        """Vertices not used by any face"""
+        return np.flatnonzero(np.diff(self.vertexFaceOffsets) == 0)
+
+    def boundaryLoops(self):
+        """
+        List of arrays with the vertices of every boundary loop, in the orientation of
+        their faces. Boundaries through non-manifold vertices are split where they branch,
+        so every boundary side belongs to exactly one loop.
+        """
+        boundarySides = np.flatnonzero(self.edgeFaceCounts[self.faceEdges.reshape(-1)] == 1)
+        tails = self.triangles.reshape(-1)[boundarySides]
+        heads = self.triangles[:, [1, 2, 0]].reshape(-1)[boundarySides]
+
+        # CSR of the outgoing boundary sides of every vertex, nextSide is the first one not walked yet
+        order = np.argsort(tails, kind="stable")
+        heads = heads[order].tolist()
+        counts = np.bincount(tails, minlength=self.vertexCount)
+        offsets = np.zeros(self.vertexCount + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        nextSide = offsets[:-1].tolist()
+        ends = offsets[1:].tolist()
+
+        # Walks start at branch vertices, then at the remaining ones
+        starts = np.flatnonzero(counts > 1).tolist() + np.flatnonzero(counts == 1).tolist()
+
+        loops = []
+        for start in starts:
+            while nextSide[start] < ends[start]:
+                path = [start]
+                positions = {start: 0}
+                vertex = start
+                while True:
+                    # Boundaries of faces with inconsistent orientations may end anywhere
+                    if nextSide[vertex] == ends[vertex]:
+                        loops.append(np.array(path, dtype=np.int64))
+                        break
+
+                    vertex = heads[nextSide[vertex]]
+                    nextSide[path[-1]] += 1
+                    if vertex not in positions:
+                        positions[vertex] = len(path)
+                        path.append(vertex)
+                        continue
+
+                    # Back to a vertex of the path, the loop since then is closed there
+                    i = positions[vertex]
+                    loops.append(np.array(path[i:], dtype=np.int64))
+                    for removed in path[i + 1:]:
+                        del positions[removed]
+                    del path[i + 1:]
+                    if len(path) == 1:
+                        break
+        return loops
+
+    def connectedComponents(self):
+        """Returns the number of edge connected components and the component of every face"""
+        return csgraph.connected_components(self.faceAdjacency, directed=False)
+
+    def isClosed(self):
+        return bool(np.all(self.edgeFaceCounts == 2))
+
+    def isManifold(self):
+        """True when every edge has 1 or 2 faces. Vertices joining separate fans are not detected."""
+        return bool(np.all(self.edgeFaceCounts <= 2))
@@ -0,0 +1,159 @@
+# coding=utf-8
+"""
+Vertex normals for triangle meshes stored as arrays: positions (V,3) and triangles (F,3).
+
+Normals are accumulated over all the triangles at once with numpy, so meshes loaded
+without normals, or generated from samples, can be drawn with the lighting pipelines.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
+import grafica.basic_shapes as bs
+import grafica.triangle_mesh as tm
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+AREA_WEIGHTED = "area"
+ANGLE_WEIGHTED = "angle"
+
+
+def _normalize(vectors):
+    lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(lengths > 0, lengths, 1)
+
+
+def faceNormals(positions, triangles, normalize=True):
+    """(F,3) normals of the triangles. Without normalization, their length is twice the triangle area"""
+    positions = np.asarray(positions, dtype=np.float32)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+
+    a = positions[triangles[:, 0]]
+    normals = np.cross(positions[triangles[:, 1]] - a, positions[triangles[:, 2]] - a)
+    return _normalize(normals) if normalize else normals
+
+
+def cornerAngles(positions, triangles):
+    """(F,3) interior angle of every triangle at its vertices a, b and c"""
+    positions = np.asarray(positions, dtype=np.float32)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+
+    # Squared lengths of the sides opposite to a, b and c
+    a = positions[triangles[:, 0]]
+    b = positions[triangles[:, 1]]
+    c = positions[triangles[:, 2]]
+    opposite = np.stack((
+        np.sum((c - b) ** 2, axis=1),
+        np.sum((a - c) ** 2, axis=1),
+        np.sum((b - a) ** 2, axis=1)), axis=1)
+
+    # Law of cosines, the adjacent sides of each corner are the other two
+    adjacent = np.roll(opposite, -1, axis=1) * np.roll(opposite, 1, axis=1)
+    cosines = (np.roll(opposite, -1, axis=1) + np.roll(opposite, 1, axis=1) - opposite) / \
+        (2 * np.sqrt(np.where(adjacent > 0, adjacent, 1)))
+    return np.arccos(np.clip(cosines, -1, 1))
+
+
+def _cornerContributions(positions, triangles, weighting):
+    """(3F,3) weighted face normal that every corner adds to its vertex"""
+    normals = faceNormals(positions, triangles, normalize=False)
+
+    if weighting == AREA_WEIGHTED:
+        return np.repeat(normals, 3, axis=0)
+
+    assert weighting == ANGLE_WEIGHTED, "Unknown weighting: " + str(weighting)
+    angles = cornerAngles(positions, triangles).reshape(-1)
+    return np.repeat(_normalize(normals), 3, axis=0) * angles[:, np.newaxis]
+
+
+def smoothNormals(positions, triangles, weighting=AREA_WEIGHTED):
+    """
+    (V,3) vertex normals averaging the normals of the triangles around each vertex,
+    weighted by the triangle area or by the triangle angle at the vertex.
+    """
+    positions = np.asarray(positions, dtype=np.float32)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    contributions = _cornerContributions(positions, triangles, weighting)
+
+    corners = triangles.reshape(-1)
+    V = len(positions)
+    normals = np.stack([
+        np.bincount(corners, weights=contributions[:, i], minlength=V) for i in range(3)], axis=1)
+    return _normalize(normals).astype(np.float32)
+
+
+def flatNormals(positions, triangles):
+    """
+    Vertices are not shared among triangles, so each one takes the normal of its triangle.
+    Returns (vertexIndices, normals, newTriangles), where vertexIndices maps every new vertex
+    to the original one, so any other attribute is expanded as attribute[vertexIndices].
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    normals = np.repeat(faceNormals(positions, triangles), 3, axis=0)
+    newTriangles = np.arange(triangles.size, dtype=np.int64).reshape((-1, 3))
+    return triangles.reshape(-1), normals.astype(np.float32), newTriangles
+
+
+def creaseNormals(positions, triangles, creaseAngle, weighting=AREA_WEIGHTED):
+    """
+    Smooth normals that keep hard edges: the mesh is split along edges where adjacent
+    triangles meet at more than creaseAngle radians, and along its boundaries.
+    Corners of a vertex still connected through smooth edges share a new vertex.
+    Returns (vertexIndices, normals, newTriangles), as flatNormals does.
+    """
+    positions = np.asarray(positions, dtype=np.float32)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    F = len(triangles)
+    contributions = _cornerContributions(positions, triangles, weighting)
+    units = faceNormals(positions, triangles)
+
+    # Smooth sides, those with a neighbour within the crease angle
+    neighbours = tm.computeNeighbours(triangles)
+    faces, sides = np.nonzero(neighbours >= 0)
+    others = neighbours[faces, sides]
+    smooth = np.sum(units[faces] * units[others], axis=1) >= np.cos(creaseAngle)
+    faces, sides, others = faces[smooth], sides[smooth], others[smooth]
+
+    # Across a smooth side, the corners at both of its vertices are joined
+    links = []
+    for corner in (sides, (sides + 1) % 3):
+        vertices = triangles[faces, corner]
+        otherCorner = np.argmax(triangles[others] == vertices[:, np.newaxis], axis=1)
+        links.append((3 * faces + corner, 3 * others + otherCorner))
+    linkA = np.concatenate([link[0] for link in links])
+    linkB = np.concatenate([link[1] for link in links])
+
+    graph = sparse.csr_matrix((np.ones(len(linkA), dtype=np.int8), (linkA, linkB)), shape=(3 * F, 3 * F))
+    count, labels = csgraph.connected_components(graph, directed=False)
+
+    normals = np.stack([
+        np.bincount(labels, weights=contributions[:, i], minlength=count) for i in range(3)], axis=1)
+
+    corners = triangles.reshape(-1)
+    vertexIndices = np.zeros(count, dtype=np.int64)
+    vertexIndices[labels] = corners
+    return vertexIndices, _normalize(normals).astype(np.float32), labels.reshape((F, 3))
+
+
+def createNormalsShape(positions, triangles, color, creaseAngle=None, weighting=AREA_WEIGHTED):
+    """
+    Shape with positions, colors and normals per vertex (the layout of the lighting pipelines)
+    stored in numpy arrays. creaseAngle=0 gives flat normals, None smooth normals.
+    """
+    positions = np.asarray(positions, dtype=np.float32)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+
+    if creaseAngle is None:
+        vertexIndices = np.arange(len(positions))
+        normals = smoothNormals(positions, triangles, weighting)
+        newTriangles = triangles
+    elif creaseAngle == 0:
+        vertexIndices, normals, newTriangles = flatNormals(positions, triangles)
+    else:
+        vertexIndices, normals, newTriangles = creaseNormals(positions, triangles, creaseAngle, weighting)
+
+    colors = np.broadcast_to(np.asarray(color, dtype=np.float32), (len(vertexIndices), 3))
+    vertices = np.hstack((positions[vertexIndices], colors, normals))
+
+    return bs.Shape(vertices.reshape(-1), newTriangles.reshape(-1).astype(np.uint32))
@@ -0,0 +1,292 @@
+# coding=utf-8
+"""
+Wavefront OBJ reader building indexed meshes with numpy.
+
+The file is read in chunks of whole lines. Consecutive lines of the same kind (v, vt, vn or f)
+are parsed together as a single block of text with numpy, so there is no Python work per line.
+Faces with more than 3 vertices are triangulated as fans, and every distinct combination of
+position, texture coordinates and normal becomes a vertex of the indexed mesh.
+"""
+
+import numpy as np
+import grafica.basic_shapes as bs
+import grafica.normals as nm
+import grafica.mesh_cache as mc
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+CHUNK_SIZE = 1 << 22
+
+# Kinds of lines, the others (comments, groups, materials...) are ignored
+OTHER = 0
+POSITION = 1
+TEXTURE = 2
+NORMAL = 3
+FACE = 4
+
+_PREFIXES = {POSITION: b"v", TEXTURE: b"vt", NORMAL: b"vn", FACE: b"f"}
+_SLASHES_AS_SPACES = bytes.maketrans(b"/", b" ")
+
+# Vertex layouts of the shapes built by OBJMesh
+COLOR_LAYOUT = [("position", 3), ("color", 3), ("normal", 3)]
+TEXTURE_LAYOUT = [("position", 3), ("texCoords", 2), ("normal", 3)]
+
+
+class OBJMesh:
+    """
+    Indexed triangle mesh read from an OBJ file.
+
+    - positions: (V,3) float32, texCoords: (V,2) float32 or None, normals: (V,3) float32 or None.
+    - triangles: (F,3) indices of the vertices, counterclockwise as in the file.
+    - positionIndices: (V,) position of the file used by every vertex. Vertices split
+      by texture or normal seams share it, so missing normals are smooth across seams.
+    """
+    def __init__(self, positions, texCoords, normals, triangles, positionIndices):
+        self.positions = positions
+        self.texCoords = texCoords
+        self.normals = normals
+        self.triangles = triangles
+        self.positionIndices = positionIndices
+
+    def computeNormals(self, weighting=nm.AREA_WEIGHTED):
+        """Smooth normals, used when the file does not define them"""
+        uniquePositions = np.zeros((int(np.max(self.positionIndices, initial=-1)) + 1, 3), dtype=np.float32)
+        uniquePositions[self.positionIndices] = self.positions
+        normals = nm.smoothNormals(uniquePositions, self.positionIndices[self.triangles], weighting)
+        self.normals = normals[self.positionIndices]
+        return self.normals
+
+    def _shape(self, attributes):
+        if self.normals is None:
+            self.computeNormals()
+        vertices = np.hstack([self.positions] + attributes + [self.normals]).astype(np.float32)
+        return bs.Shape(vertices.reshape(-1), self.triangles.reshape(-1).astype(np.uint32))
+
+    def toShape(self, color):
+        """Shape with positions, the given color and normals, for the lighting pipelines"""
+        colors = np.broadcast_to(np.asarray(color, dtype=np.float32), (len(self.positions), 3))
+        return self._shape([colors])
+
+    def toTextureShape(self):
+        """Shape with positions, texture coordinates and normals, for the textured lighting pipelines"""
+        assert self.texCoords is not None, "The mesh has no texture coordinates."
+        return self._shape([self.texCoords])
+
+
+def _lineKinds(data, lineStarts):
+    """Kind of every line from its first 3 bytes"""
+    padded = np.concatenate((data, np.zeros(3, dtype=np.uint8)))
+    first = padded[lineStarts]
+    second = padded[lineStarts + 1]
+    third = padded[lineStarts + 2]
+
+    kinds = np.full(len(lineStarts), OTHER, dtype=np.int8)
+    kinds[(first == ord("v")) & (second <= 32)] = POSITION
+    kinds[(first == ord("v")) & (second == ord("t")) & (third <= 32)] = TEXTURE
+    kinds[(first == ord("v")) & (second == ord("n")) & (third <= 32)] = NORMAL
+    kinds[(first == ord("f")) & (second <= 32)] = FACE
+    return kinds
+
+
+def _tokenStarts(data):
+    """Positions where a token starts, whitespace and newlines being separators"""
+    separators = data <= 32
+    starts = np.flatnonzero(separators[:-1] & ~separators[1:]) + 1
+    if len(data) > 0 and not separators[0]:
+        starts = np.concatenate(([0], starts))
+    return starts
+
+
+def _parseValues(text, lines, columns):
+    """(lines, columns) floats of lines with the prefix removed. Extra values are dropped"""
+    values = np.fromstring(text, dtype=np.float64, sep=" ")
+    if len(values) == lines * columns:
+        return values.reshape((lines, columns))
+
+    # Lines with a different number of values, as positions with colors or 3D texture coordinates
+    data = np.frombuffer(text, dtype=np.uint8)
+    tokenLines = np.searchsorted(np.flatnonzero(data == ord("\n")), _tokenStarts(data))
+    counts = np.bincount(tokenLines, minlength=lines)
+    assert np.all(counts >= columns), "Lines with less than " + str(columns) + " values."
+    offsets = np.cumsum(counts) - counts
+    return values[offsets[:, np.newaxis] + np.arange(columns)]
+
+
+def _parseFaces(text, lines):
+    """
+    Corners of face lines as (C,3) indices of position, texture coordinates and normal,
+    0 when missing, and the number of corners of every face.
+    """
+    original = np.frombuffer(text, dtype=np.uint8)
+    text = text.translate(_SLASHES_AS_SPACES)
+    data = np.frombuffer(text, dtype=np.uint8)
+    values = np.fromstring(text, dtype=np.int32, sep=" ")
+    starts = _tokenStarts(data)
+    assert len(values) == len(starts), "Malformed face."
+
+    # A value after a space starts a corner: v, v/vt, v/vt/vn or v//vn.
+    # The first byte of a face text is always the space replacing its prefix
+    before = original[starts - 1]
+    cornerStarts = before <= 32
+    afterDoubleSlash = (before == ord("/")) & (original[starts - 2] == ord("/"))
+
+    cornerIds = np.cumsum(cornerStarts) - 1
+    firstValues = np.flatnonzero(cornerStarts)
+    fields = np.arange(len(values)) - firstValues[cornerIds] + afterDoubleSlash
+    assert np.all(fields < 3), "Malformed face."
+
+    corners = np.zeros((len(firstValues), 3), dtype=np.int64)
+    corners[cornerIds, fields] = values
+
+    cornerCounts = np.bincount(np.searchsorted(np.flatnonzero(data == ord("\n")), starts[cornerStarts]), minlength=lines)
+    return corners, cornerCounts
+
+
+def _fans(cornerCounts):
+    """(T,3) corners of the triangles of every face, as fans around its first corner"""
+    triangleCounts = np.maximum(cornerCounts - 2, 0)
+    faceStarts = np.cumsum(cornerCounts) - cornerCounts
+    firsts = np.repeat(faceStarts, triangleCounts)
+    steps = np.arange(np.sum(triangleCounts)) - np.repeat(np.cumsum(triangleCounts) - triangleCounts, triangleCounts)
+    return np.stack((firsts, firsts + steps + 1, firsts + steps + 2), axis=1)
+
+
+class _OBJParser:
+    """Blocks of values and faces read so far, faces referencing the elements defined before them"""
+    def __init__(self):
+        self.blocks = {POSITION: [], TEXTURE: [], NORMAL: []}
+        self.counts = {POSITION: 0, TEXTURE: 0, NORMAL: 0}
+        self.corners = []
+        self.triangles = []
+        self.cornerCount = 0
+
+    def parse(self, chunk):
+        """Parses a chunk of whole lines"""
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        lineEnds = np.flatnonzero(data == ord("\n"))
+        lineStarts = np.concatenate(([0], lineEnds[:-1] + 1))
+        kinds = _lineKinds(data, lineStarts)
+
+        # Runs of consecutive lines of the same kind
+        changes = np.flatnonzero(np.diff(kinds)) + 1
+        runStarts = np.concatenate(([0], changes))
+        runEnds = np.concatenate((changes, [len(kinds)]))
+
+        for kind, first, last in zip(kinds[runStarts].tolist(), runStarts.tolist(), runEnds.tolist()):
+            if kind == OTHER:
+                continue
+
+            lines = last - first
+            prefix = _PREFIXES[kind]
+            # Only prefixes at line starts, values as inf hold an 'f' too
+            text = (b"\n" + chunk[lineStarts[first]:lineEnds[last - 1] + 1]).replace(
+                b"\n" + prefix, b"\n" + b" " * len(prefix))[1:]
+
+            if kind == FACE:
+                self._addFaces(text, lines)
+            else:
+                values = _parseValues(text, lines, 2 if kind == TEXTURE else 3)
+                self.blocks[kind].append(values.astype(np.float32))
+                self.counts[kind] += lines
+
+    def _addFaces(self, text, lines):
+        corners, cornerCounts = _parseFaces(text, lines)
+
+        # OBJ indices start at 1, negative ones count backwards from the last element defined
+        for column, kind in enumerate((POSITION, TEXTURE, NORMAL)):
+            indices = corners[:, column]
+            corners[:, column] = np.where(indices < 0, indices + self.counts[kind], indices - 1)
+
+        self.corners.append(corners)
+        self.triangles.append(_fans(cornerCounts) + self.cornerCount)
+        self.cornerCount += len(corners)
+
+    def mesh(self):
+        positions, texCoords, normals = [
+            np.concatenate(self.blocks[kind]) if len(self.blocks[kind]) > 0 else np.zeros((0, columns), dtype=np.float32)
+            for kind, columns in ((POSITION, 3), (TEXTURE, 2), (NORMAL, 3))]
+        corners = np.concatenate(self.corners) if len(self.corners) > 0 else np.zeros((0, 3), dtype=np.int64)
+        triangles = np.concatenate(self.triangles) if len(self.triangles) > 0 else np.zeros((0, 3), dtype=np.int64)
+
+        # Missing texture coordinates or normals were read as -1
+        assert np.all((corners[:, 0] >= 0) & (corners[:, 0] < len(positions))), "Position index out of range."
+        for column, elements in ((1, texCoords), (2, normals)):
+            assert np.all((corners[:, column] >= -1) & (corners[:, column] < len(elements))), "Face index out of range."
+
+        hasTexCoords = bool(np.any(corners[:, 1] >= 0))
+        hasNormals = len(corners) > 0 and bool(np.all(corners[:, 2] >= 0))
+
+        # Distinct corners become the vertices of the indexed mesh
+        columns = [0] + [1] * hasTexCoords + [2] * hasNormals
+        sizes = [len(positions), len(texCoords) + 1, len(normals) + 1]
+
+        if np.prod([float(sizes[column]) for column in columns]) < 2 ** 62:
+            keys = np.zeros(len(corners), dtype=np.int64)
+            for column in columns:
+                keys = keys * sizes[column] + corners[:, column] + (column > 0)
+            _, firstCorners, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        else:
+            _, firstCorners, inverse = np.unique(corners[:, columns], axis=0, return_index=True, return_inverse=True)
+
+        vertexCorners = corners[firstCorners]
+        positionIndices = vertexCorners[:, 0]
+        meshTexCoords = None
+        if hasTexCoords:
+            meshTexCoords = np.where(vertexCorners[:, 1:2] >= 0, texCoords[vertexCorners[:, 1]], 0).astype(np.float32)
+        meshNormals = normals[vertexCorners[:, 2]] if hasNormals else None
+
+        return OBJMesh(positions[positionIndices], meshTexCoords, meshNormals,
+            inverse.reshape(-1)[triangles], positionIndices)
+
+
+def loadOBJ(filename, chunkSize=CHUNK_SIZE):
+    """Reads an OBJ file into an OBJMesh, chunkSize bytes at a time"""
+    parser = _OBJParser()
+    remainder = b""
+
+    with open(filename, "rb") as file:
+        while True:
+            chunk = file.read(chunkSize)
+            if len(chunk) == 0:
+                break
+
+            # Lines crossing the end of the chunk are parsed with the next one
+            chunk = remainder + chunk
+            end = chunk.rfind(b"\n") + 1
+            remainder = chunk[end:]
+            if end > 0:
+                parser.parse(chunk[:end])
+
+    if len(remainder.strip()) > 0:
+        parser.parse(remainder + b"\n")
+
+    return parser.mesh()
+
+
+def _readCached(filename, cache, variant, layout, build):
+    """
+    Shape built from the file. With a cache, the default one when cache is True or the given
+    MeshCache, it is stored there and later calls load it memory mapped instead of parsing the file.
+    """
+    if cache is None or cache is False:
+        return build(filename)
+    if cache is True:
+        cache = mc.defaultCache()
+
+    def importer(path):
+        shape = build(path)
+        return shape.vertices, shape.indices, layout
+
+    return cache.load(filename, importer, variant).toShape()
+
+
+def readOBJ(filename, color, cache=False):
+    """Shape with positions, a color and normals per vertex, for the lighting pipelines"""
+    variant = "color " + ",".join(repr(float(value)) for value in color)
+    return _readCached(filename, cache, variant, COLOR_LAYOUT, lambda path: loadOBJ(path).toShape(color))
+
+
+def readTextureOBJ(filename, cache=False):
+    """Shape with positions, texture coordinates and normals per vertex, for the textured lighting pipelines"""
+    return _readCached(filename, cache, "texture", TEXTURE_LAYOUT, lambda path: loadOBJ(path).toTextureShape())
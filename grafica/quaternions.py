@@ -0,0 +1,178 @@
+# coding=utf-8
+"""
+Unit quaternions to represent and interpolate rotations.
+
+A quaternion is stored as an array (w, x, y, z), w being the scalar part.
+Every function also works on (N,4) arrays, operating on all the quaternions at once,
+so orientations of many animated objects are handled with a few numpy calls.
+"""
+
+import numpy as np
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+def identity(count=None):
+    """Quaternion with no rotation, or a (count,4) array of them"""
+    shape = (4,) if count is None else (count, 4)
+    q = np.zeros(shape, dtype=np.float32)
+    q[..., 0] = 1
+    return q
+
+
+def fromAxisAngle(axis, theta):
+    """Rotation of theta radians around a normalized axis. axis may be (N,3) and theta (N,)"""
+    axis = np.asarray(axis, dtype=np.float32)
+    halfTheta = 0.5 * np.asarray(theta, dtype=np.float32)
+    s = np.sin(halfTheta)[..., np.newaxis]
+    w = np.cos(halfTheta)[..., np.newaxis]
+    vector = axis * s
+    w = np.broadcast_to(w, vector.shape[:-1] + (1,))
+    return np.concatenate((w, vector), axis=-1)
+
+
+def fromEuler(rotations):
+    """
+    Quaternions from (...,3) XYZ euler angles in radians, giving the same rotation as
+    rotationZ(rz) @ rotationY(ry) @ rotationX(rx)
+    """
+    rotations = np.asarray(rotations, dtype=np.float32)
+    c = np.cos(0.5 * rotations)
+    s = np.sin(0.5 * rotations)
+    cx, cy, cz = c[..., 0], c[..., 1], c[..., 2]
+    sx, sy, sz = s[..., 0], s[..., 1], s[..., 2]
+
+    return np.stack((
+        cx * cy * cz + sx * sy * sz,
+        sx * cy * cz - cx * sy * sz,
+        cx * sy * cz + sx * cy * sz,
+        cx * cy * sz - sx * sy * cz), axis=-1)
+
+
+def multiply(a, b):
+    """Hamilton product a * b, the rotation b followed by a"""
+    a = np.asarray(a)
+    b = np.asarray(b)
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+
+    return np.stack((
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw), axis=-1)
+
+
+def conjugate(q):
+    """Inverse rotation of a unit quaternion"""
+    q = np.array(q)
+    q[..., 1:] *= -1
+    return q
+
+
+def normalize(q):
+    q = np.asarray(q)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def dot(a, b):
+    return np.sum(np.asarray(a) * np.asarray(b), axis=-1)
+
+
+def nlerp(a, b, t):
+    """
+    Normalized linear interpolation between unit quaternions, following the shortest arc.
+    Cheaper than slerp, it does not keep a constant angular speed.
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    t = np.asarray(t)[..., np.newaxis]
+
+    # q and -q are the same rotation, the closest one to a is taken
+    sign = np.where(dot(a, b) < 0, -1, 1)[..., np.newaxis]
+    return normalize(a + t * (sign * b - a))
+
+
+def slerp(a, b, t):
+    """Spherical linear interpolation between unit quaternions, following the shortest arc"""
+    a = np.asarray(a)
+    b = np.asarray(b)
+    t = np.asarray(t)
+
+    cosTheta = dot(a, b)
+    sign = np.where(cosTheta < 0, -1, 1)
+    cosTheta = np.minimum(np.abs(cosTheta), 1)
+
+    theta = np.arccos(cosTheta)
+    sinTheta = np.sin(theta)
+
+    # Almost equal rotations are linearly interpolated, avoiding divisions by sinTheta
+    close = sinTheta < 1e-4
+    safeSin = np.where(close, 1, sinTheta)
+    weightA = np.where(close, 1 - t, np.sin((1 - t) * theta) / safeSin)
+    weightB = np.where(close, t, np.sin(t * theta) / safeSin) * sign
+
+    q = weightA[..., np.newaxis] * a + weightB[..., np.newaxis] * b
+    return normalize(q)
+
+
+def rotate(q, vectors):
+    """Rotates (...,3) vectors by unit quaternions"""
+    q = np.asarray(q)
+    vectors = np.asarray(vectors)
+    w = q[..., 0:1]
+    u = q[..., 1:]
+
+    uv = np.cross(u, vectors)
+    return vectors + 2 * (w * uv + np.cross(u, uv))
+
+
+def toMatrix(q, out=None):
+    """4x4 rotation matrices, as (...,4,4) arrays like the ones of grafica.transformations"""
+    q = np.asarray(q)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    if out is None:
+        out = np.zeros(q.shape[:-1] + (4, 4), dtype=np.float32)
+    else:
+        out[...] = 0
+
+    out[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    out[..., 0, 1] = 2 * (x * y - w * z)
+    out[..., 0, 2] = 2 * (x * z + w * y)
+    out[..., 1, 0] = 2 * (x * y + w * z)
+    out[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    out[..., 1, 2] = 2 * (y * z - w * x)
+    out[..., 2, 0] = 2 * (x * z - w * y)
+    out[..., 2, 1] = 2 * (y * z + w * x)
+    out[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    out[..., 3, 3] = 1
+    return out
+
+
+def fromMatrix(matrices):
+    """Unit quaternions of the rotation part of (...,4,4) or (...,3,3) matrices without scaling"""
+    m = np.asarray(matrices)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    # Shepperd's method: each row divides by the biggest of 4w², 4x², 4y², 4z²,
+    # so it is accurate everywhere, including half turns where w is 0
+    trace = m00 + m11 + m22
+    diagonal = np.stack((trace, m00, m11, m22), axis=-1)
+    s = 2 * np.sqrt(np.maximum(1 + 2 * diagonal - trace[..., None], 1e-12))
+    a, b, c = m21 - m12, m02 - m20, m10 - m01
+    d, e, f = m01 + m10, m02 + m20, m12 + m21
+    candidates = np.stack((
+        np.stack((s[..., 0] / 4, a / s[..., 0], b / s[..., 0], c / s[..., 0]), axis=-1),
+        np.stack((a / s[..., 1], s[..., 1] / 4, d / s[..., 1], e / s[..., 1]), axis=-1),
+        np.stack((b / s[..., 2], d / s[..., 2], s[..., 2] / 4, f / s[..., 2]), axis=-1),
+        np.stack((c / s[..., 3], e / s[..., 3], f / s[..., 3], s[..., 3] / 4), axis=-1)), axis=-2)
+    best = np.argmax(diagonal, axis=-1)[..., None, None]
+    q = np.take_along_axis(candidates, best, axis=-2)[..., 0, :]
+
+    # q and -q are the same rotation, w >= 0 is kept as before
+    q = np.where(q[..., :1] < 0, -q, q)
+    return normalize(q)
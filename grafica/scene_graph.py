@@ -6,10 +6,149 @@ import OpenGL.GL.shaders
 import numpy as np
 import grafica.transformations as tr
 import grafica.gpu_shape as gs
+import grafica.bounding_volumes as bv
+import grafica.strips as st
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
+# Flags marking cached data of a node that must be recomputed
+DIRTY_BOUNDS = 1
+DIRTY_BAKE = 2
+DIRTY_ALL = DIRTY_BOUNDS | DIRTY_BAKE
+
+# Counter increased on every structural edit of any scene graph,
+# i.e. modifications of childs lists or pipelines of nodes
+_structureRevision = 0
+
+
+def structureRevision(node=None):
+    """Structure revision of all the scene graphs, or of the subtree below the given node"""
+    if node is not None:
+        return node._structureRevision
+    return _structureRevision
+
+
+def _ancestors(nodes):
+    """The nodes and all their ancestors, shared nodes reached through several paths appear once"""
+    pending = list(nodes)
+    visited = {}
+    while pending:
+        node = pending.pop()
+        if id(node) in visited:
+            continue
+        visited[id(node)] = node
+        pending += node._parents
+    return visited.values()
+
+
+def _structureChanged(nodes):
+    """Counts a structural edit of the nodes on them, all their ancestors and the global counter"""
+    global _structureRevision
+    _structureRevision += 1
+    for node in _ancestors(nodes):
+        node._structureRevision += 1
+
+
+# Counter increased every time node transforms are moved to a different storage
+_bindingRevision = 0
+
+
+def bindingRevision():
+    return _bindingRevision
+
+
+def _markDirty(nodes, flags):
+    """Flags the given nodes and all their ancestors.
+    Propagation stops on nodes already flagged, as their ancestors are flagged too."""
+
+    pending = list(nodes)
+    while pending:
+        node = pending.pop()
+        if node._dirty & flags == flags:
+            continue
+        node._dirty |= flags
+        pending += node._parents
+
+
+class _ChildList(list):
+    """
+    List of childs of a SceneGraphNode.
+    It behaves as a regular list, but it keeps the parent references
+    of its child nodes and flags the owner when it is modified.
+    """
+    def __init__(self, owner, childs=()):
+        super().__init__(childs)
+        self._owner = owner
+        for child in self:
+            self._link(child)
+
+    def _link(self, child):
+        if isinstance(child, (SceneGraphNode, gs.GPUShape)):
+            child._parents.append(self._owner)
+
+    def _unlink(self, child):
+        if isinstance(child, (SceneGraphNode, gs.GPUShape)):
+            child._parents.remove(self._owner)
+
+    def _modified(self):
+        _markDirty([self._owner], DIRTY_ALL)
+        _structureChanged([self._owner])
+
+    def _relinkAfter(self, operation, *args):
+        # Generic path for modifications where the affected childs are not obvious
+        for child in self:
+            self._unlink(child)
+        result = operation(self, *args)
+        for child in self:
+            self._link(child)
+        self._modified()
+        return result
+
+    def append(self, child):
+        super().append(child)
+        self._link(child)
+        self._modified()
+
+    def extend(self, childs):
+        childs = list(childs)
+        super().extend(childs)
+        for child in childs:
+            self._link(child)
+        self._modified()
+
+    def __iadd__(self, childs):
+        self.extend(childs)
+        return self
+
+    def insert(self, index, child):
+        super().insert(index, child)
+        self._link(child)
+        self._modified()
+
+    def remove(self, child):
+        super().remove(child)
+        self._unlink(child)
+        self._modified()
+
+    def pop(self, index=-1):
+        child = super().pop(index)
+        self._unlink(child)
+        self._modified()
+        return child
+
+    def clear(self):
+        self._relinkAfter(list.clear)
+
+    def __setitem__(self, index, value):
+        self._relinkAfter(list.__setitem__, index, value)
+
+    def __delitem__(self, index):
+        self._relinkAfter(list.__delitem__, index)
+
+    def __imul__(self, factor):
+        return self._relinkAfter(list.__imul__, factor)
+
 
 class SceneGraphNode:
     """
@@ -17,21 +156,325 @@ class SceneGraphNode:
     Each node represents a group of objects
     Each leaf represents a basic figure (GPUShape)
     To identify each node properly, it MUST have a unique name
+    A node may set its own pipeline, used to draw its subtree in render lists
+
+    A static node is drawn as a single GPUShape merging all the geometry below it,
+    with the relative transforms already applied. Its own transform may still change,
+    any other modification of the subtree rebuilds the merged shape when drawn.
+    All its leaves must share the vertex layout and texture. If vertices have normals,
+    staticNormalOffset must indicate where they start, in floats, so they are rotated too.
+
+    node.transform is read only, it is modified by assigning a new matrix, so cached bounds
+    and static shapes are updated. Nodes in a render list keep their transform in a slot of it,
+    there the matrix read follows later assignments, and it must be copied to keep its value.
     """
     def __init__(self, name):
         self.name = name
+        self._pipeline = None
+        self._static = False
+        self.staticNormalOffset = None
+
+        # Nodes referencing this node as a child, and cached data to recompute
+        self._parents = []
+        self._structureRevision = 0
+        self._dirty = DIRTY_ALL
+
+        # Increased when a GPUShape below the node is filled again, see GPUShape.boundsRevision
+        self.boundsRevision = 0
+        self._boundingBox = None
+        self._bakedShape = None
+        self._bakedPipeline = None
+
         self.transform = tr.identity()
         self.childs = []
 
+    @property
+    def transform(self):
+        # In place edits would skip the flags below
+        view = self._transform.view()
+        view.flags.writeable = False
+        return view
+
+    @transform.setter
+    def transform(self, value):
+        # Nodes bound to a storage (see bindTransforms) are written into their slot,
+        # the others get a new matrix, so matrices read before keep their values
+        if hasattr(self, "_transform") and self._transform.base is not None:
+            self._transform[...] = value
+        else:
+            self._transform = np.array(value, dtype=np.float32)
+
+        # The geometry of this node moves inside its parents
+        _markDirty(self._parents, DIRTY_ALL)
+
+    @property
+    def pipeline(self):
+        return self._pipeline
+
+    @pipeline.setter
+    def pipeline(self, value):
+        self._pipeline = value
+        _structureChanged([self])
+
+    @property
+    def static(self):
+        return self._static
+
+    @static.setter
+    def static(self, value):
+        self._static = value
+        if not value:
+            self._clearBakedShape()
+        _structureChanged([self])
+
+    @property
+    def childs(self):
+        return self._childs
+
+    @childs.setter
+    def childs(self, value):
+        # 'node.childs += [...]' assigns back the very same list
+        if value is getattr(self, "_childs", None):
+            return
+
+        if hasattr(self, "_childs"):
+            for child in self._childs:
+                self._childs._unlink(child)
+
+        self._childs = _ChildList(self, value)
+        self._childs._modified()
+
     def clear(self):
         """Freeing GPU memory"""
 
         for child in self.childs:
             child.clear()
 
-            
+        self._clearBakedShape()
+
+    def _shapeModified(self):
+        """Called by GPUShapes of this node when their buffers are filled again"""
+        _markDirty([self], DIRTY_ALL)
+        for node in _ancestors([self]):
+            node.boundsRevision += 1
+
+    def _clearBakedShape(self):
+        if self._bakedShape is not None:
+            # The texture belongs to the original leaves
+            self._bakedShape.texture = None
+            self._bakedShape.clear()
+            self._bakedShape = None
+
+
+def bindTransforms(nodes, replacedStorage=None):
+    """
+    Moves the transforms of the nodes into the rows of a new (N,4,4) array,
+    so nodes[i].transform is storage[i] and writing into the array modifies the nodes.
+    It returns the storage. If it replaces a storage of the caller, it must be given,
+    so nodes in it are not considered as taken from somebody else.
+    After writing into the storage directly, markModified must be called with the
+    parents of the modified nodes (see parentsOf).
+    """
+    storage = np.empty((len(nodes), 4, 4), dtype=np.float32)
+
+    boundElsewhere = False
+    for slot, node in enumerate(nodes):
+        storage[slot] = node.transform
+        base = node._transform.base
+        boundElsewhere |= base is not None and base is not replacedStorage
+        node._transform = storage[slot]
+
+    global _bindingRevision
+    _bindingRevision += 1
+
+    # Render lists holding some of these nodes lost their slots and must be compiled again
+    if boundElsewhere:
+        _structureChanged(nodes)
+
+    return storage
+
+
+def findTransformStorage(nodes):
+    """
+    Returns (storage, slots) if the transforms of all the nodes are rows of the same
+    array, so storage[slots[i]] is nodes[i].transform. Otherwise it returns (None, None).
+    """
+    if len(nodes) == 0:
+        return None, None
+
+    storage = nodes[0]._transform.base
+    if storage is None or storage.ndim != 3 or storage.shape[1:] != (4, 4) \
+            or not storage.flags.c_contiguous:
+        return None, None
+
+    # Each row of the storage is 16 floats
+    start = storage.__array_interface__["data"][0]
+    rowBytes = storage.strides[0]
+    slots = np.empty(len(nodes), dtype=np.int64)
+    for i, node in enumerate(nodes):
+        if node._transform.base is not storage:
+            return None, None
+        slots[i] = (node._transform.__array_interface__["data"][0] - start) // rowBytes
+
+    return storage, slots
+
+
+def parentsOf(nodes):
+    """Nodes having any of the given nodes as a child, without repetitions"""
+
+    parents = {}
+    for node in nodes:
+        for parent in node._parents:
+            parents[id(parent)] = parent
+    return list(parents.values())
+
+
+def markModified(nodes):
+    """Flags cached data (bounds, static shapes) of the nodes and their ancestors as outdated"""
+    _markDirty(nodes, DIRTY_ALL)
+
+
+class CullingStats:
+    """
+    Counters filled by drawSceneGraphNode and RenderList.draw
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """It should be called once per frame, before drawing"""
+        self.culled = 0
+        self.drawn = 0
+        self.drawCalls = 0
+
+    def __str__(self):
+        return f" [drawn: {self.drawn} - culled: {self.culled} - draw calls: {self.drawCalls}]"
+
+
+class LODView:
+    """
+    View information needed to estimate the size of objects on screen
+    """
+    def __init__(self, view, projection, viewportHeight):
+        self.view = np.asarray(view, dtype=np.float32)
+
+        # A sphere of radius r at distance d covers r * scale / d pixels,
+        # or r * scale pixels with an orthographic projection
+        self.scale = float(projection[1][1]) * viewportHeight
+        self.perspective = projection[3][3] == 0
+
+
+class LODNode(SceneGraphNode):
+    """
+    A node drawing one of several versions of the same object (levels of detail),
+    from the most detailed to the coarsest, depending on its size on screen.
+
+    thresholds[i] is the minimum diameter on screen, in pixels, to draw levels[i],
+    the last level is drawn below all thresholds, so there is one threshold less than levels.
+    To avoid popping back and forth, the level changes only when the size
+    crosses a threshold by more than the hysteresis fraction.
+    The bounding sphere of the first level is used to estimate the size on screen.
+    """
+    def __init__(self, name, levels, thresholds, hysteresis=0.1):
+        super().__init__(name)
+
+        assert len(levels) > 0 and all(isinstance(level, gs.GPUShape) for level in levels)
+        assert len(thresholds) == len(levels) - 1, "There must be one threshold less than levels."
+        assert all(thresholds[i] > thresholds[i + 1] for i in range(len(thresholds) - 1)), \
+            "Thresholds must be decreasing."
+
+        self.levels = list(levels)
+        for level in self.levels:
+            level._parents.append(self)
+        self.thresholds = np.array(thresholds, dtype=np.float32)
+        self.hysteresis = hysteresis
+
+        # Number of times each level was drawn, see resetCounts
+        self.drawCounts = np.zeros(len(levels), dtype=np.int64)
+
+        # Level used on the previous frame, for drawSceneGraphNode
+        self._currentLevel = np.zeros(1, dtype=np.int64)
+
+    def resetCounts(self):
+        self.drawCounts[:] = 0
+
+    def projectedSizes(self, worldTransforms, lodView):
+        """Diameters on screen, in pixels, for a stack of (N,4,4) world transforms"""
+
+        sphere = self.levels[0].boundingSphere
+        if sphere is None:
+            return np.full(len(worldTransforms), np.inf, dtype=np.float32)
+
+        linear = worldTransforms[:, :3, :3]
+        centers = linear @ sphere.center + worldTransforms[:, :3, 3]
+
+        # The largest scale factor of each transform enlarges the radius
+        radii = sphere.radius * np.sqrt(np.max(np.sum(linear * linear, axis=1), axis=1))
+        sizes = radii * lodView.scale
+
+        if lodView.perspective:
+            # Distance along the view direction, the camera looks towards -z
+            depths = -(centers @ lodView.view[2, :3] + lodView.view[2, 3])
+            sizes = sizes / np.maximum(depths, 1e-6)
+
+        return sizes
+
+    def selectLevels(self, worldTransforms, lodView, currentLevels):
+        """
+        Levels to draw for a stack of (N,4,4) world transforms, given the levels
+        used on the previous frame. currentLevels is updated in place.
+        """
+        sizes = self.projectedSizes(worldTransforms, lodView)
+
+        # Levels using sizes biased towards the finer and the coarser levels,
+        # the current level is kept while it lies between them
+        finest = np.sum(sizes[:, np.newaxis] * (1 + self.hysteresis) < self.thresholds, axis=1)
+        coarsest = np.sum(sizes[:, np.newaxis] * (1 - self.hysteresis) < self.thresholds, axis=1)
+        np.clip(currentLevels, finest, coarsest, out=currentLevels)
+        return currentLevels
+
+    def clear(self):
+        """Freeing GPU memory"""
+
+        super().clear()
+        for level in self.levels:
+            level.clear()
+
+
+def getBoundingBox(node):
+    """
+    Bounding box of all the geometry below the node, in the coordinates
+    where node.transform is applied, i.e. without including node.transform.
+    It returns None if the extent is unknown (a GPUShape without bounds).
+    The box is cached on the node and recomputed only after changes below it.
+    """
+
+    if isinstance(node, gs.GPUShape):
+        return node.boundingBox
+
+    if isinstance(node, LODNode):
+        return node.levels[0].boundingBox
+
+    if not node._dirty & DIRTY_BOUNDS:
+        return node._boundingBox
+
+    box = None
+    unknown = False
+    for child in node.childs:
+        childBox = getBoundingBox(child)
+        if childBox is None:
+            unknown = True
+            continue
+
+        if isinstance(child, SceneGraphNode):
+            childBox = childBox.transform(child.transform)
+
+        box = bv.mergeBoxes(box, childBox)
+
+    node._boundingBox = None if unknown else box
+    node._dirty &= ~DIRTY_BOUNDS
+    return node._boundingBox
 
-    
 def findNode(node, name):
 
     # The name was not found in this path
@@ -85,12 +528,128 @@ def findPosition(node, name, parentTransform=tr.identity()):
     return None
 
 
-def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identity()):
+def _collectStaticLeaves(node, transform, leaves):
+    """Leaves below the node with their transforms relative to it.
+    Visited nodes are marked as baked."""
+
+    node._dirty &= ~DIRTY_BAKE
+    if isinstance(node, LODNode):
+        leaves.append((node.levels[0], transform))
+
+    for child in node.childs:
+        if isinstance(child, gs.GPUShape):
+            leaves.append((child, transform))
+        else:
+            _collectStaticLeaves(child, np.matmul(transform, child.transform), leaves)
+
+
+def getStaticShape(node, pipeline):
+    """
+    Returns the GPUShape merging all the geometry below a static node,
+    building it again if the subtree was modified since the last time.
+    """
+    assert node.static, "The node " + node.name + " is not static."
+
+    if node._bakedShape is not None and node._bakedPipeline is pipeline \
+            and not node._dirty & DIRTY_BAKE:
+        return node._bakedShape
+
+    leaves = []
+    _collectStaticLeaves(node, tr.identity(), leaves)
+    assert len(leaves) > 0, "The static node " + node.name + " has no geometry."
+
+    stride = leaves[0][0].stride
+    texture = leaves[0][0].texture
+    assert stride is not None, "Unknown vertex layout below the static node " + node.name + "."
+
+    vertexBlocks = []
+    indexBlocks = []
+    offset = 0
+    for gpuShape, transform in leaves:
+        assert gpuShape.stride == stride and gpuShape.texture == texture, \
+            "All the leaves below the static node " + node.name + " must share vertex layout and texture."
+
+        vertexData, indices = gpuShape.readBuffers()
+        vertices = vertexData.reshape((-1, stride)).copy()
+
+        # Strips are merged as independent triangles
+        if gpuShape.mode == GL_TRIANGLE_STRIP:
+            indices = st.unstripify(indices).reshape(-1).astype(np.uint32)
+
+        # Applying the relative transform to positions, and its inverse transpose to normals
+        linear = transform[:3, :3]
+        vertices[:, 0:3] = vertices[:, 0:3] @ linear.T + transform[:3, 3]
+        if node.staticNormalOffset is not None:
+            normalSlice = slice(node.staticNormalOffset, node.staticNormalOffset + 3)
+            normals = vertices[:, normalSlice] @ np.linalg.inv(linear)
+            norms = np.linalg.norm(normals, axis=1, keepdims=True)
+            vertices[:, normalSlice] = normals / np.maximum(norms, 1e-12)
+
+        vertexBlocks.append(vertices)
+        indexBlocks.append(indices + offset)
+        offset += len(vertices)
+
+    node._clearBakedShape()
+    bakedShape = gs.GPUShape().initBuffers()
+    pipeline.setupVAO(bakedShape)
+    bakedShape.fillBuffers(np.concatenate(vertexBlocks).reshape(-1), np.concatenate(indexBlocks), GL_STATIC_DRAW, stride)
+    bakedShape.texture = texture
+
+    node._bakedShape = bakedShape
+    node._bakedPipeline = pipeline
+    return bakedShape
+
+
+def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identity(), frustum=None, stats=None, lodView=None):
+    """
+    Draws the node and its childs.
+    If frustum planes are given (see bounding_volumes.frustumPlanes), subtrees
+    outside them are skipped. Planes must be in the coordinates parentTransform maps to.
+    Optional CullingStats are updated with the number of drawn leaves and culled subtrees.
+    LODNodes select their level with the given LODView, or draw their finest level without it.
+    """
     assert(isinstance(node, SceneGraphNode))
 
     # Composing the transformations through this path
     newTransform = np.matmul(parentTransform, node.transform)
 
+    # Subtrees outside the frustum are discarded, if they are completely inside
+    # there is no need to test their childs
+    if frustum is not None:
+        box = getBoundingBox(node)
+        if box is not None:
+            result = bv.testBox(frustum, box.transform(newTransform))
+            if result == bv.OUTSIDE:
+                if stats is not None:
+                    stats.culled += 1
+                return
+            elif result == bv.INSIDE:
+                frustum = None
+
+    if isinstance(node, LODNode):
+        level = 0
+        if lodView is not None:
+            level = node.selectLevels(newTransform[np.newaxis], lodView, node._currentLevel)[0]
+
+        glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
+        pipeline.drawCall(node.levels[level])
+        node.drawCounts[level] += 1
+
+        if stats is not None:
+            stats.drawn += 1
+            stats.drawCalls += 1
+        return
+
+    # Static subtrees are drawn with a single call
+    if node.static:
+        glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
+        pipeline.drawCall(getStaticShape(node, pipeline))
+
+        if stats is not None:
+            stats.drawn += 1
+            stats.drawCalls += 1
+        return
+
     # If the child node is a leaf, it should be a GPUShape.
     # Hence, it can be drawn with drawCall
     if len(node.childs) == 1 and isinstance(node.childs[0], gs.GPUShape):
@@ -98,9 +657,369 @@ def drawSceneGraphNode(node, pipeline, transformName, parentTransform=tr.identit
         glUniformMatrix4fv(glGetUniformLocation(pipeline.shaderProgram, transformName), 1, GL_TRUE, newTransform)
         pipeline.drawCall(leaf)
 
+        if stats is not None:
+            stats.drawn += 1
+            stats.drawCalls += 1
+
     # If the child node is not a leaf, it MUST be a SceneGraphNode,
     # so this draw function is called recursively
     else:
         for child in node.childs:
-            drawSceneGraphNode(child, pipeline, transformName, newTransform)
+            drawSceneGraphNode(child, pipeline, transformName, newTransform, frustum, stats, lodView)
+
+
+
+class RenderList:
+    """
+    A scene graph compiled into a flat list of draws (pipeline, GPUShape, world matrix slot).
+
+    The hierarchy is traversed only when the structure of the scene graph changes.
+    Node transforms are stored in the rows of a single array, so assigning
+    node.transform writes directly into its slot, and world matrices of all
+    the nodes are computed with one matrix product per depth level of the graph.
+
+    Every GPUShape child of a node is drawn with the world transform of that node,
+    using the closest pipeline set on the path from the root, or the default pipeline.
+    A node should belong to a single render list, as its transform lives in it.
+
+    instancedPipelines maps pipelines to their instanced counterparts, e.g.
+    {pipeline: es.SimpleInstancedTransformShaderProgram()}. Leaves sharing the same
+    GPUShape and pipeline are then drawn with a single instanced draw call, when there
+    are at least minInstances of them. Instanced pipelines need the same uniforms
+    (view, projection, ...) as the pipelines they replace.
+
+    LODNodes are evaluated on every draw, all the instances of a LODNode at once,
+    and each of its levels is drawn as a group of instances as well.
+    """
+    def __init__(self, root, pipeline, transformName, instancedPipelines=None, minInstances=2):
+        assert(isinstance(root, SceneGraphNode))
+
+        self.root = root
+        self.pipeline = pipeline
+        self.transformName = transformName
+        self.instancedPipelines = instancedPipelines if instancedPipelines is not None else {}
+        self.minInstances = minInstances
+        self.revision = None
+        self.staticNodes = []
+
+        # InstancedGPUShapes are kept between compilations, as they own GPU buffers
+        self.instancedShapes = {}
+
+    def compile(self):
+        """Traverses the scene graph building the draw entries and transform slots"""
+
+        nodes = []
+        nodeSlots = {}
+        self.staticNodes = []
+        instanceNodes = []
+        instanceParents = []
+        self.levels = []
+        entries = []
+        lodEntries = {}
+
+        # Breadth first traversal, every path from the root to a node is an instance
+        # of that node with its own world matrix
+        current = [(self.root, -1, self.pipeline)]
+        while len(current) > 0:
+            start = len(instanceNodes)
+            following = []
+
+            for node, parentInstance, pipeline in current:
+                slot = nodeSlots.get(id(node))
+                if slot is None:
+                    slot = len(nodes)
+                    nodeSlots[id(node)] = slot
+                    nodes.append(node)
+
+                instance = len(instanceNodes)
+                instanceNodes.append(slot)
+                instanceParents.append(parentInstance)
+
+                if node.pipeline is not None:
+                    pipeline = node.pipeline
+
+                if isinstance(node, LODNode):
+                    key = (id(pipeline), id(node))
+                    lodEntries.setdefault(key, (pipeline, node, []))[2].append(instance)
+                    continue
+
+                if node.static:
+                    entries.append((pipeline, getStaticShape(node, pipeline), instance))
+                    self.staticNodes.append(node)
+                    continue
+
+                for child in node.childs:
+                    if isinstance(child, gs.GPUShape):
+                        entries.append((pipeline, child, instance))
+                    else:
+                        following.append((child, instance, pipeline))
+
+            self.levels.append((start, len(instanceNodes)))
+            current = following
+
+        self.nodes = nodes
+        self.instanceNodes = np.array(instanceNodes, dtype=np.int64)
+        self.instanceParents = np.array(instanceParents, dtype=np.int64)
+
+        # Node transforms are moved into slots of a shared array
+        self.localTransforms = bindTransforms(nodes, getattr(self, "localTransforms", None))
+        self.worldTransforms = np.empty((len(instanceNodes), 4, 4), dtype=np.float32)
+
+        # Entries are grouped by pipeline to minimize program switches
+        self.batches = []
+        batchIndices = {}
+        for pipeline, gpuShape, instance in entries:
+            if id(pipeline) not in batchIndices:
+                batchIndices[id(pipeline)] = len(self.batches)
+                self.batches.append((pipeline, [], []))
+            _, gpuShapes, instances = self.batches[batchIndices[id(pipeline)]]
+            gpuShapes.append(gpuShape)
+            instances.append(instance)
+
+        usedInstancedShapes = {}
+        self.batches = [self._prepareBatch(*batch, usedInstancedShapes) for batch in self.batches]
+        self.lodBatches = [self._prepareLODBatch(*lodEntry, usedInstancedShapes) for lodEntry in lodEntries.values()]
+
+        for key, instancedShape in self.instancedShapes.items():
+            if key not in usedInstancedShapes:
+                instancedShape.clear()
+        self.instancedShapes = usedInstancedShapes
+
+        self.revision = self.root._structureRevision
+        self.boundsRevision = self.root.boundsRevision
+
+    def _prepareBatch(self, pipeline, gpuShapes, instances, usedInstancedShapes):
+        location = glGetUniformLocation(pipeline.shaderProgram, self.transformName)
+
+        # Entries sharing a GPUShape are grouped to be drawn as instances
+        instancedPipeline = self.instancedPipelines.get(pipeline)
+        singles = list(range(len(gpuShapes)))
+        groups = []
+        if instancedPipeline is not None:
+            entriesByShape = {}
+            for i, gpuShape in enumerate(gpuShapes):
+                entriesByShape.setdefault(id(gpuShape), []).append(i)
+
+            singles = []
+            for indices in entriesByShape.values():
+                if len(indices) < self.minInstances:
+                    singles += indices
+                    continue
+
+                instancedShape = self._getInstancedShape(gpuShapes[indices[0]], instancedPipeline, usedInstancedShapes)
+                groups.append((instancedShape, np.array(indices, dtype=np.int64)))
+            singles.sort()
+
+        return RenderBatch(pipeline, location, gpuShapes, np.array(instances, dtype=np.int64),
+            instancedPipeline, singles, groups)
+
+    def _getInstancedShape(self, gpuShape, instancedPipeline, usedInstancedShapes):
+        key = (id(gpuShape), id(instancedPipeline))
+        instancedShape = self.instancedShapes.get(key)
+        if instancedShape is None:
+            instancedShape = gs.InstancedGPUShape(gpuShape)
+            instancedPipeline.setupVAO(instancedShape)
+        usedInstancedShapes[key] = instancedShape
+        return instancedShape
+
+    def _prepareLODBatch(self, pipeline, lodNode, instances, usedInstancedShapes):
+        location = glGetUniformLocation(pipeline.shaderProgram, self.transformName)
+
+        instancedPipeline = self.instancedPipelines.get(pipeline)
+        instancedShapes = None
+        if instancedPipeline is not None and len(instances) >= self.minInstances:
+            instancedShapes = [self._getInstancedShape(level, instancedPipeline, usedInstancedShapes)
+                for level in lodNode.levels]
+
+        return LODBatch(pipeline, location, lodNode, np.array(instances, dtype=np.int64),
+            instancedPipeline, instancedShapes)
+
+    def update(self, parentTransform=tr.identity()):
+        """
+        Computes the world matrices of all the nodes.
+        It must be called once per frame, after modifying the node transforms.
+        The render list is compiled again only if the scene graph structure changed,
+        or if any static subtree was modified.
+        """
+        staticModified = any(node._dirty & DIRTY_BAKE for node in self.staticNodes)
+        if self.revision != self.root._structureRevision or staticModified:
+            self.compile()
+        elif self.boundsRevision != self.root.boundsRevision:
+            # Some GPUShape was filled again, only the culling data is outdated
+            for batch in self.batches + self.lodBatches:
+                batch.updateBounds()
+            self.boundsRevision = self.root.boundsRevision
+
+        for start, end in self.levels:
+            localMatrices = self.localTransforms[self.instanceNodes[start:end]]
+            if start == 0:
+                np.matmul(parentTransform, localMatrices, out=self.worldTransforms[start:end])
+            else:
+                parentMatrices = self.worldTransforms[self.instanceParents[start:end]]
+                np.matmul(parentMatrices, localMatrices, out=self.worldTransforms[start:end])
+
+    def draw(self, frustum=None, stats=None, lodView=None):
+        """
+        Issues all the draw calls, binding each pipeline once.
+        Entries outside the frustum planes are skipped when those are given.
+        LODNodes select their levels with the given LODView, or draw their finest level without it.
+        """
+        for batch in self.batches:
+            worlds = self.worldTransforms[batch.instances]
+
+            visible = None
+            if frustum is not None:
+                visible = batch.visibleMask(worlds, frustum)
+                if stats is not None:
+                    stats.culled += len(visible) - int(np.count_nonzero(visible))
+
+            if len(batch.singles) > 0:
+                glUseProgram(batch.pipeline.shaderProgram)
+
+            for i in batch.singles:
+                if visible is not None and not visible[i]:
+                    continue
+
+                glUniformMatrix4fv(batch.location, 1, GL_TRUE, worlds[i])
+                batch.pipeline.drawCall(batch.gpuShapes[i])
+
+                if stats is not None:
+                    stats.drawn += 1
+                    stats.drawCalls += 1
+
+            if len(batch.groups) > 0:
+                glUseProgram(batch.instancedPipeline.shaderProgram)
+
+            # World matrices of visible instances are uploaded on every frame
+            for instancedShape, indices in batch.groups:
+                if visible is not None:
+                    indices = indices[visible[indices]]
+                if len(indices) == 0:
+                    continue
+
+                instancedShape.fillInstanceBuffer(worlds[indices])
+                batch.instancedPipeline.drawCall(instancedShape)
+
+                if stats is not None:
+                    stats.drawn += len(indices)
+                    stats.drawCalls += 1
+
+        for batch in self.lodBatches:
+            self._drawLODBatch(batch, frustum, stats, lodView)
+
+    def _drawLODBatch(self, batch, frustum, stats, lodView):
+        worlds = self.worldTransforms[batch.instances]
+        lodNode = batch.lodNode
+
+        if lodView is not None:
+            levels = lodNode.selectLevels(worlds, lodView, batch.currentLevels)
+        else:
+            levels = np.zeros(len(worlds), dtype=np.int64)
+
+        visible = np.ones(len(worlds), dtype=bool)
+        if frustum is not None and batch.cullable:
+            visible = _visibleMask(worlds, batch.centers, batch.extents, frustum)
+            if stats is not None:
+                stats.culled += len(visible) - int(np.count_nonzero(visible))
+
+        for level, gpuShape in enumerate(lodNode.levels):
+            indices = np.flatnonzero(visible & (levels == level))
+            if len(indices) == 0:
+                continue
+
+            lodNode.drawCounts[level] += len(indices)
+            if stats is not None:
+                stats.drawn += len(indices)
+
+            if batch.instancedShapes is not None and len(indices) >= self.minInstances:
+                instancedShape = batch.instancedShapes[level]
+                instancedShape.fillInstanceBuffer(worlds[indices])
+                glUseProgram(batch.instancedPipeline.shaderProgram)
+                batch.instancedPipeline.drawCall(instancedShape)
+
+                if stats is not None:
+                    stats.drawCalls += 1
+                continue
+
+            glUseProgram(batch.pipeline.shaderProgram)
+            for i in indices:
+                glUniformMatrix4fv(batch.location, 1, GL_TRUE, worlds[i])
+                batch.pipeline.drawCall(gpuShape)
+
+            if stats is not None:
+                stats.drawCalls += len(indices)
+
+    def clear(self):
+        """Freeing GPU memory of instance buffers, the scene graph is not modified"""
+
+        for instancedShape in self.instancedShapes.values():
+            instancedShape.clear()
+        self.instancedShapes = {}
+
+
+class RenderBatch:
+    """
+    Draw entries of a RenderList sharing the same pipeline.
+    Entries are drawn one by one (singles) or as groups of instances of the same GPUShape.
+    """
+    def __init__(self, pipeline, location, gpuShapes, instances, instancedPipeline, singles, groups):
+        self.pipeline = pipeline
+        self.instancedPipeline = instancedPipeline
+        self.singles = singles
+        self.groups = groups
+        self.location = location
+        self.gpuShapes = gpuShapes
+        self.instances = instances
+        self.updateBounds()
+
+    def updateBounds(self):
+        """Local bounding boxes of every entry, for vectorized frustum culling"""
+        self.cullable = np.array([gpuShape.boundingBox is not None for gpuShape in self.gpuShapes], dtype=bool)
+        self.centers = np.zeros((len(self.gpuShapes), 3), dtype=np.float32)
+        self.extents = np.zeros((len(self.gpuShapes), 3), dtype=np.float32)
+        for i, gpuShape in enumerate(self.gpuShapes):
+            if self.cullable[i]:
+                self.centers[i] = gpuShape.boundingBox.center()
+                self.extents[i] = gpuShape.boundingBox.halfExtents()
+
+    def visibleMask(self, worlds, frustum):
+        return _visibleMask(worlds, self.centers, self.extents, frustum) | ~self.cullable
+
+
+class LODBatch:
+    """
+    All the instances of a LODNode drawn by a RenderList with the same pipeline,
+    with the level each of them used on the previous frame.
+    """
+    def __init__(self, pipeline, location, lodNode, instances, instancedPipeline, instancedShapes):
+        self.pipeline = pipeline
+        self.location = location
+        self.lodNode = lodNode
+        self.instances = instances
+        self.instancedPipeline = instancedPipeline
+        self.instancedShapes = instancedShapes
+        self.currentLevels = np.zeros(len(instances), dtype=np.int64)
+        self.updateBounds()
+
+    def updateBounds(self):
+        """Bounding box of the first level, shared by all the instances"""
+        box = self.lodNode.levels[0].boundingBox
+        self.cullable = box is not None
+        if self.cullable:
+            self.centers = np.broadcast_to(box.center(), (len(self.instances), 3))
+            self.extents = np.broadcast_to(box.halfExtents(), (len(self.instances), 3))
+
+
+def _visibleMask(worlds, centers, extents, frustum):
+    """Tests local bounding boxes, given by centers and half extents, transformed
+    by a stack of world matrices against the frustum planes at once"""
+
+    linear = worlds[:, :3, :3]
+    centers = np.einsum('nij,nj->ni', linear, centers) + worlds[:, :3, 3]
+    extents = np.einsum('nij,nj->ni', np.abs(linear), extents)
+
+    # (entries, planes) signed distances and projected radii
+    distances = centers @ frustum[:, :3].T + frustum[:, 3]
+    radii = extents @ np.abs(frustum[:, :3]).T
 
+    return ~np.any(distances < -radii, axis=1)
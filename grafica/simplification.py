@@ -0,0 +1,415 @@
+# coding=utf-8
+"""
+Mesh simplification with quadric error metrics (Garland and Heckbert).
+
+Meshes are arrays: positions (V,3) and triangles (F,3). Edges are collapsed into one of
+their vertices (half edge collapses), so simplified meshes keep indexing the original
+vertices: a chain of levels of detail shares one vertex buffer and only differs in indices.
+
+Vertices split by their attributes (texture coordinates or normals at seams, as the OBJ
+readers produce) are welded by position, so the mesh is simplified as a connected surface.
+A collapse then moves every copy of the removed position to a copy of the kept one, the
+one sharing an edge with it when there is one, so both sides of a seam stay consistent.
+
+Collapses are done in rounds. Every round evaluates all the edges at once and collapses
+the cheapest ones that are far enough from each other to be applied independently.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+import grafica.basic_shapes as bs
+import grafica.normals as nm
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+def _planeQuadrics(normals, points, weights):
+    """(N,4,4) quadrics of planes with unit normals through the points, scaled by the weights"""
+    planes = np.hstack((normals, -np.sum(normals * points, axis=1, keepdims=True)))
+    return weights[:, np.newaxis, np.newaxis] * planes[:, :, np.newaxis] * planes[:, np.newaxis, :]
+
+
+def _accumulate(vertices, quadrics, V):
+    """Sums (N,4,4) quadrics into their vertices"""
+    flat = quadrics.reshape((-1, 16))
+    return np.stack([
+        np.bincount(vertices, weights=flat[:, i], minlength=V) for i in range(16)], axis=1).reshape((V, 4, 4))
+
+
+def _uniqueEdges(triangles, V):
+    """(E,2) edges of the triangles with sorted vertices, and the number of faces of each one"""
+    tails = triangles.reshape(-1)
+    heads = triangles[:, [1, 2, 0]].reshape(-1)
+    keys = np.minimum(tails, heads) * V + np.maximum(tails, heads)
+    edgeKeys, counts = np.unique(keys, return_counts=True)
+    return np.stack((edgeKeys // V, edgeKeys % V), axis=1), counts
+
+
+def weldPositions(positions, positionIndices=None):
+    """
+    (P,3) distinct positions and the (V,) index of each vertex among them. Vertices are
+    welded when they have the same position, or the same positionIndices if given
+    (e.g. OBJMesh.positionIndices).
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if positionIndices is None:
+        _, first, inverse = np.unique(positions, axis=0, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(positionIndices, return_index=True, return_inverse=True)
+    return positions[first], inverse.reshape(-1)
+
+
+def _groups(keys, values, K):
+    """values sorted by their keys in [0, K), with the start and number of the values of each key"""
+    order = np.argsort(keys, kind="stable")
+    counts = np.bincount(keys, minlength=K)
+    return values[order], np.cumsum(counts) - counts, counts
+
+
+class QuadricSimplifier:
+    """
+    Simplifies a mesh step by step, keeping the quadrics between calls, so successive
+    calls to simplify produce a chain of levels of detail.
+
+    Triangles index the vertices, which are welded by position (see weldPositions).
+    The optional (V,K) attributes choose, when a removed vertex has no edge to a copy of the
+    kept position, the copy with the nearest attributes.
+
+    With preserveBoundaries, boundary edges get constraint planes weighted by boundaryWeight,
+    and boundary vertices only slide along the boundary. In the same way, positions on
+    attribute seams (with several copies) only slide along seams, so seams do not open.
+    """
+    def __init__(self, positions, triangles, preserveBoundaries=True, boundaryWeight=100.0,
+            positionIndices=None, attributes=None):
+        self.positions, self.welds = weldPositions(positions, positionIndices)
+        self.attributes = None if attributes is None else np.asarray(attributes, dtype=np.float64).reshape((len(self.welds), -1))
+        self.preserveBoundaries = preserveBoundaries
+        self.error = 0.0
+        self._random = np.random.default_rng(0)
+
+        # Triangles whose corners share a position have no area to keep
+        triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+        welded = self.welds[triangles]
+        self.triangles = triangles[(welded[:, 0] != welded[:, 1]) & (welded[:, 1] != welded[:, 2]) & (welded[:, 2] != welded[:, 0])]
+        welded = self.welds[self.triangles]
+
+        # Every position starts with the planes of its triangles, weighted by their area
+        P = len(self.positions)
+        normals = nm.faceNormals(self.positions, welded, normalize=False).astype(np.float64)
+        areas = np.linalg.norm(normals, axis=1)
+        units = normals / np.where(areas > 0, areas, 1)[:, np.newaxis]
+        faceQuadrics = _planeQuadrics(units, self.positions[welded[:, 0]], 0.5 * areas)
+        self.quadrics = _accumulate(welded.reshape(-1), np.repeat(faceQuadrics, 3, axis=0), P)
+
+        if preserveBoundaries:
+            self._addBoundaryPlanes(welded, units, boundaryWeight)
+
+    def _addBoundaryPlanes(self, triangles, faceUnits, boundaryWeight):
+        # Sides with no other face on their edge
+        V = len(self.positions)
+        tails = triangles.reshape(-1)
+        heads = triangles[:, [1, 2, 0]].reshape(-1)
+        keys = np.minimum(tails, heads) * V + np.maximum(tails, heads)
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        boundary = np.flatnonzero(counts[inverse] == 1)
+        if len(boundary) == 0:
+            return
+
+        # Planes containing the boundary edge, perpendicular to its face
+        tails = tails[boundary]
+        heads = heads[boundary]
+        directions = self.positions[heads] - self.positions[tails]
+        normals = np.cross(directions, faceUnits[boundary // 3])
+        lengths = np.linalg.norm(normals, axis=1)
+        normals /= np.where(lengths > 0, lengths, 1)[:, np.newaxis]
+
+        weights = boundaryWeight * np.sum(directions * directions, axis=1)
+        quadrics = _planeQuadrics(normals, self.positions[tails], weights)
+        self.quadrics += _accumulate(np.concatenate((tails, heads)), np.concatenate((quadrics, quadrics)), V)
+
+    def _costs(self, quadrics, vertices):
+        points = np.hstack((self.positions[vertices], np.ones((len(vertices), 1))))
+        return np.sum(np.matmul(quadrics, points[:, :, np.newaxis])[:, :, 0] * points, axis=1)
+
+    def _selectIndependent(self, candidates, costs, edges, V):
+        """
+        Candidate edges whose collapses do not share triangles. An edge is chosen when it is
+        the cheapest one around its vertices and their neighbours; the surroundings of chosen
+        edges are then blocked and more edges are chosen among the rest, until none is left.
+        Ties are broken at random, otherwise flat regions would collapse in index order.
+        """
+        a = edges[:, 0]
+        b = edges[:, 1]
+        E = len(edges)
+        ties = self._random.random(len(candidates))
+        candidateRanks = np.empty(len(candidates), dtype=np.int64)
+        candidateRanks[np.lexsort((ties, costs[candidates]))] = np.arange(len(candidates))
+
+        selected = []
+        blocked = np.zeros(V, dtype=bool)
+        while len(candidates) > 0:
+            ranks = np.full(E, E, dtype=np.int64)
+            ranks[candidates] = candidateRanks
+
+            best = np.full(V, E, dtype=np.int64)
+            np.minimum.at(best, a, ranks)
+            np.minimum.at(best, b, ranks)
+            around = best.copy()
+            np.minimum.at(around, a, best[b])
+            np.minimum.at(around, b, best[a])
+
+            chosen = (candidateRanks == around[a[candidates]]) & (candidateRanks == around[b[candidates]])
+            if not np.any(chosen):
+                break
+            selected.append(candidates[chosen])
+
+            # Vertices of the chosen edges and their neighbours cannot be touched again
+            blocked[a[candidates[chosen]]] = True
+            blocked[b[candidates[chosen]]] = True
+            nearby = blocked.copy()
+            nearby[a[blocked[b]]] = True
+            nearby[b[blocked[a]]] = True
+
+            free = ~nearby[a[candidates]] & ~nearby[b[candidates]]
+            candidates = candidates[free]
+            candidateRanks = candidateRanks[free]
+
+        return np.concatenate(selected) if len(selected) > 0 else candidates[:0]
+
+    def _keepsOrientation(self, removed, kept, triangles, V):
+        """Mask of the collapses not flipping any of the triangles remaining around them"""
+        remap = np.arange(V)
+        remap[removed] = kept
+        collapse = np.full(V, -1, dtype=np.int64)
+        collapse[removed] = np.arange(len(removed))
+
+        touched = triangles[np.any(collapse[triangles] >= 0, axis=1)]
+        moved = remap[touched]
+        survivors = (moved[:, 0] != moved[:, 1]) & (moved[:, 1] != moved[:, 2]) & (moved[:, 2] != moved[:, 0])
+        oldNormals = nm.faceNormals(self.positions, touched[survivors])
+        newNormals = nm.faceNormals(self.positions, moved[survivors])
+        flipped = np.sum(oldNormals * newNormals, axis=1) < 0.2
+
+        # Each triangle is touched by a single collapse
+        owners = np.max(collapse[touched[survivors]], axis=1)
+        valid = np.ones(len(removed), dtype=bool)
+        valid[owners[flipped]] = False
+        return valid
+
+    def _usedVertices(self):
+        used = np.zeros(len(self.welds), dtype=bool)
+        used[self.triangles] = True
+        return np.flatnonzero(used)
+
+    def _seams(self, edges, V):
+        """
+        Masks of the positions with several copies in use, and of the edges on a seam:
+        those whose faces do not use the same copies of both of their positions.
+        """
+        used = self._usedVertices()
+        copies = np.bincount(self.welds[used], minlength=V)
+
+        # Each side of a face as the pair of copies it uses, ordered by position
+        tails = self.triangles.reshape(-1)
+        heads = self.triangles[:, [1, 2, 0]].reshape(-1)
+        swap = self.welds[tails] > self.welds[heads]
+        first = np.where(swap, heads, tails)
+        second = np.where(swap, tails, heads)
+        copyKeys = first * len(self.welds) + second
+        edgeIndices = np.searchsorted(edges[:, 0] * V + edges[:, 1], self.welds[first] * V + self.welds[second])
+
+        # Sides of an edge using different pairs of copies make it a seam
+        order = np.lexsort((copyKeys, edgeIndices))
+        starts = np.searchsorted(edgeIndices[order], np.arange(len(edges)))
+        ends = np.searchsorted(edgeIndices[order], np.arange(len(edges)), side="right") - 1
+        sortedKeys = copyKeys[order]
+        return copies > 1, sortedKeys[starts] != sortedKeys[ends]
+
+    def _copyTargets(self, removed, kept):
+        """
+        Vertices that are copies of the removed positions, and the copies of the kept positions
+        replacing them: a copy sharing an edge with the vertex if any, otherwise any copy,
+        the one with the nearest attributes first. Collapses must not share positions.
+        """
+        V = len(self.welds)
+        P = len(self.positions)
+        used = self._usedVertices()
+        collapseOfRemoved = np.full(P, -1, dtype=np.int64)
+        collapseOfRemoved[removed] = np.arange(len(removed))
+        collapseOfKept = np.full(P, -1, dtype=np.int64)
+        collapseOfKept[kept] = np.arange(len(kept))
+
+        sources = used[collapseOfRemoved[self.welds[used]] >= 0]
+        sourceCollapses = collapseOfRemoved[self.welds[sources]]
+        targets = used[collapseOfKept[self.welds[used]] >= 0]
+        targets, starts, counts = _groups(collapseOfKept[self.welds[targets]], targets, len(kept))
+
+        # Every copy of a removed position paired with every copy of the kept one
+        repeats = counts[sourceCollapses]
+        pairSources = np.repeat(sources, repeats)
+        offsets = np.arange(len(pairSources)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        pairTargets = targets[np.repeat(starts[sourceCollapses], repeats) + offsets]
+
+        tails = self.triangles.reshape(-1)
+        heads = self.triangles[:, [1, 2, 0]].reshape(-1)
+        linkedKeys = np.sort(np.concatenate((tails * V + heads, heads * V + tails)))
+        pairKeys = pairSources * V + pairTargets
+        linked = linkedKeys[np.minimum(np.searchsorted(linkedKeys, pairKeys), len(linkedKeys) - 1)] == pairKeys
+
+        if self.attributes is None:
+            distances = np.zeros(len(pairSources))
+        else:
+            distances = np.sum((self.attributes[pairSources] - self.attributes[pairTargets]) ** 2, axis=1)
+
+        order = np.lexsort((pairTargets, distances, ~linked, pairSources))
+        pairSources = pairSources[order]
+        first = np.concatenate(([True], pairSources[1:] != pairSources[:-1]))
+        return pairSources[first], pairTargets[order][first]
+
+    def _round(self, trianglesToRemove, maxError):
+        """Applies one round of independent collapses, returning how many were done"""
+        V = len(self.positions)
+        triangles = self.welds[self.triangles]
+        edges, faceCounts = _uniqueEdges(triangles, V)
+        if len(edges) == 0:
+            return 0
+
+        boundaryVertices = np.zeros(V, dtype=bool)
+        boundaryVertices[edges[faceCounts == 1].reshape(-1)] = True
+        boundaryEdge = faceCounts == 1
+
+        # Cost of collapsing each edge into either of its vertices
+        a = edges[:, 0]
+        b = edges[:, 1]
+        quadrics = self.quadrics[a] + self.quadrics[b]
+        costIntoA = self._costs(quadrics, a)
+        costIntoB = self._costs(quadrics, b)
+
+        if self.preserveBoundaries:
+            seamVertices, seamEdge = self._seams(edges, V)
+
+        def removable(vertex):
+            allowed = faceCounts <= 2
+            if self.preserveBoundaries:
+                # Boundary and seam vertices may only move along the boundary or seam
+                allowed &= ~boundaryVertices[vertex] | boundaryEdge
+                allowed &= ~seamVertices[vertex] | seamEdge
+            return allowed
+
+        canRemoveA = removable(a)
+        canRemoveB = removable(b)
+        intoB = canRemoveA & (~canRemoveB | (costIntoB <= costIntoA))
+        removed = np.where(intoB, a, b)
+        kept = np.where(intoB, b, a)
+        costs = np.where(intoB, costIntoB, costIntoA)
+        candidates = (canRemoveA | canRemoveB) & (costs <= maxError)
+
+        candidates = np.flatnonzero(candidates)
+        if len(candidates) == 0:
+            return 0
+
+        adjacency = sparse.csr_matrix(
+            (np.ones(2 * len(edges), dtype=np.int32), (np.concatenate((a, b)), np.concatenate((b, a)))), shape=(V, V))
+
+        # Selections where every collapse is invalid are retried without them
+        while True:
+            selected = self._selectIndependent(candidates, costs, edges, V)
+
+            # Link condition: the vertices of an edge share exactly its opposite vertices,
+            # otherwise the collapse creates non manifold geometry
+            common = np.asarray(adjacency[a[selected]].multiply(adjacency[b[selected]]).sum(axis=1)).reshape(-1)
+            valid = common == faceCounts[selected]
+            valid &= self._keepsOrientation(removed[selected], kept[selected], triangles, V)
+            if np.any(valid):
+                selected = selected[valid]
+                break
+
+            candidates = np.setdiff1d(candidates, selected)
+            if len(candidates) == 0:
+                return 0
+
+        # Not removing more triangles than requested, cheapest collapses first
+        selected = selected[np.argsort(costs[selected], kind="stable")]
+        if trianglesToRemove is not None:
+            removedTriangles = np.cumsum(faceCounts[selected])
+            count = max(1, np.searchsorted(removedTriangles, trianglesToRemove, side="right"))
+            selected = selected[:count]
+
+        if len(selected) == 0:
+            return 0
+
+        self.quadrics[kept[selected]] += self.quadrics[removed[selected]]
+
+        sources, targets = self._copyTargets(removed[selected], kept[selected])
+        remap = np.arange(len(self.welds))
+        remap[sources] = targets
+
+        self.triangles = remap[self.triangles]
+        triangles = self.welds[self.triangles]
+        degenerate = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | \
+            (triangles[:, 2] == triangles[:, 0])
+        self.triangles = self.triangles[~degenerate]
+        self.error = max(self.error, float(np.max(costs[selected])))
+        return len(selected)
+
+    def simplify(self, targetTriangles=None, maxError=np.inf):
+        """
+        Collapses edges until reaching targetTriangles, or until every remaining
+        collapse costs more than maxError. Returns the (F',3) triangles.
+        """
+        while targetTriangles is None or len(self.triangles) > targetTriangles:
+            toRemove = None if targetTriangles is None else len(self.triangles) - targetTriangles
+            if self._round(toRemove, maxError) == 0:
+                break
+        return self.triangles
+
+
+def simplify(positions, triangles, targetTriangles=None, maxError=np.inf, preserveBoundaries=True,
+        positionIndices=None, attributes=None):
+    """Simplified (F',3) triangles, indexing the same vertices"""
+    simplifier = QuadricSimplifier(positions, triangles, preserveBoundaries,
+        positionIndices=positionIndices, attributes=attributes)
+    return simplifier.simplify(targetTriangles, maxError)
+
+
+def lodChain(positions, triangles, ratios=(0.5, 0.25, 0.125), preserveBoundaries=True,
+        positionIndices=None, attributes=None):
+    """
+    List of triangle arrays, the original one followed by simplifications to the given
+    ratios of its triangle count. All of them index the same vertices, so one vertex buffer
+    serves every level, e.g. bs.Shape(vertexData, level.reshape(-1)) for each level.
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    simplifier = QuadricSimplifier(positions, triangles, preserveBoundaries,
+        positionIndices=positionIndices, attributes=attributes)
+
+    levels = [triangles]
+    for ratio in ratios:
+        levels.append(simplifier.simplify(int(ratio * len(triangles))).copy())
+    return levels
+
+
+def compactVertices(triangles, vertexCount):
+    """
+    Drops the vertices not used by the triangles. Returns (vertexIndices, newTriangles),
+    vertexIndices being the original index of each remaining vertex.
+    """
+    used = np.zeros(vertexCount, dtype=bool)
+    used[triangles.reshape(-1)] = True
+    vertexIndices = np.flatnonzero(used)
+    remap = np.full(vertexCount, -1, dtype=np.int64)
+    remap[vertexIndices] = np.arange(len(vertexIndices))
+    return vertexIndices, remap[triangles]
+
+
+def createLODShapes(shape, stride, ratios=(0.5, 0.25, 0.125), preserveBoundaries=True):
+    """
+    Levels of detail of a bs.Shape, from the full shape to the coarsest one.
+    All of them share the vertex data of the shape, so they can be uploaded as GPUShapes
+    and used as the levels of a scene_graph.LODNode.
+    """
+    vertexData = np.asarray(shape.vertices, dtype=np.float32).reshape((-1, stride))
+    triangles = np.asarray(shape.indices, dtype=np.int64).reshape((-1, 3))
+    levels = lodChain(vertexData[:, :3], triangles, ratios, preserveBoundaries, attributes=vertexData[:, 3:])
+    return [bs.Shape(shape.vertices, level.reshape(-1).astype(np.uint32)) for level in levels]
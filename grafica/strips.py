@@ -0,0 +1,130 @@
+# coding=utf-8
+"""
+Triangle strips joined with a primitive restart index.
+
+A strip v0 v1 v2 v3 ... draws the triangles (v0 v1 v2), (v2 v1 v3), (v2 v3 v4), ...
+so every triangle after the first one takes a single index, instead of the 3 indices
+of GL_TRIANGLES. Strips are separated by RESTART_INDEX, which GPUShapes drawn as
+GL_TRIANGLE_STRIP enable as primitive restart index.
+"""
+
+import numpy as np
+import grafica.triangle_mesh as tm
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+# Largest 32 bits index, indices are uploaded as unsigned ints
+RESTART_INDEX = 0xFFFFFFFF
+
+
+def _hasSide(triangle, tail, head):
+    """True when the triangle, in its own orientation, goes from tail to head"""
+    k = triangle.index(tail)
+    return triangle[(k + 1) % 3] == head
+
+
+def stripify(triangles):
+    """
+    Greedy strips over the triangles of a (F,3) array, joined with RESTART_INDEX.
+    Strips grow through neighbours sharing an edge with the same orientation,
+    starting from the triangles with fewer neighbours, so borders are consumed first.
+    Returns a uint32 array of indices to be drawn as GL_TRIANGLE_STRIP.
+    """
+    triangles = tm.triangleArray(triangles)
+    F = len(triangles)
+    neighboursArray = tm.computeNeighbours(triangles)
+    starts = np.argsort(np.count_nonzero(neighboursArray >= 0, axis=1), kind="stable")
+
+    vertices = triangles.tolist()
+    neighbours = neighboursArray.tolist()
+    visited = bytearray(F)
+    indices = []
+
+    for start in starts.tolist():
+        if visited[start]:
+            continue
+        visited[start] = 1
+
+        # Rotating the first triangle so the strip leaves through a free side bc
+        triangle = vertices[start]
+        rotation = 0
+        for r in range(3):
+            other = neighbours[start][(r + 1) % 3]
+            if other >= 0 and not visited[other]:
+                rotation = r
+                break
+        strip = triangle[rotation:] + triangle[:rotation]
+
+        current = start
+        while True:
+            p, q = strip[-2], strip[-1]
+            triangle = vertices[current]
+            side = 0
+            while {triangle[side], triangle[(side + 1) % 3]} != {p, q}:
+                side += 1
+
+            following = neighbours[current][side]
+            if following < 0 or visited[following]:
+                break
+
+            # The triangle at an odd position of the strip is drawn as (q, p, next)
+            nextTriangle = vertices[following]
+            odd = (len(strip) - 2) % 2 == 1
+            if not (_hasSide(nextTriangle, q, p) if odd else _hasSide(nextTriangle, p, q)):
+                break
+
+            visited[following] = 1
+            strip.append(sum(nextTriangle) - p - q)
+            current = following
+
+        if len(indices) > 0:
+            indices.append(RESTART_INDEX)
+        indices += strip
+
+    return np.array(indices, dtype=np.uint32)
+
+
+def gridStrips(rows, columns):
+    """
+    Strips of a regular grid with (rows + 1) x (columns + 1) vertices, the vertex at
+    (row, column) having the index row * (columns + 1) + column, as height maps and
+    parametric surfaces are sampled. There is a strip per row of cells, counterclockwise
+    when columns grow along x and rows along y.
+    """
+    width = columns + 1
+    if rows <= 0 or columns <= 0:
+        return np.zeros(0, dtype=np.uint32)
+
+    # Every strip alternates between the upper and the lower row, ending with a restart
+    lower = np.arange(rows)[:, np.newaxis] * width + np.arange(width)
+    strips = np.empty((rows, 2 * width + 1), dtype=np.uint32)
+    strips[:, 0:-1:2] = lower + width
+    strips[:, 1:-1:2] = lower
+    strips[:, -1] = RESTART_INDEX
+    return strips.reshape(-1)[:-1]
+
+
+def unstripify(indices):
+    """(F,3) triangles drawn by strip indices with restarts, skipping degenerate ones"""
+    indices = np.asarray(indices, dtype=np.uint32).reshape(-1)
+    n = len(indices)
+    if n < 3:
+        return np.zeros((0, 3), dtype=np.int64)
+
+    # Position of every index within its strip
+    restarts = indices == RESTART_INDEX
+    lastRestart = np.maximum.accumulate(np.where(restarts, np.arange(n), -1))
+    positions = np.arange(n) - lastRestart - 1
+
+    firsts = np.arange(n - 2)
+    valid = ~(restarts[:-2] | restarts[1:-1] | restarts[2:])
+    firsts = firsts[valid]
+    triangles = np.stack((indices[firsts], indices[firsts + 1], indices[firsts + 2]), axis=1).astype(np.int64)
+
+    odd = positions[firsts] % 2 == 1
+    triangles[odd] = triangles[odd][:, [1, 0, 2]]
+
+    degenerate = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | \
+        (triangles[:, 2] == triangles[:, 0])
+    return triangles[~degenerate]
@@ -175,13 +175,13 @@ class TextureTextRendererShaderProgram:
         glBindVertexArray(0)
 
 
-    def drawCall(self, gpuShape, mode=GL_TRIANGLES):
+    def drawCall(self, gpuShape, mode=None):
         assert isinstance(gpuShape, es.GPUShape)
 
         # Binding the VAO and executing the draw call
         glBindVertexArray(gpuShape.vao)
         glBindTexture(GL_TEXTURE_3D, gpuShape.texture)
-        glDrawElements(mode, gpuShape.size, GL_UNSIGNED_INT, None)
+        es.drawElements(gpuShape, mode)
         
         # Unbind the current VAO
         glBindVertexArray(0)
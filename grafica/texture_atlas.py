@@ -0,0 +1,229 @@
+# coding=utf-8
+"""
+Texture atlases, packing many small images into a few big textures.
+
+Shapes using images of the same atlas page share its texture, so they can be merged,
+baked by a static scene graph node or drawn one after another without binding textures.
+Images are placed with a skyline packer. Each of them is surrounded by a padding
+repeating its border pixels, so linear filtering and mipmaps do not bleed the neighbours in.
+"""
+
+from OpenGL.GL import *
+import numpy as np
+import grafica.basic_shapes as bs
+import grafica.textures as tx
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+
+class SkylinePacker:
+    """
+    Places rectangles in a width x height page, bottom-left first.
+    The skyline is a list of [x, y, width] segments, the top of the rectangles placed so far.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+
+    def _fit(self, index, width, height):
+        """Lowest y where a rectangle starting at the segment index fits, None if it does not"""
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+
+        y = 0
+        remaining = width
+        while remaining > 0:
+            _, segmentY, segmentWidth = self.skyline[index]
+            y = max(y, segmentY)
+            if y + height > self.height:
+                return None
+            remaining -= segmentWidth
+            index += 1
+        return y
+
+    def insert(self, width, height):
+        """Position (x, y) for a width x height rectangle, None if the page is full"""
+        best = None
+        for i in range(len(self.skyline)):
+            y = self._fit(i, width, height)
+            if y is None:
+                continue
+            # Lowest top first, then the narrowest segment to leave fewer gaps
+            candidate = (y + height, self.skyline[i][2], i, y)
+            if best is None or candidate < best:
+                best = candidate
+
+        if best is None:
+            return None
+
+        _, _, index, y = best
+        x = self.skyline[index][0]
+        self._addSegment(index, x, y + height, width)
+        return x, y
+
+    def _addSegment(self, index, x, y, width):
+        self.skyline.insert(index, [x, y, width])
+
+        # Segments below the new one are shortened or removed
+        i = index + 1
+        while i < len(self.skyline):
+            segment = self.skyline[i]
+            overlap = x + width - segment[0]
+            if overlap <= 0:
+                break
+            segment[0] += overlap
+            segment[2] -= overlap
+            if segment[2] > 0:
+                break
+            del self.skyline[i]
+
+        # Neighbours at the same height are joined
+        i = 0
+        while i < len(self.skyline) - 1:
+            if self.skyline[i][1] == self.skyline[i + 1][1]:
+                self.skyline[i][2] += self.skyline[i + 1][2]
+                del self.skyline[i + 1]
+            else:
+                i += 1
+
+
+class AtlasRegion:
+    """Rectangle of an image inside an atlas page, in pixels, without the padding"""
+    def __init__(self, page, x, y, width, height, pageWidth, pageHeight):
+        self.page = page
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.pageWidth = pageWidth
+        self.pageHeight = pageHeight
+
+    @property
+    def uvRect(self):
+        """(u0, v0, u1, v1) of the region, texture coordinates in [0, 1] of the page"""
+        return (self.x / self.pageWidth, self.y / self.pageHeight,
+            (self.x + self.width) / self.pageWidth, (self.y + self.height) / self.pageHeight)
+
+    def mapTexCoords(self, texCoords):
+        """Texture coordinates (N,2) of the image, in [0, 1], as coordinates of the page"""
+        u0, v0, u1, v1 = self.uvRect
+        texCoords = np.asarray(texCoords, dtype=np.float64)
+        return np.column_stack([u0 + texCoords[:, 0] * (u1 - u0), v0 + texCoords[:, 1] * (v1 - v0)])
+
+
+class TextureAtlas:
+    """
+    Images added by name and packed into square pages of pageSize pixels by build.
+    Images are stored as RGBA, so pages can hold images with and without transparency.
+    """
+    def __init__(self, pageSize=2048, padding=2):
+        self.pageSize = pageSize
+        self.padding = padding
+        self.images = {}
+
+        # Results of build
+        self.pages = []
+        self.regions = {}
+        self.textures = []
+        self.textureManager = None
+
+    def addImage(self, name, data):
+        """Adds a (height, width, channels) uint8 image, with 3 or 4 channels"""
+        data = np.asarray(data, dtype=np.uint8)
+        assert data.ndim == 3 and data.shape[2] in (3, 4), "Images must be RGB or RGBA."
+        assert max(data.shape[:2]) + 2 * self.padding <= self.pageSize, \
+            "The image " + str(name) + " does not fit in a page."
+
+        if data.shape[2] == 3:
+            data = np.concatenate([data, np.full(data.shape[:2] + (1,), 255, dtype=np.uint8)], axis=2)
+        self.images[name] = data
+
+    def addFile(self, filename, name=None):
+        """Adds an image file, named after its path unless other name is given"""
+        data, _ = tx.loadImage(filename)
+        self.addImage(filename if name is None else name, data)
+
+    def build(self):
+        """Packs the images into pages, tallest first, opening a page only when the others are full"""
+        padding = self.padding
+        order = sorted(self.images.keys(), key=lambda name: (-self.images[name].shape[0], -self.images[name].shape[1], str(name)))
+
+        packers = []
+        self.pages = []
+        self.regions = {}
+        for name in order:
+            image = self.images[name]
+            height, width = image.shape[:2]
+            paddedWidth, paddedHeight = width + 2 * padding, height + 2 * padding
+
+            position = None
+            for page, packer in enumerate(packers):
+                position = packer.insert(paddedWidth, paddedHeight)
+                if position is not None:
+                    break
+
+            if position is None:
+                packers.append(SkylinePacker(self.pageSize, self.pageSize))
+                self.pages.append(np.zeros((self.pageSize, self.pageSize, 4), dtype=np.uint8))
+                page = len(packers) - 1
+                position = packers[page].insert(paddedWidth, paddedHeight)
+
+            x, y = position
+            self.pages[page][y:y + paddedHeight, x:x + paddedWidth] = \
+                np.pad(image, ((padding, padding), (padding, padding), (0, 0)), mode="edge")
+            self.regions[name] = AtlasRegion(page, x + padding, y + padding, width, height, self.pageSize, self.pageSize)
+
+        return self
+
+    def upload(self, minFilterMode=GL_LINEAR, maxFilterMode=GL_LINEAR, mipmaps=None, textureManager=None):
+        """
+        Uploads the pages as textures, clamping at the edges, returning the list of them.
+        Mipmaps are generated when the minification filter needs them, unless told otherwise.
+        Pages are added to the texture manager (the default one if None), referenced by the atlas
+        until release, so GPUShape.clear gives back the references of shapes instead of deleting them.
+        """
+        if mipmaps is None:
+            mipmaps = minFilterMode in tx.MIPMAP_FILTERS
+        self.textureManager = textureManager if textureManager is not None else tx.defaultManager()
+
+        self.textures = []
+        for i, page in enumerate(self.pages):
+            texture = tx.uploadTexture(page, GL_RGBA, GL_CLAMP_TO_EDGE, GL_CLAMP_TO_EDGE,
+                minFilterMode, maxFilterMode, mipmaps)
+            height, width, channels = page.shape
+            self.textureManager.add(("atlas", id(self), i), texture, tx.textureBytes(width, height, channels, mipmaps))
+            self.textures.append(texture)
+        return self.textures
+
+    def acquireTexture(self, name):
+        """Texture of the page holding an image, adding a reference for the shape using it"""
+        texture = self.textures[self.regions[name].page]
+        self.textureManager.retain(texture)
+        return texture
+
+    def release(self):
+        """Gives back the references of the atlas, pages are deleted once no shape uses them"""
+        for texture in self.textures:
+            self.textureManager.release(texture)
+        self.textures = []
+
+    def remapShape(self, shape, name, stride=5, texCoordOffset=3):
+        """
+        Copy of a shape whose texture coordinates refer to the image inside the atlas.
+        Defaults fit createTextureQuad and other builders with positions and texture coordinates.
+        Coordinates must be in [0, 1], an image can not be repeated inside an atlas.
+        """
+        vertices = np.array(shape.vertices, dtype=np.float64).reshape((-1, stride))
+        texCoords = vertices[:, texCoordOffset:texCoordOffset + 2]
+        assert np.all((texCoords >= 0) & (texCoords <= 1)), \
+            "Texture coordinates out of [0, 1] repeat the image, which is not possible in an atlas."
+
+        vertices[:, texCoordOffset:texCoordOffset + 2] = self.regions[name].mapTexCoords(texCoords)
+
+        # The vertices keep the container of the original, so bs.merge still works on lists
+        if isinstance(shape.vertices, list):
+            return bs.Shape(vertices.reshape(-1).tolist(), list(shape.indices))
+        return bs.Shape(vertices.reshape(-1), np.array(shape.indices))
@@ -0,0 +1,410 @@
+# coding=utf-8
+"""
+Block compression of textures, BC1 (DXT1) for RGB images and BC3 (DXT5) for RGBA ones.
+
+Images are split in 4x4 pixel blocks, all of them encoded at once with numpy: colors are
+fitted along the principal axis of each block and refined by least squares, then stored as
+two RGB565 endpoints and 2 bits per pixel. BC3 adds two alpha endpoints and 3 bits per pixel.
+A BC1 texture uses 1/6 of the memory of the RGB one on the GPU (padded to RGBA, 1/8), BC3 1/4.
+
+Encoding takes a while, so compressed mipmap chains are stored in a cache next to the mesh
+cache, valid while the source image does not change, as mesh cache entries are.
+"""
+
+import hashlib
+import os
+import struct
+from OpenGL.GL import *
+from OpenGL.GL.EXT.texture_compression_s3tc import GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
+import numpy as np
+import grafica.mesh_cache as mc
+import grafica.textures as tx
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+BC1 = int(GL_COMPRESSED_RGB_S3TC_DXT1_EXT)
+BC3 = int(GL_COMPRESSED_RGBA_S3TC_DXT5_EXT)
+BLOCK_BYTES = {BC1: 8, BC3: 16}
+
+# Blocks encoded at once, bounding the memory of the temporary arrays
+CHUNK_BLOCKS = 1 << 14
+
+MAGIC = b"GRAFTEXC"
+VERSION = 1
+
+# magic, version, format, width, height, levels, source modification time (ns), source size, source hash
+_HEADER = struct.Struct("<8sIIIIIqQ32s")
+_SOURCE_TIME_OFFSET = struct.calcsize("<8sIIIII")
+_LEVEL = struct.Struct("<IIQ")
+
+# Weights of the first endpoint for each 2 bits color index, and each 3 bits alpha index
+_COLOR_WEIGHTS = np.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=np.float32)
+_ALPHA_WEIGHTS = np.array([1.0, 0.0, 6.0 / 7.0, 5.0 / 7.0, 4.0 / 7.0, 3.0 / 7.0, 2.0 / 7.0, 1.0 / 7.0], dtype=np.float32)
+
+
+class CompressedTexture:
+    """Block compressed mipmap chain, levels being (width, height, uint8 blocks), the largest first"""
+    def __init__(self, format, levels):
+        self.format = format
+        self.levels = levels
+
+    @property
+    def width(self):
+        return self.levels[0][0]
+
+    @property
+    def height(self):
+        return self.levels[0][1]
+
+    @property
+    def nbytes(self):
+        return sum(data.nbytes for _, _, data in self.levels)
+
+
+def _blocks(image):
+    """(N,16,channels) float32 pixels of the 4x4 blocks of an image, row by row, edges repeated to fill them"""
+    height, width, channels = image.shape
+    padded = np.pad(image, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    rows, columns = padded.shape[0] // 4, padded.shape[1] // 4
+    blocks = padded.reshape((rows, 4, columns, 4, channels)).transpose((0, 2, 1, 3, 4))
+    return blocks.reshape((rows * columns, 16, channels)).astype(np.float32)
+
+
+def _toRGB565(colors):
+    """Packed RGB565 of (N,3) colors in [0, 255], with the colors they decode to"""
+    quantized = np.rint(np.clip(colors, 0, 255) * (np.array([31, 63, 31]) / 255.0)).astype(np.uint32)
+    r, g, b = quantized[:, 0], quantized[:, 1], quantized[:, 2]
+    decoded = np.column_stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)]).astype(np.float32)
+    return (r << 11) | (g << 5) | b, decoded
+
+
+def _nearest(values, palette):
+    """Index of the nearest palette entry for every value, (N,16,channels) and (N,entries,channels)"""
+    distances = np.sum((values[:, :, None, :] - palette[:, None, :, :]) ** 2, axis=3)
+    return np.argmin(distances, axis=2)
+
+
+def _colorPalette(first, second):
+    weights = _COLOR_WEIGHTS[None, :, None]
+    return weights * first[:, None, :] + (1 - weights) * second[:, None, :]
+
+
+def _encodeColors(pixels):
+    """(N,2) uint32 words of the color part of the blocks: endpoints, then 2 bits per pixel"""
+    mean = np.mean(pixels, axis=1, keepdims=True)
+    centered = pixels - mean
+
+    # Principal axis of every block, by power iteration on the covariance
+    covariance = np.einsum("npi,npj->nij", centered, centered)
+    axis = np.ones((len(pixels), 3), dtype=np.float32)
+    for i in range(8):
+        axis = np.einsum("nij,nj->ni", covariance, axis)
+        axis /= np.maximum(np.max(np.abs(axis), axis=1, keepdims=True), 1e-12)
+
+    projections = np.einsum("npi,ni->np", centered, axis)
+    blockIndices = np.arange(len(pixels))
+    first = pixels[blockIndices, np.argmax(projections, axis=1)]
+    second = pixels[blockIndices, np.argmin(projections, axis=1)]
+
+    # A least squares step, the endpoints best reproducing the pixels with their current indices
+    _, firstDecoded = _toRGB565(first)
+    _, secondDecoded = _toRGB565(second)
+    weights = _COLOR_WEIGHTS[_nearest(pixels, _colorPalette(firstDecoded, secondDecoded))]
+    aa = np.sum(weights * weights, axis=1)
+    ab = np.sum(weights * (1 - weights), axis=1)
+    bb = np.sum((1 - weights) * (1 - weights), axis=1)
+    ax = np.einsum("np,npi->ni", weights, pixels)
+    bx = np.einsum("np,npi->ni", 1 - weights, pixels)
+    determinant = aa * bb - ab * ab
+    solvable = np.abs(determinant) > 1e-6
+    safe = np.where(solvable, determinant, 1.0)[:, None]
+    first = np.where(solvable[:, None], (bb[:, None] * ax - ab[:, None] * bx) / safe, first)
+    second = np.where(solvable[:, None], (aa[:, None] * bx - ab[:, None] * ax) / safe, second)
+
+    firstPacked, firstDecoded = _toRGB565(first)
+    secondPacked, secondDecoded = _toRGB565(second)
+
+    # The first endpoint must be the greater one, otherwise decoders use the 3 colors mode
+    swap = firstPacked < secondPacked
+    firstPacked, secondPacked = np.where(swap, secondPacked, firstPacked), np.where(swap, firstPacked, secondPacked)
+    firstDecoded, secondDecoded = np.where(swap[:, None], secondDecoded, firstDecoded), np.where(swap[:, None], firstDecoded, secondDecoded)
+
+    indices = _nearest(pixels, _colorPalette(firstDecoded, secondDecoded)).astype(np.uint32)
+    indices[firstPacked == secondPacked] = 0
+
+    words = np.empty((len(pixels), 2), dtype="<u4")
+    words[:, 0] = firstPacked | (secondPacked << 16)
+    words[:, 1] = np.bitwise_or.reduce(indices << (2 * np.arange(16, dtype=np.uint32)), axis=1)
+    return words
+
+
+def _encodeAlpha(alpha):
+    """(N,8) uint8 alpha part of BC3 blocks: endpoints, then 3 bits per pixel"""
+    first = np.max(alpha, axis=1)
+    second = np.min(alpha, axis=1)
+    palette = _ALPHA_WEIGHTS[None, :] * first[:, None] + (1 - _ALPHA_WEIGHTS[None, :]) * second[:, None]
+    indices = _nearest(alpha[:, :, None], palette[:, :, None]).astype(np.uint64)
+
+    bits = np.bitwise_or.reduce(indices << (3 * np.arange(16, dtype=np.uint64)), axis=1)
+    data = np.empty((len(alpha), 8), dtype=np.uint8)
+    data[:, 0] = first
+    data[:, 1] = second
+    data[:, 2:] = bits.astype("<u8").view(np.uint8).reshape((-1, 8))[:, :6]
+    return data
+
+
+def _compress(image, encode, blockBytes):
+    """Blocks of an image, encoded in chunks so temporary arrays stay small for big textures"""
+    pixels = _blocks(image)
+    data = np.empty((len(pixels), blockBytes), dtype=np.uint8)
+    for start in range(0, len(pixels), CHUNK_BLOCKS):
+        data[start:start + CHUNK_BLOCKS] = encode(pixels[start:start + CHUNK_BLOCKS])
+    return data.reshape(-1)
+
+
+def _encodeBC1(pixels):
+    return _encodeColors(pixels[:, :, :3]).view(np.uint8)
+
+
+def _encodeBC3(pixels):
+    return np.concatenate([_encodeAlpha(pixels[:, :, 3]), _encodeColors(pixels[:, :, :3]).view(np.uint8)], axis=1)
+
+
+def compressBC1(image):
+    """BC1 blocks, 8 bytes per 4x4 pixels, of a (height, width, channels) uint8 image. Alpha is ignored"""
+    return _compress(image[:, :, :3], _encodeBC1, BLOCK_BYTES[BC1])
+
+
+def compressBC3(image):
+    """BC3 blocks, 16 bytes per 4x4 pixels, of a (height, width, 4) uint8 image"""
+    assert image.shape[2] == 4, "BC3 needs an alpha channel."
+    return _compress(image, _encodeBC3, BLOCK_BYTES[BC3])
+
+
+def _decodeColors(words):
+    """(N,16,3) pixels of the (N,2) uint32 words of color blocks"""
+    endpoints = np.stack([words[:, 0] & 0xFFFF, words[:, 0] >> 16], axis=1)
+    r, g, b = endpoints >> 11, (endpoints >> 5) & 63, endpoints & 31
+    colors = np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=2).astype(np.float32)
+    palette = _colorPalette(colors[:, 0], colors[:, 1])
+    indices = (words[:, 1:2] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    return np.take_along_axis(palette, indices[:, :, None].astype(np.intp), axis=1)
+
+
+def _unblock(pixels, width, height):
+    rows, columns = (height + 3) // 4, (width + 3) // 4
+    channels = pixels.shape[2]
+    image = pixels.reshape((rows, columns, 4, 4, channels)).transpose((0, 2, 1, 3, 4))
+    image = image.reshape((rows * 4, columns * 4, channels))[:height, :width]
+    return np.clip(np.rint(image), 0, 255).astype(np.uint8)
+
+
+def decompressBC1(data, width, height):
+    """(height, width, 3) uint8 image of BC1 blocks, assuming the 4 colors mode this encoder uses"""
+    words = np.ascontiguousarray(data).view("<u4").reshape((-1, 2))
+    return _unblock(_decodeColors(words), width, height)
+
+
+def decompressBC3(data, width, height):
+    """(height, width, 4) uint8 image of BC3 blocks, assuming the 8 alphas mode this encoder uses"""
+    blocks = data.reshape((-1, 16))
+    colors = _decodeColors(np.ascontiguousarray(blocks[:, 8:]).view("<u4"))
+
+    first = blocks[:, 0].astype(np.float32)
+    second = blocks[:, 1].astype(np.float32)
+    palette = _ALPHA_WEIGHTS[None, :] * first[:, None] + (1 - _ALPHA_WEIGHTS[None, :]) * second[:, None]
+    bits = np.zeros((len(blocks), 8), dtype=np.uint8)
+    bits[:, :6] = blocks[:, 2:8]
+    indices = (bits.view("<u8") >> (3 * np.arange(16, dtype=np.uint64))) & 7
+    alpha = np.take_along_axis(palette, indices.astype(np.intp), axis=1)
+
+    return _unblock(np.concatenate([colors, alpha[:, :, None]], axis=2), width, height)
+
+
+def mipmapImages(image):
+    """The image and its mipmaps down to 1x1, each level averaging 2x2 pixels of the previous one"""
+    levels = [image]
+    level = image.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        height, width = level.shape[:2]
+        level = np.pad(level, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge")
+        level = level.reshape((level.shape[0] // 2, 2, level.shape[1] // 2, 2, -1)).mean(axis=(1, 3))
+
+        # Odd sizes round down, as OpenGL mipmap sizes do
+        level = level[:max(1, height // 2), :max(1, width // 2)]
+        levels.append(np.rint(level).astype(np.uint8))
+    return levels
+
+
+def compressImage(image, mipmaps=True):
+    """CompressedTexture of an image, BC3 if it has alpha, BC1 otherwise"""
+    format = BC3 if image.shape[2] == 4 else BC1
+    compress = compressBC3 if format == BC3 else compressBC1
+    images = mipmapImages(image) if mipmaps else [image]
+    return CompressedTexture(format, [(level.shape[1], level.shape[0], compress(level)) for level in images])
+
+
+def writeCompressed(filename, compressed, sourceTime=0, sourceSize=0, sourceHash=b""):
+    """Writes a compressed texture file with mc.atomicWrite, as mesh files are"""
+    header = _HEADER.pack(MAGIC, VERSION, compressed.format, compressed.width, compressed.height,
+        len(compressed.levels), sourceTime, sourceSize, sourceHash)
+
+    def write(file):
+        file.write(header)
+        for width, height, data in compressed.levels:
+            file.write(_LEVEL.pack(width, height, data.nbytes))
+        for _, _, data in compressed.levels:
+            file.write(data.data)
+
+    mc.atomicWrite(filename, write)
+
+
+def _readHeader(file):
+    data = file.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        return None
+    fields = _HEADER.unpack(data)
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        return None
+    return {
+        "format": fields[2],
+        "levels": fields[5],
+        "sourceTime": fields[6],
+        "sourceSize": fields[7],
+        "sourceHash": fields[8]
+    }
+
+
+def readCompressed(filename):
+    """CompressedTexture of a file, None if it is not a valid compressed texture file"""
+    try:
+        with open(filename, "rb") as file:
+            header = _readHeader(file)
+            if header is None:
+                return None
+            sizes = [_LEVEL.unpack(file.read(_LEVEL.size)) for i in range(header["levels"])]
+            buffer = file.read()
+    except (OSError, struct.error):
+        return None
+
+    levels = []
+    offset = 0
+    for width, height, size in sizes:
+        levels.append((width, height, np.frombuffer(buffer, dtype=np.uint8, count=size, offset=offset)))
+        offset += size
+    return CompressedTexture(header["format"], levels)
+
+
+def defaultCacheDirectory():
+    """GRAFICA_TEXTURE_CACHE, or a textures folder next to the default mesh cache"""
+    directory = os.environ.get("GRAFICA_TEXTURE_CACHE")
+    if directory is None:
+        directory = os.path.join(os.path.dirname(mc.defaultCacheDirectory()), "textures")
+    return directory
+
+
+class TextureCache:
+    """Compressed textures of image files, stored in a directory, one entry per file and variant"""
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else defaultCacheDirectory()
+        self.hits = 0
+        self.misses = 0
+
+    def entryPath(self, sourcePath, variant=""):
+        key = (os.path.abspath(sourcePath) + "\n" + variant).encode("utf-8")
+        return os.path.join(self.directory, hashlib.blake2b(key, digest_size=16).hexdigest() + ".texc")
+
+    def load(self, sourcePath, mipmaps=True):
+        """CompressedTexture of an image file, compressing it only if there is no valid entry"""
+        entryPath = self.entryPath(sourcePath, "mipmaps" if mipmaps else "")
+        try:
+            with open(entryPath, "rb") as file:
+                header = _readHeader(file)
+        except OSError:
+            header = None
+
+        if header is not None and mc.sourceMatches(entryPath, header, sourcePath, _SOURCE_TIME_OFFSET):
+            compressed = readCompressed(entryPath)
+            if compressed is not None:
+                self.hits += 1
+                return compressed
+
+        self.misses += 1
+        sourceTime, sourceSize = mc.sourceStatus(sourcePath)
+        sourceHash = mc.fileHash(sourcePath)
+        data, _ = tx.loadImage(sourcePath)
+        compressed = compressImage(data, mipmaps)
+
+        # The hash must describe the decoded bytes, sources modified meanwhile are not stored
+        if mc.sourceStatus(sourcePath) == (sourceTime, sourceSize):
+            os.makedirs(self.directory, exist_ok=True)
+            writeCompressed(entryPath, compressed, sourceTime, sourceSize, sourceHash)
+        return compressed
+
+    def clear(self):
+        """Removes all the compressed textures of the cache"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".texc"):
+                os.remove(os.path.join(self.directory, name))
+
+
+_defaultCache = None
+
+
+def defaultCache():
+    """TextureCache used when no other one is given"""
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = TextureCache()
+    return _defaultCache
+
+
+def loadCompressed(filename, mipmaps=True, cache=True):
+    """
+    CompressedTexture of an image file, through the default cache when cache is True,
+    the given TextureCache, or compressing it again if cache is None or False.
+    """
+    if cache is None or cache is False:
+        data, _ = tx.loadImage(filename)
+        return compressImage(data, mipmaps)
+    if cache is True:
+        cache = defaultCache()
+    return cache.load(filename, mipmaps)
+
+
+_supportsS3TC = None
+
+
+def supportsS3TC():
+    """True if the current context can sample S3TC (BC1-BC3) textures. Needs a context"""
+    global _supportsS3TC
+    if _supportsS3TC is None:
+        count = glGetIntegerv(GL_NUM_EXTENSIONS)
+        extensions = set(glGetStringi(GL_EXTENSIONS, i) for i in range(int(count)))
+        _supportsS3TC = b"GL_EXT_texture_compression_s3tc" in extensions
+    return _supportsS3TC
+
+
+def uploadCompressedTexture(compressed, sWrapMode, tWrapMode, minFilterMode, maxFilterMode):
+    """
+    New 2D texture with the levels of a CompressedTexture, as tx.uploadTexture does with images.
+    Mipmaps are not generated, the texture has the levels given. The texture is left bound.
+    """
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, sWrapMode)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, tWrapMode)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, minFilterMode)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, maxFilterMode)
+
+    # Without this, a texture missing the smallest levels would be incomplete
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(compressed.levels) - 1)
+
+    for level, (width, height, data) in enumerate(compressed.levels):
+        glCompressedTexImage2D(GL_TEXTURE_2D, level, compressed.format, width, height, 0, data.nbytes, data)
+
+    return texture
@@ -0,0 +1,272 @@
+# coding=utf-8
+"""
+Loading textures into GPU memory, and a manager sharing them among shapes.
+
+The TextureManager keeps a texture per image file and sampler parameters, so the same
+asset is decoded and uploaded once however many shapes use it. Textures are reference
+counted: the ones no longer referenced stay loaded, to be reused, until the estimated
+GPU memory exceeds a budget. Then the least recently used of them are deleted.
+With compression enabled, images are uploaded block compressed when the context supports it,
+see grafica.texture_compression.
+"""
+
+import collections
+import os.path
+from OpenGL.GL import *
+import numpy as np
+from PIL import Image
+import grafica.texture_compression as tc
+
+__author__ = "Daniel Calderon"
+__license__ = "MIT"
+
+MIPMAP_FILTERS = (GL_NEAREST_MIPMAP_NEAREST, GL_LINEAR_MIPMAP_NEAREST,
+    GL_NEAREST_MIPMAP_LINEAR, GL_LINEAR_MIPMAP_LINEAR)
+
+_FORMATS = {"RGB": GL_RGB, "RGBA": GL_RGBA}
+
+
+def loadImage(filename):
+    """Decodes an image file as a (height, width, channels) uint8 array, returning it with its GL format"""
+    image = Image.open(filename)
+    if image.mode not in _FORMATS:
+        print("Image mode not supported.")
+        raise Exception()
+
+    return np.array(image, np.uint8), _FORMATS[image.mode]
+
+
+def uploadTexture(data, format, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps=False):
+    """
+    New 2D texture with the (height, width, channels) pixels of an image.
+    The texture is left bound, as textureSimpleSetup does.
+    """
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+
+    # texture wrapping params
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, sWrapMode)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, tWrapMode)
+
+    # texture filtering params
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, minFilterMode)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, maxFilterMode)
+
+    height, width = data.shape[:2]
+    glTexImage2D(GL_TEXTURE_2D, 0, format, width, height, 0, format, GL_UNSIGNED_BYTE, data)
+
+    if mipmaps:
+        glGenerateMipmap(GL_TEXTURE_2D)
+
+    return texture
+
+
+def uploadTextureArray(images, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps=False):
+    """
+    New 2D array texture, a layer per (height, width, channels) image. All of them must have
+    the same size, RGB images are given an opaque alpha if mixed with RGBA ones.
+    Shaders read it with a sampler2DArray and (s, t, layer) coordinates. The texture is left bound.
+    """
+    assert len(images) > 0, "A texture array needs at least an image."
+    height, width = images[0].shape[:2]
+    assert all(image.shape[:2] == (height, width) for image in images), \
+        "All the layers of a texture array must have the same size."
+
+    channels = max(image.shape[2] for image in images)
+    layers = np.empty((len(images), height, width, channels), dtype=np.uint8)
+    for i, image in enumerate(images):
+        layers[i, :, :, :image.shape[2]] = image
+        if image.shape[2] < channels:
+            layers[i, :, :, 3] = 255
+    format = GL_RGBA if channels == 4 else GL_RGB
+
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, sWrapMode)
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, tWrapMode)
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, minFilterMode)
+    glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, maxFilterMode)
+
+    glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, format, width, height, len(images), 0, format, GL_UNSIGNED_BYTE, layers)
+
+    if mipmaps:
+        glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+
+    return texture
+
+
+def loadTextureArray(filenames, sWrapMode=GL_REPEAT, tWrapMode=GL_REPEAT,
+        minFilterMode=GL_LINEAR, maxFilterMode=GL_LINEAR, mipmaps=None):
+    """Texture array with an image file per layer, in the given order"""
+    if mipmaps is None:
+        mipmaps = minFilterMode in MIPMAP_FILTERS
+    images = [loadImage(filename)[0] for filename in filenames]
+    return uploadTextureArray(images, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+
+
+def textureBytes(width, height, channels, mipmaps):
+    """Estimated GPU memory of a texture, mipmaps adding a third of the base level"""
+    size = width * height * channels
+    return size * 4 // 3 if mipmaps else size
+
+
+class _TextureEntry:
+    def __init__(self, texture, size):
+        self.texture = texture
+        self.size = size
+        self.references = 0
+
+
+class TextureManager:
+    """
+    Textures keyed by (path, wrap modes, filters, mipmaps).
+    Budget is the GPU memory in bytes that textures without references may keep in use.
+    With compression, images are uploaded as BC1/BC3 with precomputed mipmaps when S3TC is supported.
+    """
+    def __init__(self, budget=256 * 1024 * 1024, compression=False):
+        self.budget = budget
+        self.compression = compression
+        self.entries = collections.OrderedDict()
+        self.keys = {}
+        self.usedBytes = 0
+
+        # Counters, to verify assets are loaded once
+        self.hits = 0
+        self.decodes = 0
+        self.uploads = 0
+        self.evictions = 0
+
+    def key(self, filename, sWrapMode=GL_REPEAT, tWrapMode=GL_REPEAT,
+            minFilterMode=GL_LINEAR, maxFilterMode=GL_LINEAR, mipmaps=None):
+        """Key of a texture, mipmaps being used when the minification filter needs them unless told otherwise"""
+        if mipmaps is None:
+            mipmaps = minFilterMode in MIPMAP_FILTERS
+        return (os.path.abspath(filename), int(sWrapMode), int(tWrapMode), int(minFilterMode), int(maxFilterMode), bool(mipmaps))
+
+    def contains(self, key):
+        return key in self.entries
+
+    def _load(self, key):
+        """Texture and its estimated size, for a key that is not loaded"""
+        filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps = key
+        if self.usesCompression():
+            compressed = tc.loadCompressed(filename, mipmaps)
+            self.decodes += 1
+            texture = tc.uploadCompressedTexture(compressed, sWrapMode, tWrapMode, minFilterMode, maxFilterMode)
+            self.uploads += 1
+            return texture, compressed.nbytes
+
+        data, format = loadImage(filename)
+        self.decodes += 1
+
+        texture = uploadTexture(data, format, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+        self.uploads += 1
+
+        height, width, channels = data.shape
+        return texture, textureBytes(width, height, channels, mipmaps)
+
+    def usesCompression(self):
+        """True if textures are compressed, which needs the current context to support S3TC"""
+        return self.compression and tc.supportsS3TC()
+
+    def _delete(self, texture):
+        glDeleteTextures(1, [texture])
+
+    def acquire(self, filename, sWrapMode=GL_REPEAT, tWrapMode=GL_REPEAT,
+            minFilterMode=GL_LINEAR, maxFilterMode=GL_LINEAR, mipmaps=None):
+        """
+        Texture of an image file with the given parameters, loading it only if needed.
+        Every call adds a reference, to be given back with release.
+        """
+        key = self.key(filename, sWrapMode, tWrapMode, minFilterMode, maxFilterMode, mipmaps)
+        if self.contains(key):
+            return self.acquireKey(key)
+
+        texture, size = self._load(key)
+        return self.add(key, texture, size)
+
+    def acquireKey(self, key):
+        """Adds a reference to a loaded texture given its key"""
+        entry = self.entries[key]
+        entry.references += 1
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.texture
+
+    def add(self, key, texture, size):
+        """Takes a texture uploaded elsewhere (e.g. by an AssetLoader), with a first reference"""
+        assert not self.contains(key), "The texture " + str(key) + " is already loaded."
+        entry = _TextureEntry(texture, size)
+        entry.references = 1
+        self.entries[key] = entry
+        self.keys[texture] = key
+        self.usedBytes += size
+        self._evict()
+        return texture
+
+    def retain(self, texture):
+        """Adds a reference to a texture of this manager, e.g. for another shape sharing it"""
+        self.entries[self.keys[texture]].references += 1
+
+    def release(self, texture):
+        """Gives back a reference, returning False if the texture does not belong to this manager"""
+        key = self.keys.get(texture)
+        if key is None:
+            return False
+
+        entry = self.entries[key]
+        assert entry.references > 0, "Texture " + str(texture) + " released more times than acquired."
+        entry.references -= 1
+        self._evict()
+        return True
+
+    def isManaged(self, texture):
+        return texture in self.keys
+
+    def _evict(self):
+        """Deletes unreferenced textures, least recently used first, while over the budget"""
+        if self.usedBytes <= self.budget:
+            return
+
+        for key in list(self.entries.keys()):
+            if self.usedBytes <= self.budget:
+                break
+
+            entry = self.entries[key]
+            if entry.references > 0:
+                continue
+
+            self._delete(entry.texture)
+            del self.entries[key]
+            del self.keys[entry.texture]
+            self.usedBytes -= entry.size
+            self.evictions += 1
+
+    def clear(self):
+        """Deletes all the textures, referenced or not"""
+        for entry in self.entries.values():
+            self._delete(entry.texture)
+        self.entries.clear()
+        self.keys.clear()
+        self.usedBytes = 0
+
+
+_defaultManager = None
+
+
+def defaultManager():
+    """TextureManager shared by the whole application"""
+    global _defaultManager
+    if _defaultManager is None:
+        _defaultManager = TextureManager()
+    return _defaultManager
+
+
+def releaseTexture(texture):
+    """
+    Gives back a reference of a texture of the default manager, or deletes the texture
+    if it is not managed. GPUShape.clear uses it.
+    """
+    if _defaultManager is None or not _defaultManager.release(texture):
+        glDeleteTextures(1, [texture])
@@ -1,16 +1,66 @@
 # coding=utf-8
-"""Transformation matrices for computer graphics"""
+"""Transformation matrices for computer graphics
 
+Constructors receiving scalars return a single 4x4 matrix.
+When any argument is an array (numpy array, list or tuple) of N values,
+they return a (N,4,4) stack with one matrix per value, so transforms of many
+objects are built with a single call. Arguments are broadcasted against each other.
+"""
+
+import threading
 import numpy as np
 
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
-def identity():
+_ARRAY_TYPES = (np.ndarray, list, tuple)
+_DIAGONAL = np.arange(4)
+_IDENTITY = np.identity(4, dtype=np.float32)
+
+# Intermediate product of matmul when writing into a single matrix, one per thread
+_local = threading.local()
+
+
+def _isBatch(*values):
+    for value in values:
+        if isinstance(value, _ARRAY_TYPES):
+            return True
+    return False
+
+
+def _scratch():
+    scratch = getattr(_local, "scratch", None)
+    if scratch is None:
+        scratch = _local.scratch = np.zeros((4, 4), dtype=np.float32)
+    return scratch
+
+
+def _asArrays(*values):
+    """Batch arguments as float32 arrays, so lists and tuples support arithmetic"""
+    return [np.asarray(value, dtype=np.float32) for value in values]
+
+
+def _identities(out, *values):
+    """Stack of identity matrices with the broadcasted shape of the values,
+    written into out when it is given"""
+    if out is None:
+        out = np.zeros(np.broadcast(*values).shape + (4, 4), dtype=np.float32)
+        out[..., _DIAGONAL, _DIAGONAL] = 1
+    else:
+        out[...] = _IDENTITY
+    return out
+
+
+def identity(out=None):
+    if out is not None:
+        return _identities(out)
     return np.identity(4, dtype=np.float32)
 
 
-def uniformScale(s):
+def uniformScale(s, out=None):
+    if out is not None or _isBatch(s):
+        return scale(s, s, s, out)
+
     return np.array([
         [s,0,0,0],
         [0,s,0,0],
@@ -18,7 +68,14 @@ def uniformScale(s):
         [0,0,0,1]], dtype = np.float32)
 
 
-def scale(sx, sy, sz):
+def scale(sx, sy, sz, out=None):
+    if out is not None or _isBatch(sx, sy, sz):
+        matrices = _identities(out, sx, sy, sz)
+        matrices[..., 0, 0] = sx
+        matrices[..., 1, 1] = sy
+        matrices[..., 2, 2] = sz
+        return matrices
+
     return np.array([
         [sx,0,0,0],
         [0,sy,0,0],
@@ -26,10 +83,18 @@ def scale(sx, sy, sz):
         [0,0,0,1]], dtype = np.float32)
 
 
-def rotationX(theta):
+def rotationX(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
+    if out is not None or _isBatch(theta):
+        matrices = _identities(out, theta)
+        matrices[..., 1, 1] = cos_theta
+        matrices[..., 1, 2] = -sin_theta
+        matrices[..., 2, 1] = sin_theta
+        matrices[..., 2, 2] = cos_theta
+        return matrices
+
     return np.array([
         [1,0,0,0],
         [0,cos_theta,-sin_theta,0],
@@ -37,10 +102,18 @@ def rotationX(theta):
         [0,0,0,1]], dtype = np.float32)
 
 
-def rotationY(theta):
+def rotationY(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
+    if out is not None or _isBatch(theta):
+        matrices = _identities(out, theta)
+        matrices[..., 0, 0] = cos_theta
+        matrices[..., 0, 2] = sin_theta
+        matrices[..., 2, 0] = -sin_theta
+        matrices[..., 2, 2] = cos_theta
+        return matrices
+
     return np.array([
         [cos_theta,0,sin_theta,0],
         [0,1,0,0],
@@ -48,10 +121,18 @@ def rotationY(theta):
         [0,0,0,1]], dtype = np.float32)
 
 
-def rotationZ(theta):
+def rotationZ(theta, out=None):
     sin_theta = np.sin(theta)
     cos_theta = np.cos(theta)
 
+    if out is not None or _isBatch(theta):
+        matrices = _identities(out, theta)
+        matrices[..., 0, 0] = cos_theta
+        matrices[..., 0, 1] = -sin_theta
+        matrices[..., 1, 0] = sin_theta
+        matrices[..., 1, 1] = cos_theta
+        return matrices
+
     return np.array([
         [cos_theta,-sin_theta,0,0],
         [sin_theta,cos_theta,0,0],
@@ -59,15 +140,30 @@ def rotationZ(theta):
         [0,0,0,1]], dtype = np.float32)
 
 
-def rotationA(theta, axis):
+def rotationA(theta, axis, out=None):
+    """Rotation around a normalized axis. For many rotations, axis may be a (N,3) array"""
     s = np.sin(theta)
     c = np.cos(theta)
 
-    assert axis.shape == (3,)
-
-    x = axis[0]
-    y = axis[1]
-    z = axis[2]
+    axis = np.asarray(axis)
+    assert axis.shape[-1] == 3
+
+    x = axis[..., 0]
+    y = axis[..., 1]
+    z = axis[..., 2]
+
+    if out is not None or _isBatch(theta) or axis.ndim > 1:
+        matrices = _identities(out, s, x)
+        matrices[..., 0, 0] = c + (1 - c) * x * x
+        matrices[..., 0, 1] = (1 - c) * x * y - s * z
+        matrices[..., 0, 2] = (1 - c) * x * z + s * y
+        matrices[..., 1, 0] = (1 - c) * x * y + s * z
+        matrices[..., 1, 1] = c + (1 - c) * y * y
+        matrices[..., 1, 2] = (1 - c) * y * z - s * x
+        matrices[..., 2, 0] = (1 - c) * x * z - s * y
+        matrices[..., 2, 1] = (1 - c) * y * z + s * x
+        matrices[..., 2, 2] = c + (1 - c) * z * z
+        return matrices
 
     return np.array([
         # First row
@@ -89,7 +185,14 @@ def rotationA(theta, axis):
         [0,0,0,1]], dtype = np.float32)
 
 
-def translate(tx, ty, tz):
+def translate(tx, ty, tz, out=None):
+    if out is not None or _isBatch(tx, ty, tz):
+        matrices = _identities(out, tx, ty, tz)
+        matrices[..., 0, 3] = tx
+        matrices[..., 1, 3] = ty
+        matrices[..., 2, 3] = tz
+        return matrices
+
     return np.array([
         [1,0,0,tx],
         [0,1,0,ty],
@@ -97,7 +200,17 @@ def translate(tx, ty, tz):
         [0,0,0,1]], dtype = np.float32)
 
 
-def shearing(xy, yx, xz, zx, yz, zy):
+def shearing(xy, yx, xz, zx, yz, zy, out=None):
+    if out is not None or _isBatch(xy, yx, xz, zx, yz, zy):
+        matrices = _identities(out, xy, yx, xz, zx, yz, zy)
+        matrices[..., 0, 1] = xy
+        matrices[..., 0, 2] = xz
+        matrices[..., 1, 0] = yx
+        matrices[..., 1, 2] = yz
+        matrices[..., 2, 0] = zx
+        matrices[..., 2, 1] = zy
+        return matrices
+
     return np.array([
         [ 1, xy, xz, 0],
         [yx,  1, yz, 0],
@@ -105,18 +218,54 @@ def shearing(xy, yx, xz, zx, yz, zy):
         [ 0,  0,  0, 1]], dtype = np.float32)
 
 
-def matmul(mats):
-    out = mats[0]
-    for i in range(1, len(mats)):
-        out = np.matmul(out, mats[i])
-
+def matmul(mats, out=None):
+    """Composes a list of transforms, each of them a 4x4 matrix or a (N,4,4) stack.
+    Stacks are multiplied element by element, broadcasting single matrices.
+    When out is given, every product is written into it, and it may be one of the inputs."""
+    if out is None:
+        out = mats[0]
+        for i in range(1, len(mats)):
+            out = np.matmul(out, mats[i])
+        return out
+
+    if len(mats) == 1:
+        out[...] = mats[0]
+        return out
+
+    # Products alternate between out and the scratch matrix, so the last one lands in out.
+    # Stacks are written into out directly, as numpy buffers overlapping operands.
+    # Later operands would be overwritten by the first products, so those sharing out are copied.
+    mats = [mats[0], mats[1]] + [mat.copy() if np.may_share_memory(mat, out) else mat for mat in mats[2:]]
+    scratch = _scratch() if out.shape == (4, 4) else out
+    target = out if len(mats) % 2 == 0 else scratch
+    np.matmul(mats[0], mats[1], out=target)
+    for i in range(2, len(mats)):
+        previous = target
+        target = scratch if target is out else out
+        np.matmul(previous, mats[i], out=target)
     return out
 
 
-def frustum(left, right, bottom, top, near, far):
+def frustum(left, right, bottom, top, near, far, out=None):
+    if _isBatch(left, right, bottom, top, near, far):
+        left, right, bottom, top, near, far = _asArrays(left, right, bottom, top, near, far)
+
     r_l = right - left
     t_b = top - bottom
     f_n = far - near
+
+    if out is not None or _isBatch(left, right, bottom, top, near, far):
+        matrices = _identities(out, left, right, bottom, top, near, far)
+        matrices[..., 0, 0] = 2 * near / r_l
+        matrices[..., 0, 2] = (right + left) / r_l
+        matrices[..., 1, 1] = 2 * near / t_b
+        matrices[..., 1, 2] = (top + bottom) / t_b
+        matrices[..., 2, 2] = -(far + near) / f_n
+        matrices[..., 2, 3] = -2 * near * far / f_n
+        matrices[..., 3, 2] = -1
+        matrices[..., 3, 3] = 0
+        return matrices
+
     return np.array([
         [ 2 * near / r_l,
         0,
@@ -136,16 +285,32 @@ def frustum(left, right, bottom, top, near, far):
         0]], dtype = np.float32)
 
 
-def perspective(fovy, aspect, near, far):
+def perspective(fovy, aspect, near, far, out=None):
+    if _isBatch(fovy, aspect, near, far):
+        fovy, aspect, near, far = _asArrays(fovy, aspect, near, far)
     halfHeight = np.tan(np.pi * fovy / 360) * near
     halfWidth = halfHeight * aspect
-    return frustum(-halfWidth, halfWidth, -halfHeight, halfHeight, near, far)
+    return frustum(-halfWidth, halfWidth, -halfHeight, halfHeight, near, far, out)
+
 
+def ortho(left, right, bottom, top, near, far, out=None):
+    if _isBatch(left, right, bottom, top, near, far):
+        left, right, bottom, top, near, far = _asArrays(left, right, bottom, top, near, far)
 
-def ortho(left, right, bottom, top, near, far):
     r_l = right - left
     t_b = top - bottom
     f_n = far - near
+
+    if out is not None or _isBatch(left, right, bottom, top, near, far):
+        matrices = _identities(out, left, right, bottom, top, near, far)
+        matrices[..., 0, 0] = 2 / r_l
+        matrices[..., 0, 3] = -(right + left) / r_l
+        matrices[..., 1, 1] = 2 / t_b
+        matrices[..., 1, 3] = -(top + bottom) / t_b
+        matrices[..., 2, 2] = -2 / f_n
+        matrices[..., 2, 3] = -(far + near) / f_n
+        return matrices
+
     return np.array([
         [ 2 / r_l,
         0,
@@ -165,7 +330,32 @@ def ortho(left, right, bottom, top, near, far):
         1]], dtype = np.float32)
 
 
-def lookAt(eye, at, up):
+def lookAt(eye, at, up, out=None):
+    """View matrix. For many cameras, eye, at and up may be (N,3) arrays"""
+
+    eye = np.asarray(eye)
+    at = np.asarray(at)
+    up = np.asarray(up)
+
+    if out is not None or eye.ndim > 1 or at.ndim > 1 or up.ndim > 1:
+        forward = at - eye
+        forward = forward / np.linalg.norm(forward, axis=-1, keepdims=True)
+
+        side = np.cross(forward, up)
+        side = side / np.linalg.norm(side, axis=-1, keepdims=True)
+
+        newUp = np.cross(side, forward)
+        newUp = newUp / np.linalg.norm(newUp, axis=-1, keepdims=True)
+
+        eye = np.broadcast_to(eye, forward.shape)
+        matrices = _identities(out, forward[..., 0])
+        matrices[..., 0, :3] = side
+        matrices[..., 1, :3] = newUp
+        matrices[..., 2, :3] = -forward
+        matrices[..., 0, 3] = -np.sum(side * eye, axis=-1)
+        matrices[..., 1, 3] = -np.sum(newUp * eye, axis=-1)
+        matrices[..., 2, 3] = np.sum(forward * eye, axis=-1)
+        return matrices
 
     forward = (at - eye)
     forward = forward / np.linalg.norm(forward)
@@ -182,3 +372,133 @@ def lookAt(eye, at, up):
             [-forward[0], -forward[1], -forward[2], np.dot(forward, eye)],
             [0,0,0,1]
         ], dtype = np.float32)
+
+
+def _perMatrix(value):
+    """Lets a value of every matrix in a stack multiply whole rows"""
+    if _isBatch(value):
+        return np.asarray(value)[..., np.newaxis]
+    return value
+
+
+def translateInPlace(matrix, tx, ty, tz):
+    """matrix = translate(tx, ty, tz) @ matrix, for an affine transform or stack of them"""
+    matrix[..., 0, 3] += tx
+    matrix[..., 1, 3] += ty
+    matrix[..., 2, 3] += tz
+    return matrix
+
+
+def scaleInPlace(matrix, sx, sy, sz):
+    """matrix = scale(sx, sy, sz) @ matrix, for a transform or stack of them"""
+    matrix[..., 0, :] *= _perMatrix(sx)
+    matrix[..., 1, :] *= _perMatrix(sy)
+    matrix[..., 2, :] *= _perMatrix(sz)
+    return matrix
+
+
+def _rotateInPlace(matrix, theta, i, j):
+    # Only rows i and j change: i' = c * i - s * j, j' = s * i + c * j
+    # The matrix is not reallocated, but the rows need temporaries of their size
+    s = _perMatrix(np.sin(theta))
+    c = _perMatrix(np.cos(theta))
+    rowI = matrix[..., i, :].copy()
+    matrix[..., i, :] *= c
+    matrix[..., i, :] -= s * matrix[..., j, :]
+    matrix[..., j, :] *= c
+    matrix[..., j, :] += s * rowI
+    return matrix
+
+
+def rotateXInPlace(matrix, theta):
+    """matrix = rotationX(theta) @ matrix, for a transform or stack of them"""
+    return _rotateInPlace(matrix, theta, 1, 2)
+
+
+def rotateYInPlace(matrix, theta):
+    """matrix = rotationY(theta) @ matrix, for a transform or stack of them"""
+    return _rotateInPlace(matrix, theta, 2, 0)
+
+
+def rotateZInPlace(matrix, theta):
+    """matrix = rotationZ(theta) @ matrix, for a transform or stack of them"""
+    return _rotateInPlace(matrix, theta, 0, 1)
+
+
+class MatrixPool:
+    """
+    Preallocated matrices to be used as out= arguments inside hot loops.
+    Matrices are handed out in order and all of them are available again after reset(),
+    usually called once per frame.
+    """
+    def __init__(self, size=64):
+        self.matrices = np.zeros((size, 4, 4), dtype=np.float32)
+        self.used = 0
+
+    def get(self, count=None):
+        """Returns a 4x4 matrix, or a (count,4,4) stack when count is given"""
+        size = 1 if count is None else count
+        assert self.used + size <= len(self.matrices), "The matrix pool is exhausted."
+
+        start = self.used
+        self.used += size
+        if count is None:
+            return self.matrices[start]
+        return self.matrices[start:self.used]
+
+    def reset(self):
+        self.used = 0
+
+
+def _cofactors(linear):
+    """Cofactor matrices and determinants of (...,3,3) matrices, computed with cross products of their rows"""
+    row0 = linear[..., 0, :]
+    row1 = linear[..., 1, :]
+    row2 = linear[..., 2, :]
+    cofactors = np.stack((
+        np.cross(row1, row2),
+        np.cross(row2, row0),
+        np.cross(row0, row1)), axis=-2)
+    determinants = np.sum(row0 * cofactors[..., 0, :], axis=-1)
+    return cofactors, determinants
+
+
+def affineInverse(matrices, out=None):
+    """
+    Inverse of an affine transform or (N,4,4) stack of them, those built from translations,
+    rotations, scales and shearing. The linear part is inverted in closed form and the
+    translation is undone with it: inverse([A t]) = [A^-1  -A^-1 t]
+    """
+    matrices = np.asarray(matrices)
+    cofactors, determinants = _cofactors(matrices[..., :3, :3])
+    inverseLinear = np.swapaxes(cofactors, -1, -2) / determinants[..., np.newaxis, np.newaxis]
+    # Computed before writing, out may be the input
+    translation = -np.matmul(inverseLinear, matrices[..., :3, 3, np.newaxis])[..., 0]
+
+    out = _identities(out, determinants)
+    out[..., :3, :3] = inverseLinear
+    out[..., :3, 3] = translation
+    return out
+
+
+def rigidInverse(matrices, out=None):
+    """Inverse of transforms with only rotations and translations, where the inverse rotation is the transpose"""
+    matrices = np.asarray(matrices)
+    # Copied before writing, out may be the input
+    inverseLinear = np.swapaxes(matrices[..., :3, :3], -1, -2).copy()
+    translation = -np.matmul(inverseLinear, matrices[..., :3, 3, np.newaxis])[..., 0]
+
+    out = _identities(out, matrices[..., 0, 0])
+    out[..., :3, :3] = inverseLinear
+    out[..., :3, 3] = translation
+    return out
+
+
+def normalMatrix(matrices, out=None):
+    """
+    3x3 matrices transforming normals of the affine transforms: the transpose of the
+    inverse of the linear part, equal to its cofactor matrix divided by its determinant.
+    """
+    matrices = np.asarray(matrices)
+    cofactors, determinants = _cofactors(matrices[..., :3, :3])
+    return np.divide(cofactors, determinants[..., np.newaxis, np.newaxis], out=out)
@@ -1,6 +1,8 @@
 # coding=utf-8
 """Face based data structure for a triangle mesh"""
 
+import numpy as np
+
 __author__ = "Daniel Calderon"
 __license__ = "MIT"
 
@@ -107,6 +109,107 @@ class TriangleFaceMeshBuilder:
     def getTriangleFaceMeshes(self):
         return self.triangleMeshes
 
-        
 
-        
+def triangleArray(triangles):
+    """(F,3) int64 array of vertex indices, from such array or a list of Triangle"""
+    if len(triangles) > 0 and isinstance(triangles[0], Triangle):
+        triangles = [[triangle.a, triangle.b, triangle.c] for triangle in triangles]
+    return np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+
+
+def computeNeighbours(triangles):
+    """
+    Returns a (F,3) array with the face adjacent to every side ab, bc and ca of every
+    triangle, or -1 when there is none.
+    Each side is an edge with a key packing its sorted vertex indices. Sorting the keys
+    puts the sides sharing an edge next to each other, and they are paired in order,
+    as TriangleFaceMeshBuilder does when an edge is shared by more than 2 triangles.
+    """
+    triangles = triangleArray(triangles)
+    F = len(triangles)
+    neighbours = np.full((F, 3), -1, dtype=np.int64)
+    if F == 0:
+        return neighbours
+
+    # Sides in the order faces and sides are inserted: a->b, b->c, c->a of each face
+    tails = triangles.reshape(-1)
+    heads = triangles[:, [1, 2, 0]].reshape(-1)
+    V = int(triangles.max()) + 1
+    keys = np.minimum(tails, heads) * V + np.maximum(tails, heads)
+
+    order = np.argsort(keys, kind="stable")
+    sortedKeys = keys[order]
+
+    # Position of every side within its run of equal keys
+    runStarts = np.ones(len(sortedKeys), dtype=bool)
+    runStarts[1:] = sortedKeys[1:] != sortedKeys[:-1]
+    starts = np.maximum.accumulate(np.where(runStarts, np.arange(len(sortedKeys)), 0))
+    positions = np.arange(len(sortedKeys)) - starts
+
+    # Sides at even positions pair with the following one, if it shares the edge
+    first = np.flatnonzero((positions[:-1] % 2 == 0) & ~runStarts[1:])
+    sidesA = order[first]
+    sidesB = order[first + 1]
+
+    flat = neighbours.reshape(-1)
+    flat[sidesA] = sidesB // 3
+    flat[sidesB] = sidesA // 3
+    return neighbours
+
+
+class TriangleFaceMeshArrays:
+    """
+    Triangle mesh stored as arrays: triangles (F,3) with vertex indices and neighbours (F,3)
+    with the face across sides ab, bc and ca, or -1.
+    getTriangleFaceMeshes gives TriangleFaceMesh views over them, so code navigating
+    the meshes of TriangleFaceMeshBuilder works with them too.
+    """
+    def __init__(self, triangles):
+        self.triangles = triangleArray(triangles)
+        self.neighbours = computeNeighbours(self.triangles)
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def getTriangleFaceMesh(self, index):
+        return TriangleFaceMeshView(self, index)
+
+    def getTriangleFaceMeshes(self):
+        return [TriangleFaceMeshView(self, index) for index in range(len(self.triangles))]
+
+
+class TriangleFaceMeshView(TriangleFaceMesh):
+    """A TriangleFaceMesh reading its data and neighbours from TriangleFaceMeshArrays"""
+    def __init__(self, mesh, index):
+        self.mesh = mesh
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, TriangleFaceMeshView) and \
+            self.mesh is other.mesh and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.mesh), self.index))
+
+    def _neighbour(self, side):
+        neighbour = self.mesh.neighbours[self.index, side]
+        if neighbour < 0:
+            return None
+        return TriangleFaceMeshView(self.mesh, int(neighbour))
+
+    @property
+    def data(self):
+        a, b, c = self.mesh.triangles[self.index]
+        return Triangle(int(a), int(b), int(c))
+
+    @property
+    def ab(self):
+        return self._neighbour(0)
+
+    @property
+    def bc(self):
+        return self._neighbour(1)
+
+    @property
+    def ca(self):
+        return self._neighbour(2)